@@ -0,0 +1,253 @@
+#
+# Copyright 2017 Chef Software
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""A local stand-in for the parts of the okta API that okta_aws uses, and a
+stub for STS, so that okta_aws can be run end to end without network
+access."""
+import base64
+import collections
+import datetime
+import json
+import os
+import re
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        os.pardir, 'tests', 'data')
+
+SESSION_TOKEN = '1234567890ABCDEFGHIJKLMNO'
+SESSION_ID = 'benchmarksessionid'
+APP_PATH = '/home/amazon_aws/'
+
+
+def read_data(filename):
+    with open(os.path.join(DATA_DIR, filename)) as fh:
+        return fh.read()
+
+
+def account_id(index):
+    """Returns the (fake) AWS account ID for the index'th account"""
+    return "%012d" % (100000000000 + index)
+
+
+def account_label(index):
+    """Returns the okta application name for the index'th account"""
+    return "Benchmark Account %03d AWS" % index
+
+
+class FakeOkta(object):
+    """Serves the okta API endpoints used by okta_aws on a local port:
+    authn, sessions, the user's appLinks (paginated the same way okta does)
+    and a SAML form page for each application. Counts the requests made to
+    each endpoint so benchmarks can check what was fetched.
+
+    accounts  - how many AWS applications are assigned to the user
+    page_size - the most appLinks returned in a single page, whatever limit
+                the client asks for
+    latency   - how long (in seconds) to wait before answering each request
+    """
+    def __init__(self, accounts=10, page_size=200, latency=0.0):
+        self.accounts = accounts
+        self.page_size = page_size
+        self.latency = latency
+        self.requests = collections.Counter()
+        self._lock = threading.Lock()
+        self._page = read_data('saml_assertion_page.html')
+        self._assertion = read_data('saml_assertion_decoded.txt')
+        self._httpd = None
+        self._thread = None
+
+    @property
+    def url(self):
+        return "http://%s:%d" % self._httpd.server_address[:2]
+
+    def start(self):
+        fake = self
+
+        class Handler(FakeOktaRequestHandler):
+            okta = fake
+
+        self._httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self._httpd.serve_forever,
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def count(self, endpoint):
+        with self._lock:
+            self.requests[endpoint] += 1
+
+    def reset_counts(self):
+        with self._lock:
+            self.requests.clear()
+
+    def applinks(self, after, limit):
+        """Returns one page of appLinks starting after the given index, and
+        the index to continue from (or None if this is the last page)."""
+        end = min(after + min(limit, self.page_size), self.accounts)
+        links = [{
+            'appName': 'amazon_aws',
+            'label': account_label(i),
+            'linkUrl': "%s%sapp%d/sso/saml" % (self.url, APP_PATH, i),
+        } for i in range(after, end)]
+        return links, (end if end < self.accounts else None)
+
+    def saml_page(self, index):
+        """Returns the SAML form page okta serves for the index'th account,
+        containing an assertion that is valid for the next five minutes."""
+        not_on_or_after = (
+            datetime.datetime.now(datetime.timezone.utc) +
+            datetime.timedelta(minutes=5)).strftime('%Y-%m-%dT%H:%M:%S.000Z')
+        assertion = self._assertion.replace(
+            '012345678901', account_id(index))
+        assertion = re.sub(r'NotOnOrAfter="[^"]*"',
+                           'NotOnOrAfter="%s"' % not_on_or_after, assertion)
+        encoded = base64.b64encode(assertion.encode()).decode()
+        return re.sub(r'(name="SAMLResponse" type="hidden" value=")[^"]*',
+                      r'\g<1>' + encoded, self._page)
+
+
+class FakeOktaRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately, so don't let delayed ACKs
+    # add to every response time.
+    disable_nagle_algorithm = True
+    okta = None
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+    def send_body(self, status, body, content_type='application/json',
+                  headers=None):
+        if not isinstance(body, str):
+            body = json.dumps(body)
+        data = body.encode()
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length)
+
+    def logged_in(self):
+        return ("sid=%s" % SESSION_ID) in (self.headers.get('Cookie') or '')
+
+    @staticmethod
+    def session():
+        expires_at = datetime.datetime.now(datetime.timezone.utc) + \
+            datetime.timedelta(hours=2)
+        return {'id': SESSION_ID,
+                'expiresAt': expires_at.strftime('%Y-%m-%dT%H:%M:%S.000Z')}
+
+    def handle_request(self, method):
+        if method == 'POST':
+            self.read_body()
+        url = urllib.parse.urlsplit(self.path)
+        if self.okta.latency:
+            time.sleep(self.okta.latency)
+
+        if method == 'POST' and url.path == '/api/v1/authn':
+            self.okta.count('authn')
+            body = json.loads(read_data('okta_auth_success.json'))
+            body['sessionToken'] = SESSION_TOKEN
+            return self.send_body(200, body)
+        if method == 'POST' and url.path == '/api/v1/sessions':
+            self.okta.count('sessions')
+            return self.send_body(200, self.session())
+        if method == 'GET' and url.path == '/api/v1/sessions/me':
+            self.okta.count('sessions/me')
+            if not self.logged_in():
+                return self.send_body(404, {'errorCode': 'E0000007'})
+            return self.send_body(200, self.session())
+        if method == 'POST' and \
+                url.path == '/api/v1/sessions/me/lifecycle/refresh':
+            self.okta.count('refresh')
+            if not self.logged_in():
+                return self.send_body(404, {'errorCode': 'E0000007'})
+            return self.send_body(200, self.session())
+        if method == 'GET' and url.path == '/api/v1/users/me/appLinks':
+            self.okta.count('appLinks')
+            if not self.logged_in():
+                return self.send_body(403, {'errorCode': 'E0000006'})
+            query = urllib.parse.parse_qs(url.query)
+            after = int(query.get('after', ['0'])[0])
+            limit = int(query.get('limit', ['20'])[0])
+            links, next_after = self.okta.applinks(after, limit)
+            headers = {}
+            if next_after is not None:
+                headers['Link'] = \
+                    '<%s/api/v1/users/me/appLinks?limit=%d&after=%d>; ' \
+                    'rel="next"' % (self.okta.url, limit, next_after)
+            return self.send_body(200, links, headers=headers)
+        match = re.match(re.escape(APP_PATH) + r'app(\d+)/', url.path)
+        if method == 'POST' and match:
+            self.okta.count('saml')
+            if not self.logged_in():
+                return self.send_body(403, 'Forbidden', 'text/plain')
+            return self.send_body(200, self.okta.saml_page(
+                int(match.group(1))), 'text/html')
+        return self.send_body(404, {'errorCode': 'E0000022'})
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        self.handle_request('GET')
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        self.handle_request('POST')
+
+
+class FakeSTSClient(object):
+    """Stands in for a botocore STS client, handing out made up credentials
+    from assume_role_with_saml after waiting for latency seconds."""
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def assume_role_with_saml(self, RoleArn, PrincipalArn, SAMLAssertion,
+                              DurationSeconds):
+        # pylint: disable=invalid-name,unused-argument
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.calls += 1
+            serial = self.calls
+        return {
+            'Credentials': {
+                'AccessKeyId': 'ASIABENCHMARK%07d' % serial,
+                'SecretAccessKey': 'benchmark-secret-%d' % serial,
+                'SessionToken': 'benchmark-token-%d' % serial,
+                'Expiration': datetime.datetime.now(datetime.timezone.utc) +
+                datetime.timedelta(seconds=DurationSeconds),
+            },
+        }
@@ -0,0 +1,225 @@
+#
+# Copyright 2017 Chef Software
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Runs okta_aws end to end against benchmarks.fake_okta and reports how long
+each run took, and how that time was split between the phases of fetching
+credentials.
+
+Each benchmark is run in three modes:
+
+cold  - nothing is cached and there is no okta session, so we have to log in
+warm  - straight after a cold run, so everything that can be cached is
+force - straight after a warm run, with --force. The okta session is reused,
+        but everything else is fetched again.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from unittest import mock
+
+from okta_aws import okta_aws
+
+from benchmarks import fake_okta
+
+MODES = ('cold', 'warm', 'force')
+COMMANDS = ('single', 'all')
+
+# The phases reported by okta_aws.metrics that are shown in the results
+PHASES = ('authn', 'sessions', 'session refresh', 'applinks', 'saml',
+          'parse', 'sts', 'store')
+
+
+class Workspace(object):
+    """A temporary home for the config file, okta session cookie, caches and
+    AWS credentials file used by a series of runs."""
+    def __init__(self, okta_url):
+        self._tmpdir = tempfile.TemporaryDirectory(prefix='okta_aws_bench')
+        self.path = self._tmpdir.name
+        self.config_file = os.path.join(self.path, 'okta_aws.toml')
+        self.credentials_file = os.path.join(self.path, 'credentials')
+        with open(self.config_file, 'w') as fh:
+            fh.write('[general]\n'
+                     'username = "benchmark"\n'
+                     'okta_server = "%s"\n'
+                     'cookie_file = "%s"\n'
+                     'cache_dir = "%s"\n' % (
+                         okta_url,
+                         os.path.join(self.path, 'cookie'),
+                         os.path.join(self.path, 'cache')))
+
+    def cleanup(self):
+        self._tmpdir.cleanup()
+
+
+def run_okta_aws(workspace, args):
+    """Runs okta_aws with the given command line arguments, returning how
+    long it took in seconds and a dictionary of the time spent in each
+    phase."""
+    argv = ['--quiet', '--config', workspace.config_file] + args
+    oa = okta_aws.OktaAWS(argv)
+    output = io.StringIO()
+    status = 0
+    start = time.perf_counter()
+    with mock.patch.dict(os.environ, {
+            'AWS_SHARED_CREDENTIALS_FILE': workspace.credentials_file}), \
+            mock.patch('getpass.getpass', return_value='password'), \
+            mock.patch('okta_aws.config.CACHE_FILE', os.path.join(
+                workspace.path, 'cache', 'config.json')), \
+            contextlib.redirect_stdout(output):
+        try:
+            oa.run()
+        except SystemExit as e:
+            status = e.code or 0
+    elapsed = time.perf_counter() - start
+    if status != 0:
+        raise RuntimeError("okta_aws %s exited with status %s\n%s" % (
+            ' '.join(argv), status, output.getvalue()))
+    return elapsed, {name: stats.seconds
+                     for name, stats in oa.metrics.phases.items()}
+
+
+def benchmark(accounts, command, repeat=3, jobs=4, page_size=200,
+              okta_latency=0.0, sts_latency=0.0):
+    """Runs a benchmark in each of the modes, returning a list of results
+    (one per mode). Each result is a dictionary containing the median
+    elapsed time and the median time spent in each phase, along with the
+    number of requests made to each okta endpoint and to STS in the last
+    run.
+
+    accounts     - how many AWS accounts are assigned to the user
+    command      - 'single' to fetch credentials for one profile, or 'all'
+                   to fetch them for every account with --all
+    repeat       - how many times to run each mode
+    jobs         - how many accounts to fetch at once with --all
+    page_size    - how many accounts okta returns in each page of appLinks
+    okta_latency - how long okta takes to answer each request, in seconds
+    sts_latency  - how long STS takes to answer each request, in seconds
+    """
+    if command == 'all':
+        args = ['--all', '--jobs', str(jobs)]
+    else:
+        args = [okta_aws.OktaAWS([]).shorten_appname(
+            fake_okta.account_label(0))]
+    samples = {mode: [] for mode in MODES}
+    counts = {}
+    sts_client = fake_okta.FakeSTSClient(sts_latency)
+    with fake_okta.FakeOkta(accounts, page_size, okta_latency) as okta, \
+            mock.patch('okta_aws.sts.get_client', return_value=sts_client):
+        for _ in range(repeat):
+            workspace = Workspace(okta.url)
+            try:
+                for mode in MODES:
+                    okta.reset_counts()
+                    sts_client.calls = 0
+                    extra = ['--force'] if mode == 'force' else []
+                    samples[mode].append(
+                        run_okta_aws(workspace, args + extra))
+                    counts[mode] = dict(okta.requests, sts=sts_client.calls)
+            finally:
+                workspace.cleanup()
+
+    results = []
+    for mode in MODES:
+        results.append({
+            'command': command,
+            'accounts': accounts,
+            'mode': mode,
+            'seconds': statistics.median(s[0] for s in samples[mode]),
+            'phases': {
+                phase: statistics.median(s[1].get(phase, 0.0)
+                                         for s in samples[mode])
+                for phase in PHASES
+            },
+            'requests': counts[mode],
+        })
+    return results
+
+
+def format_results(results):
+    """Formats benchmark results as a table, with times in milliseconds"""
+    headings = ['command', 'accounts', 'mode', 'total'] + \
+        list(PHASES) + ['requests']
+    rows = [headings]
+    for r in results:
+        rows.append(
+            [r['command'], str(r['accounts']), r['mode'],
+             "%.1f" % (r['seconds'] * 1000)] +
+            ["%.1f" % (r['phases'][phase] * 1000) for phase in PHASES] +
+            [' '.join("%s=%d" % (k, v)
+                      for k, v in sorted(r['requests'].items()) if v)])
+    widths = [max(len(row[i]) for row in rows)
+              for i in range(len(headings) - 1)]
+    lines = []
+    for row in rows:
+        cells = [cell.rjust(width) if row is not headings and i > 2
+                 else cell.ljust(width)
+                 for i, (cell, width) in enumerate(zip(row, widths))]
+        lines.append('  '.join(cells + [row[-1]]))
+    return '\n'.join(lines)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks',
+        description='Time okta_aws end to end against a local fake okta '
+        'server and STS. Times are in milliseconds.')
+    parser.add_argument('--accounts', type=int, nargs='+',
+                        default=[1, 10, 100],
+                        help='Numbers of assigned AWS accounts to try')
+    parser.add_argument('--commands', nargs='+', choices=COMMANDS,
+                        default=list(COMMANDS),
+                        help='Fetch credentials for a single profile, '
+                        'for all profiles with --all, or both')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Number of times to run each benchmark. The '
+                        'median time is reported.')
+    parser.add_argument('--jobs', '-j', type=int, default=4,
+                        help='Number of accounts to fetch at once with --all')
+    parser.add_argument('--page-size', type=int, default=200,
+                        help='Number of applications okta returns in each '
+                        'page of results')
+    parser.add_argument('--okta-latency', type=float, default=20,
+                        help='Milliseconds okta takes to answer a request')
+    parser.add_argument('--sts-latency', type=float, default=50,
+                        help='Milliseconds STS takes to answer a request')
+    parser.add_argument('--json', metavar='FILE',
+                        help='Also write the results to FILE as JSON')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = []
+    for command in args.commands:
+        for accounts in args.accounts:
+            results.extend(benchmark(
+                accounts, command, repeat=args.repeat, jobs=args.jobs,
+                page_size=args.page_size,
+                okta_latency=args.okta_latency / 1000.0,
+                sts_latency=args.sts_latency / 1000.0))
+    print(format_results(results))
+    if args.json:
+        with open(args.json, 'w') as fh:
+            json.dump(results, fh, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,119 @@
+#
+# Copyright 2017 Chef Software
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Micro-benchmark comparing okta_aws.saml with the way SAML assertions used
+to be handled: a regular expression over the whole page to find the
+assertion, then building a tree for the whole assertion to find the roles,
+and again to find NotOnOrAfter. Run it with
+`python -m benchmarks.saml_parsing`."""
+import argparse
+import base64
+import html
+import re
+import sys
+import timeit
+import xml.etree.ElementTree as ET
+
+from okta_aws import cache, saml
+
+from benchmarks import fake_okta
+
+
+def make_assertion(roles):
+    """Returns the test SAML assertion, base64 encoded, with the given number
+    of roles in it."""
+    assertion = fake_okta.read_data('saml_assertion_decoded.txt')
+    value = re.search(r'<saml2:AttributeValue[^>]*>arn:aws:iam::[^<]*'
+                      r'</saml2:AttributeValue>', assertion).group(0)
+    values = [value.replace('012345678901', fake_okta.account_id(i))
+              for i in range(roles)]
+    assertion = assertion.replace(value, '\n'.join(values))
+    return base64.b64encode(assertion.encode()).decode()
+
+
+def make_page(assertion, padding=0):
+    """Returns the SAML form page for an assertion, with padding bytes of
+    extra markup before and after the form."""
+    page = fake_okta.read_data('saml_assertion_page.html')
+    filler = '<div class="filler">%s</div>\n' % ('x' * 80)
+    extra = filler * (padding // len(filler))
+    page = page.replace('<body id="app" class="enduser-app  ">',
+                        '<body id="app" class="enduser-app  ">' + extra)
+    page = page.replace('</form>', '</form>' + extra)
+    return page.replace('VGVzdGluZyAxLi4uMi4uLjMuLi4K', assertion)
+
+
+def old_form_value(page):
+    match = re.search(r'<input name="SAMLResponse".*value="([^"]*)"', page)
+    return html.unescape(match.group(1))
+
+
+def old_parse(assertion):
+    parsed = ET.fromstring(base64.b64decode(assertion))
+    elems = parsed.findall(
+        ".//{urn:oasis:names:tc:SAML:2.0:assertion}Attribute["
+        "@Name='https://aws.amazon.com/SAML/Attributes/Role']//*")
+    roles = [e.text.split(",", 1) for e in elems]
+    parsed = ET.fromstring(base64.b64decode(assertion))
+    times = [e.get('NotOnOrAfter') for e in parsed.iter()
+             if e.get('NotOnOrAfter') is not None]
+    return roles, min(times, key=cache.parse_timestamp)
+
+
+def new_parse(assertion):
+    # Bypass the cache, to time the parsing itself
+    info = saml.parse_assertion.__wrapped__(assertion)
+    return info.roles, info.not_on_or_after
+
+
+def best_time(func, *args, number=20, repeat=5):
+    """Returns the fastest time for a single call to func, in seconds"""
+    return min(timeit.repeat(lambda: func(*args), number=number,
+                             repeat=repeat)) / number
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks.saml_parsing',
+        description='Compare the time taken to extract roles from SAML '
+        'assertions with the previous implementation. Times are in '
+        'microseconds.')
+    parser.add_argument('--roles', type=int, nargs='+',
+                        default=[1, 10, 100, 1000],
+                        help='Numbers of roles in the assertion to try')
+    parser.add_argument('--padding', type=int, default=100000,
+                        help='Bytes of extra HTML around the SAML form')
+    args = parser.parse_args(argv)
+
+    print("%6s  %10s  %10s  %10s  %10s" % (
+        'roles', 'old page', 'new page', 'old parse', 'new parse'))
+    for roles in args.roles:
+        assertion = make_assertion(roles)
+        page = make_page(assertion, args.padding)
+        assert old_form_value(page) == saml.form_value(page, 'SAMLResponse')
+        old_roles, old_expiry = old_parse(assertion)
+        new_roles, new_expiry = new_parse(assertion)
+        assert [tuple(r) for r in old_roles] == list(new_roles)
+        assert old_expiry == new_expiry
+        print("%6d  %10.1f  %10.1f  %10.1f  %10.1f" % (
+            roles,
+            best_time(old_form_value, page) * 1e6,
+            best_time(saml.form_value, page, 'SAMLResponse') * 1e6,
+            best_time(old_parse, assertion) * 1e6,
+            best_time(new_parse, assertion) * 1e6))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
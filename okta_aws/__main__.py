@@ -15,7 +15,10 @@
 # limitations under the License.
 """The main entry point for the program."""
 
-from okta_aws import okta_aws
+import logging
+import sys
+
+from okta_aws import exceptions, okta_aws
 
 
 def main(args=None):
@@ -24,6 +27,9 @@ def main(args=None):
         okta_aws.OktaAWS(args).run()
     except KeyboardInterrupt:
         print("Exiting...")
+    except exceptions.Error as e:
+        logging.error(e)
+        sys.exit(1)
 
 
 if __name__ == "__main__":
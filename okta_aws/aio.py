@@ -0,0 +1,188 @@
+#
+# Copyright 2017 Chef Software
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""An asyncio interface to OktaAWS, for programs that need to fetch
+credentials without blocking their event loop.
+
+The okta and STS calls are made by the same code the command line tool
+uses, on a pool of worker threads, so every step can be awaited and
+independent steps (checking the okta session while the cached application
+list loads, or the SAML and STS calls for many accounts) run at the same
+time. For example:
+
+    oa = OktaAWS(['--quiet'])
+    oa.config = oa.load_config('~/.okta_aws.toml')
+    creds = await AsyncOktaAWS(oa).fetch_credentials('mycompany-dev')
+"""
+
+import asyncio
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from okta_aws import exceptions
+
+DEFAULT_CONCURRENCY = 8
+
+
+def run_sync(coro):
+    """Runs a coroutine from synchronous code and returns its result.
+
+    coro - the coroutine to run, e.g. AsyncOktaAWS(oa).fetch_credentials()
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    coro.close()
+    raise RuntimeError("run_sync can't be used inside a running event loop; "
+                       "await the coroutine instead")
+
+
+class AsyncOktaAWS(object):
+    """Awaitable versions of the OktaAWS steps needed to fetch credentials.
+
+    oa          - the OktaAWS instance to use, with its config loaded
+    concurrency - the maximum number of accounts to fetch credentials for at
+                  once, and the number of worker threads to use
+    """
+    def __init__(self, oa, concurrency=DEFAULT_CONCURRENCY):
+        self.oa = oa
+        self.concurrency = max(concurrency, 1)
+        # Make sure the HTTP connection pool is big enough for every worker
+        oa.args.jobs = max(oa.args.jobs, self.concurrency)
+        self.executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        self._session_id = None
+        self._applinks = None
+        self._prepare_lock = None
+
+    async def _call(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor, functools.partial(func, *args, **kwargs))
+
+    async def prepare(self, profile=None):
+        """Makes sure we have a valid okta session and the list of assigned
+        applications, returning (session_id, applinks). The session check and
+        loading the cached application list happen at the same time.
+
+        profile - a profile that needs to be in the application list, if any
+        """
+        loop = asyncio.get_running_loop()
+        if self._prepare_lock is None or self._prepare_lock[0] is not loop:
+            # Created here so that it belongs to the running event loop
+            self._prepare_lock = (loop, asyncio.Lock())
+        async with self._prepare_lock[1]:
+            if self._session_id is None:
+                self._session_id, self._applinks = await asyncio.gather(
+                    self._call(self.oa.get_okta_session),
+                    self._call(self.oa.load_cached_applinks))
+            real_profile = profile and self.oa.chain_root(profile)
+            if self._applinks is None or (profile is not None and
+                                          real_profile not in self._applinks):
+                try:
+                    self._applinks = await self._call(
+                        self.oa.get_applinks, self._session_id, profile)
+                except exceptions.SessionError:
+                    if not self.oa.saved_session:
+                        raise
+                    self._session_id = await self._call(
+                        self.oa.renew_session, self._session_id)
+                    self._applinks = await self._call(
+                        self.oa.get_applinks, self._session_id, profile)
+        return self._session_id, self._applinks
+
+    async def renew_session(self, session_id):
+        """Called when okta rejects session_id. Renews the session if it
+        was saved by an earlier run (see OktaAWS.renew_session), returning
+        the session ID to use, or None if it can't be renewed. Only one
+        renewal happens at a time, and a session that has already been
+        replaced is never renewed again.
+
+        session_id - the okta session ID that was rejected
+        """
+        async with self._prepare_lock[1]:
+            if self._session_id != session_id:
+                return self._session_id
+            if not self.oa.saved_session:
+                return None
+            self._session_id = await self._call(self.oa.renew_session,
+                                                session_id)
+            return self._session_id
+
+    async def fetch_credentials(self, profile=None, store=True):
+        """Fetches credentials for a single profile, returning them as
+        returned by AWS. Raises an exceptions.Error subclass on failure.
+
+        profile - the profile to fetch credentials for (defaults to the
+                  profile the OktaAWS instance was created with)
+        store   - whether to store the credentials in ~/.aws/credentials
+        """
+        profile = profile or self.oa.profile
+        session_id, applinks = await self.prepare(profile)
+        try:
+            return await self._call(self.oa.fetch_credentials, applinks,
+                                    session_id, profile, store=store)
+        except exceptions.SessionError:
+            session_id = await self.renew_session(session_id)
+            if session_id is None:
+                raise
+            return await self._call(self.oa.fetch_credentials, applinks,
+                                    session_id, profile, store=store)
+
+    async def fetch_all_credentials(self, profiles=None, store=True):
+        """Fetches credentials for several profiles at once, returning a
+        dictionary mapping each profile to its credentials, or to the
+        exception raised while fetching them. A failure for one profile
+        doesn't affect the others. Credentials are stored with a single write
+        to ~/.aws/credentials.
+
+        profiles - the profiles to fetch credentials for (defaults to every
+                   assigned profile)
+        store    - whether to store the credentials in ~/.aws/credentials
+        """
+        session_id, applinks = await self.prepare()
+        if profiles is None:
+            profiles = list(applinks.keys())
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def fetch_one(profile, session_id):
+            async with semaphore:
+                try:
+                    return await self._call(
+                        self.oa.fetch_credentials, applinks, session_id,
+                        profile, store=False)
+                except Exception as e:  # pylint: disable=broad-except
+                    logging.error("%s: %s", profile, e)
+                    return e
+
+        results = dict(zip(profiles, await asyncio.gather(
+            *[fetch_one(p, session_id) for p in profiles])))
+        rejected = [p for p, e in results.items()
+                    if isinstance(e, exceptions.SessionError)]
+        if rejected:
+            session_id = await self.renew_session(session_id)
+            if session_id is not None:
+                results.update(zip(rejected, await asyncio.gather(
+                    *[fetch_one(p, session_id) for p in rejected])))
+        fetched = {p: c for p, c in results.items()
+                   if not isinstance(c, Exception)}
+        if store and fetched:
+            await self._call(self.oa.store_aws_creds_in_profiles, fetched)
+        return results
+
+    def close(self):
+        """Shuts down the worker threads"""
+        self.executor.shutdown(wait=False)
+
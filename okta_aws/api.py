@@ -0,0 +1,157 @@
+#
+# Copyright 2017 Chef Software
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Functions for using okta_aws from other Python programs.
+
+These never prompt for input, print anything or exit. Problems are reported
+by raising an okta_aws.exceptions.Error subclass; in particular,
+exceptions.LoginError is raised if there is no valid okta session (run the
+okta_aws command once to log in). For example:
+
+    from okta_aws.api import get_credentials
+
+    creds = get_credentials('mycompany-dev')
+    session = boto3.Session(**creds.boto3_kwargs())
+"""
+
+import datetime
+from dataclasses import dataclass
+
+from okta_aws import aio, cache, exceptions, okta_aws
+
+DEFAULT_CONFIG_FILE = '~/.okta_aws.toml'
+
+
+@dataclass(frozen=True, repr=False)
+class Credentials(object):
+    """A set of temporary AWS credentials"""
+    __slots__ = ('profile', 'access_key_id', 'secret_access_key',
+                 'session_token', 'expiration')
+    profile: str
+    access_key_id: str
+    secret_access_key: str
+    session_token: str
+    expiration: datetime.datetime
+
+    @classmethod
+    def from_aws(cls, profile, aws_creds):
+        """Creates Credentials from the dictionary returned by AWS
+
+        profile   - the profile the credentials are for
+        aws_creds - the credentials returned by AWS
+        """
+        return cls(profile, aws_creds['AccessKeyId'],
+                   aws_creds['SecretAccessKey'], aws_creds['SessionToken'],
+                   cache.parse_timestamp(aws_creds['Expiration']))
+
+    def __repr__(self):
+        # Don't include the secrets
+        return "Credentials(profile=%r, access_key_id=%r, expiration=%r)" % (
+            self.profile, self.access_key_id, self.expiration.isoformat())
+
+    @property
+    def seconds_remaining(self):
+        """How many seconds the credentials are still valid for"""
+        return cache.seconds_until(self.expiration)
+
+    def boto3_kwargs(self):
+        """Returns keyword arguments for boto3.Session() or boto3.client()
+        that use these credentials"""
+        return {
+            'aws_access_key_id': self.access_key_id,
+            'aws_secret_access_key': self.secret_access_key,
+            'aws_session_token': self.session_token,
+        }
+
+
+def client(profile=None, role=None, config_file=DEFAULT_CONFIG_FILE,
+           force=False):
+    """Returns a non-interactive OktaAWS instance with its configuration
+    loaded.
+
+    profile     - the default profile to fetch credentials for
+    role        - the role name or ARN to assume, if more than one is
+                  available and role_arn isn't configured
+    config_file - the okta_aws configuration file to use
+    force       - don't reuse cached credentials
+    """
+    argv = ['--quiet', '--config', config_file]
+    if role is not None:
+        argv += ['--role_arn', role]
+    if force:
+        argv.append('--force')
+    if profile is not None:
+        argv.append(profile)
+    oa = okta_aws.OktaAWS(argv)
+    oa.interactive = False
+    oa.config = oa.load_config(config_file)
+    return oa
+
+
+def get_credentials(profile, role=None, config_file=DEFAULT_CONFIG_FILE,
+                    store=False, force=False):
+    """Returns Credentials for a single profile. Valid cached credentials
+    are returned without contacting okta or AWS.
+
+    profile     - the profile to fetch credentials for
+    role        - the role name or ARN to assume, if more than one is
+                  available and role_arn isn't configured
+    config_file - the okta_aws configuration file to use
+    store       - also store the credentials in ~/.aws/credentials
+    force       - don't reuse cached credentials
+    """
+    oa = client(profile, role, config_file, force)
+    aws_creds = oa.get_cached_credentials(profile, check_file=store)
+    if aws_creds is None:
+        aws_creds = oa.with_okta_session(
+            lambda session_id: oa.fetch_credentials(
+                oa.get_applinks(session_id, profile), session_id, profile,
+                store=store))
+    return Credentials.from_aws(profile, aws_creds)
+
+
+def get_all_credentials(profiles=None, concurrency=aio.DEFAULT_CONCURRENCY,
+                        role=None, config_file=DEFAULT_CONFIG_FILE,
+                        store=False, force=False):
+    """Returns a dictionary mapping profile names to Credentials for several
+    profiles, fetching up to `concurrency` of them at once. If any profile
+    fails, exceptions.BatchError is raised; the credentials that were
+    fetched are available in its `credentials` attribute.
+
+    profiles    - the profiles to fetch credentials for (defaults to every
+                  assigned profile)
+    concurrency - the maximum number of profiles to fetch at once
+    role        - the role name or ARN to assume, if more than one is
+                  available and role_arn isn't configured
+    config_file - the okta_aws configuration file to use
+    store       - also store the credentials in ~/.aws/credentials
+    force       - don't reuse cached credentials
+    """
+    engine = client(None, role, config_file, force).aio(concurrency)
+    try:
+        results = aio.run_sync(engine.fetch_all_credentials(profiles, store))
+    finally:
+        engine.close()
+    credentials = {}
+    errors = {}
+    for profile, result in results.items():
+        if isinstance(result, Exception):
+            errors[profile] = result
+        else:
+            credentials[profile] = Credentials.from_aws(profile, result)
+    if errors:
+        raise exceptions.BatchError(
+            "Unable to fetch credentials for %s" % ', '.join(sorted(errors)),
+            credentials, errors)
+    return credentials
@@ -0,0 +1,278 @@
+#
+# Copyright 2017 Chef Software
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Small on-disk caches used to avoid repeating calls to okta and AWS."""
+
+import collections
+import datetime
+import json
+import logging
+import os
+import threading
+import time
+
+from okta_aws.fileutil import atomic_write, file_lock
+from okta_aws.store import FileStore
+
+
+def parse_timestamp(value):
+    """Converts an ISO 8601 timestamp (as returned by okta and AWS) to a
+    timezone aware datetime. Datetime objects are returned unchanged.
+
+    value - the timestamp to convert
+    """
+    if isinstance(value, datetime.datetime):
+        return value
+    if value.endswith('Z'):
+        value = value[:-1] + '+00:00'
+    parsed = datetime.datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+    return parsed
+
+
+def open_store(store):
+    """Returns store, or a FileStore if store is the path of a file"""
+    if isinstance(store, str):
+        return FileStore(store)
+    return store
+
+
+def seconds_until(value):
+    """Returns the number of seconds from now until the given timestamp.
+    This will be negative if the timestamp is in the past.
+
+    value - an ISO 8601 timestamp or a datetime
+    """
+    now = datetime.datetime.now(datetime.timezone.utc)
+    return (parse_timestamp(value) - now).total_seconds()
+
+
+class JSONFileCache(object):
+    """A dictionary stored as a JSON file. Every update is a locked,
+    atomic read-modify-write so that several okta_aws processes can share
+    the same cache file. The file is only readable by the current user.
+
+    path - the file to store the cache in
+    """
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        """Returns the whole contents of the cache as a dictionary"""
+        try:
+            with open(self.path) as fh:
+                return json.load(fh)
+        except FileNotFoundError:
+            return {}
+        except ValueError:
+            logging.debug("Ignoring corrupt cache file %s", self.path)
+            return {}
+
+    def get(self, key, default=None):
+        """Returns a single value from the cache"""
+        return self.load().get(key, default)
+
+    def update(self, entries):
+        """Stores several values in the cache at once
+
+        entries - a dictionary of keys and values to store
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), mode=0o700,
+                    exist_ok=True)
+        with file_lock(self.path):
+            data = self.load()
+            data.update(entries)
+            atomic_write(self.path, json.dumps(data, sort_keys=True),
+                         mode=0o600)
+
+    def set(self, key, value):
+        """Stores a single value in the cache"""
+        self.update({key: value})
+
+    def delete(self, key):
+        """Removes a value from the cache, if it is present"""
+        with file_lock(self.path):
+            data = self.load()
+            if data.pop(key, None) is not None:
+                atomic_write(self.path, json.dumps(data, sort_keys=True),
+                             mode=0o600)
+
+
+class CredentialCache(object):
+    """Remembers the temporary credentials obtained for each profile, along
+    with when they expire, so that okta and AWS don't need to be contacted
+    again while they are still valid.
+
+    Entries are keyed on the profile, the requested role and the requested
+    session duration, so that changing any of these fetches new credentials.
+    They are dropped from the store when the credentials expire.
+
+    store - the store.Store to keep cached credentials in, or the path of a
+            file to keep them in
+    """
+    def __init__(self, store):
+        self.store = open_store(store)
+
+    @staticmethod
+    def key(profile, role_arn, duration):
+        """Returns the cache key for a set of credentials"""
+        return "%s|%s|%s" % (profile, role_arn or '', duration)
+
+    def get(self, profile, role_arn, duration, min_lifetime=0):
+        """Returns cached credentials, or None if there are no cached
+        credentials or they expire in less than min_lifetime seconds.
+
+        profile      - the profile the credentials were stored in
+        role_arn     - the role (name or ARN) that was requested, if any
+        duration     - the session duration that was requested
+        min_lifetime - how long, in seconds, the credentials must still be
+                       valid for
+        """
+        creds = self.store.get(self.key(profile, role_arn, duration))
+        if creds is None:
+            return None
+        try:
+            remaining = seconds_until(creds['Expiration'])
+        except (KeyError, TypeError, ValueError):
+            return None
+        if remaining < min_lifetime:
+            return None
+        return creds
+
+    def put(self, profile, role_arn, duration, creds):
+        """Stores credentials returned by AWS in the cache
+
+        profile  - the profile the credentials were stored in
+        role_arn - the role (name or ARN) that was requested, if any
+        duration - the session duration that was requested
+        creds    - the credentials returned by AWS
+        """
+        creds = dict(creds)
+        if isinstance(creds.get('Expiration'), datetime.datetime):
+            creds['Expiration'] = creds['Expiration'].isoformat()
+        try:
+            ttl = seconds_until(creds['Expiration'])
+        except (KeyError, TypeError, ValueError):
+            ttl = None
+        self.store.set(self.key(profile, role_arn, duration), creds, ttl)
+
+
+class RoleDurationCache(object):
+    """Remembers the longest session duration AWS allowed for each role, as
+    learned from requests that were rejected for asking for too long. Entries
+    are forgotten after ttl seconds, in case the role is changed to allow
+    longer sessions.
+
+    path - the file to store the durations in
+    ttl  - how many seconds to remember a duration for
+    """
+    def __init__(self, path, ttl=7 * 86400):
+        self.store = JSONFileCache(path)
+        self.ttl = ttl
+
+    def get(self, role_arn):
+        """Returns the longest duration known to work for role_arn, or None
+        if nothing has been learned about the role.
+
+        role_arn - the ARN of the role
+        """
+        entry = self.store.get(role_arn)
+        if entry is None or time.time() - entry['learned_at'] > self.ttl:
+            return None
+        return entry['max_duration']
+
+    def put(self, role_arn, duration):
+        """Records the longest duration to ask for when assuming a role
+
+        role_arn - the ARN of the role
+        duration - the duration in seconds
+        """
+        self.store.set(role_arn, {'max_duration': duration,
+                                  'learned_at': time.time()})
+
+
+class AssertionCache(object):
+    """Remembers SAML assertions for each okta application until their
+    NotOnOrAfter time, both in memory and in a store. A single assertion
+    lists every role available in an account, so it can be reused to assume
+    several roles, or to assume a role again shortly afterwards.
+
+    store        - the store.Store to keep cached assertions in, the path of
+                   a file to keep them in, or None to only cache them in
+                   memory
+    min_lifetime - assertions expiring within this many seconds aren't used
+    read_store   - whether to use assertions stored by earlier runs
+    """
+    def __init__(self, store=None, min_lifetime=30, read_store=True):
+        self.store = open_store(store) if store else None
+        self.min_lifetime = min_lifetime
+        self.read_store = read_store
+        self._memory = {}
+        self._locks = collections.defaultdict(threading.Lock)
+        self._locks_lock = threading.Lock()
+
+    def _valid(self, entry):
+        try:
+            return seconds_until(entry['expires']) >= self.min_lifetime
+        except (KeyError, TypeError, ValueError):
+            return False
+
+    def get(self, key):
+        """Returns the cached assertion for key, or None if there isn't a
+        valid one"""
+        entry = self._memory.get(key)
+        if entry is None and self.store is not None and self.read_store:
+            entry = self.store.get(key)
+        if entry is None or not self._valid(entry):
+            return None
+        self._memory[key] = entry
+        return entry['assertion']
+
+    def put(self, key, assertion, expires):
+        """Stores an assertion in the cache
+
+        key       - the key to store the assertion under
+        assertion - the base64 encoded assertion
+        expires   - when the assertion expires (the NotOnOrAfter time), as an
+                    ISO 8601 timestamp
+        """
+        entry = {'assertion': assertion, 'expires': expires}
+        self._memory[key] = entry
+        if self.store is not None:
+            self.store.set(key, entry, seconds_until(expires))
+
+    def get_or_fetch(self, key, fetch):
+        """Returns the cached assertion for key, calling fetch to get a new
+        one if there isn't a valid one. Only one fetch for each key runs at
+        a time.
+
+        key   - the key the assertion is cached under
+        fetch - called with no arguments, returns an (assertion, expires)
+                tuple, or (None, None) if no assertion could be obtained.
+                If expires is None, the assertion isn't cached.
+        """
+        assertion = self.get(key)
+        if assertion is not None:
+            return assertion
+        with self._locks_lock:
+            lock = self._locks[key]
+        with lock:
+            assertion = self.get(key)
+            if assertion is not None:
+                return assertion
+            assertion, expires = fetch()
+            if assertion is not None and expires is not None:
+                self.put(key, assertion, expires)
+            return assertion
@@ -0,0 +1,311 @@
+#
+# Copyright 2017 Chef Software
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Loading and checking the okta_aws config file.
+
+The config file is checked and compiled once into a Config, which holds the
+settings for every profile with aliases resolved and defaults filled in, so
+looking up a setting is a single dictionary lookup. A Config can't be
+changed, so it can be shared between threads. The compiled settings are
+cached (see CACHE_FILE) along with the config file's modification time and
+size, so the TOML file is only parsed again when it changes.
+"""
+
+import logging
+import os
+import types
+from collections.abc import Mapping
+
+from okta_aws import cache, exceptions, store
+
+# Where compiled config files are cached. Each config file is cached under
+# its absolute path.
+CACHE_FILE = '~/.okta_aws_cache/config.json'
+# Changed whenever compiled configs from older versions can't be used
+CACHE_VERSION = 3
+
+# The settings okta_aws knows about, and the types of value each can have.
+# A string is a value the setting can have, such as 'auto', and list is a
+# list of strings.
+SETTINGS = {
+    'username': (str,),
+    'okta_server': (str,),
+    'cookie_file': (str,),
+    'cache_dir': (str,),
+    'cache_store': store.STORE_TYPES,
+    'short_profile_names': (bool,),
+    'session_duration': (int, 'auto'),
+    'refresh_threshold': (int,),
+    'refresh_margin': (int,),
+    'session_check_interval': (int,),
+    'session_refresh_threshold': (int,),
+    'serve_port': (int,),
+    'serve_token': (str,),
+    'applinks_ttl': (int,),
+    'applinks_page_size': (int,),
+    'connect_timeout': (int, float),
+    'read_timeout': (int, float),
+    'http_retries': (int,),
+    'factor_preference': (str, list),
+    'push_timeout': (int, float),
+    'metrics_file': (str,),
+    'daemon_profiles': (list,),
+    'role_arn': (str,),
+    'sts_region': (str, list),
+    'source_profile': (str,),
+    'external_id': (str,),
+    'role_session_name': (str,),
+}
+
+REQUIRED_SETTINGS = ('username', 'okta_server')
+
+# Sections of the config file that aren't profiles
+SPECIAL_SECTIONS = ('general', 'aliases', 'groups')
+
+DEFAULTS = {
+    'cookie_file': '~/.okta_aws_cookie',
+    'short_profile_names': True,
+    'session_duration': 'auto',
+    'cache_dir': '~/.okta_aws_cache',
+    'cache_store': 'file',
+    'refresh_threshold': 900,
+    'refresh_margin': 300,
+    'session_check_interval': 300,
+    'session_refresh_threshold': 900,
+    'serve_port': 9876,
+    'applinks_ttl': 86400,
+}
+
+TYPE_NAMES = {
+    str: 'a string',
+    int: 'a whole number',
+    float: 'a number',
+    bool: 'true or false',
+    list: 'a list of strings',
+}
+
+
+def _is_allowed(value, allowed):
+    if isinstance(allowed, str):
+        return value == allowed
+    if isinstance(value, bool):
+        # bool is a subclass of int, but true isn't a number of seconds
+        return allowed is bool
+    if allowed is list:
+        return isinstance(value, list) and \
+            all(isinstance(v, str) for v in value)
+    return isinstance(value, allowed)
+
+
+def check_setting(section, key, value):
+    """Raises exceptions.ConfigError if value isn't allowed for a setting.
+    Unknown settings are logged, in case they are typos, but allowed.
+
+    section - the section of the config file the setting is in
+    key     - the name of the setting
+    value   - the value of the setting
+    """
+    if key not in SETTINGS:
+        logging.warning("Unknown setting %s in [%s] in the config file",
+                        key, section)
+        return
+    allowed = SETTINGS[key]
+    if not any(_is_allowed(value, a) for a in allowed):
+        raise exceptions.ConfigError(
+            "%s in [%s] should be %s, not %r" % (
+                key, section, ' or '.join(
+                    '"%s"' % a if isinstance(a, str) else TYPE_NAMES[a]
+                    for a in allowed), value))
+
+
+def check_role_chains(sections):
+    """Checks that every profile with a source_profile (a role chain) also
+    has the ARN of the role to assume in role_arn, and that no chain leads
+    back to itself. Raises exceptions.ConfigError if not.
+
+    sections - the sections of the config file
+    """
+    aliases = sections.get('aliases', {})
+    for profile, settings in sections.items():
+        if profile in SPECIAL_SECTIONS or 'source_profile' not in settings:
+            continue
+        if not str(settings.get('role_arn', '')).startswith('arn:'):
+            raise exceptions.ConfigError(
+                "%s has a source_profile, so role_arn must be set to the ARN "
+                "of the role to assume" % profile)
+        chain = [profile]
+        source = settings['source_profile']
+        while source is not None:
+            source = aliases.get(source, source)
+            if source in chain:
+                raise exceptions.ConfigError(
+                    "The role chain for %s leads back to itself: %s" % (
+                        profile, ' -> '.join(chain + [source])))
+            chain.append(source)
+            source = sections.get(source, {}).get('source_profile')
+
+
+def check(raw):
+    """Checks the contents of a config file, returning its sections with
+    defaults filled in and paths expanded. Raises exceptions.ConfigError if
+    there is a problem.
+
+    raw - the parsed config file
+    """
+    sections = {'general': {}, 'aliases': {}, 'groups': {}}
+    for name, values in raw.items():
+        if not isinstance(values, dict):
+            raise exceptions.ConfigError(
+                "%s = %r in the config file should be in a section such as "
+                "[general]" % (name, values))
+        sections[name] = dict(values)
+
+    for name, values in sections['aliases'].items():
+        if not isinstance(values, str):
+            raise exceptions.ConfigError(
+                "Alias %s should be the name of a profile, not %r" % (
+                    name, values))
+    for name, values in sections['groups'].items():
+        if not _is_allowed(values, list):
+            raise exceptions.ConfigError(
+                "Group %s should be a list of profile names or patterns, "
+                "not %r" % (name, values))
+    for section, values in sections.items():
+        if section not in ('aliases', 'groups'):
+            for key, value in values.items():
+                check_setting(section, key, value)
+
+    general = sections['general']
+    missing_options = [k for k in REQUIRED_SETTINGS if k not in general]
+    if missing_options:
+        raise exceptions.ConfigError(
+            "Missing required configuration settings: %s" %
+            ', '.join(missing_options))
+    for key, value in DEFAULTS.items():
+        general.setdefault(key, value)
+    general['cookie_file'] = os.path.expanduser(general['cookie_file'])
+    general['cache_dir'] = os.path.expanduser(general['cache_dir'])
+
+    check_role_chains(sections)
+    return sections
+
+
+def _freeze(values):
+    return types.MappingProxyType({
+        k: tuple(v) if isinstance(v, list) else v
+        for k, v in values.items()})
+
+
+class Config(Mapping):
+    """The checked contents of a config file, which can't be changed. It
+    can be used like the dictionary of sections in the config file (e.g.
+    config['aliases']), and setting() looks up the value of a setting for a
+    profile.
+
+    sections - the sections of the config file, as returned by check()
+    """
+    def __init__(self, sections):
+        self._sections = {name: _freeze({}) for name in SPECIAL_SECTIONS}
+        self._sections.update((name, _freeze(values))
+                              for name, values in sections.items())
+        aliases = self._sections['aliases']
+        general = self._sections['general']
+        # The settings for every profile and alias, with the profile's
+        # settings taking precedence over the real profile's (for aliases),
+        # which take precedence over [general]
+        self._profiles = {}
+        for name in self._sections:
+            if name in SPECIAL_SECTIONS:
+                continue
+            settings = dict(general)
+            if name in aliases:
+                settings.update(self._sections.get(aliases[name], {}))
+            settings.update(self._sections[name])
+            self._profiles[name] = types.MappingProxyType(settings)
+        for alias, real_profile in aliases.items():
+            if alias not in self._profiles:
+                settings = dict(general)
+                settings.update(self._sections.get(real_profile, {}))
+                self._profiles[alias] = types.MappingProxyType(settings)
+
+    def __getitem__(self, name):
+        return self._sections[name]
+
+    def __iter__(self):
+        return iter(self._sections)
+
+    def __len__(self):
+        return len(self._sections)
+
+    def setting(self, key, default=None, profile=None):
+        """Returns the value of a setting for a profile, falling back to the
+        [general] section and then default.
+
+        key     - the setting to look up
+        default - the value to return if the setting isn't set anywhere
+        profile - the profile to look up the setting for
+        """
+        return self._profiles.get(profile, self._sections['general']).get(
+            key, default)
+
+    def sections(self):
+        """Returns the sections as plain dictionaries, e.g. for caching"""
+        return {name: {k: list(v) if isinstance(v, tuple) else v
+                       for k, v in values.items()}
+                for name, values in self._sections.items()}
+
+
+def load(path, cache_file=None):
+    """Loads, checks and compiles a config file, returning a Config. If the
+    file hasn't changed since it was last loaded, the cached compiled config
+    is used instead of parsing it again. Raises FileNotFoundError if the
+    file doesn't exist, or exceptions.ConfigError if there is a problem with
+    it.
+
+    path       - the config file to load
+    cache_file - where to cache compiled config files (defaults to
+                 CACHE_FILE)
+    """
+    path = os.path.abspath(os.path.expanduser(path))
+    stat = os.stat(path)
+    key = [CACHE_VERSION, stat.st_mtime_ns, stat.st_size]
+    compiled_cache = cache.JSONFileCache(
+        os.path.expanduser(cache_file or CACHE_FILE))
+    try:
+        entry = compiled_cache.get(path)
+    except OSError:
+        entry = None
+    if isinstance(entry, dict) and entry.get('key') == key:
+        logging.debug("Using compiled config for %s", path)
+        try:
+            return Config(entry['sections'])
+        except (AttributeError, KeyError, TypeError):
+            logging.debug("Ignoring invalid compiled config")
+
+    import toml
+
+    logging.debug("Loading config file %s", path)
+    try:
+        raw = toml.load(path)
+    except toml.TomlDecodeError as e:
+        raise exceptions.ConfigError(
+            "Error reading config file %s: %s" % (path, e))
+    config = Config(check(raw))
+    try:
+        compiled_cache.set(path, {'key': key, 'sections': config.sections()})
+    except (OSError, TypeError, ValueError) as e:
+        # Values such as dates can't be cached, and the cache directory may
+        # not be writable. Either way, the config file is parsed next time.
+        logging.debug("Couldn't cache compiled config: %s", e)
+    return config
@@ -0,0 +1,154 @@
+#
+# Copyright 2017 Chef Software
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Reads and updates the AWS shared credentials file (~/.aws/credentials)
+directly, instead of running 'aws configure set' once per setting.
+
+Only the keys being changed are touched. Other profiles, comments and
+formatting in the file are left as they are."""
+
+import os
+import re
+
+from okta_aws.fileutil import atomic_write, file_lock
+
+SECTION_RE = re.compile(r'^\s*\[([^\]]+)\]\s*$')
+KEY_RE = re.compile(r'^([^\s=#;][^=]*?)\s*=')
+
+
+def credentials_path():
+    """Returns the path to the AWS shared credentials file, honouring the
+    AWS_SHARED_CREDENTIALS_FILE environment variable like the AWS tools do.
+    """
+    return os.path.expanduser(
+        os.getenv('AWS_SHARED_CREDENTIALS_FILE', '~/.aws/credentials'))
+
+
+def parse_profiles(content):
+    """Returns a dictionary mapping profile names to a dictionary of their
+    settings.
+
+    content - the contents of a credentials file
+    """
+    profiles = {}
+    section = None
+    for line in content.splitlines():
+        m = SECTION_RE.match(line)
+        if m:
+            section = profiles.setdefault(m.group(1).strip(), {})
+            continue
+        m = KEY_RE.match(line)
+        if m and section is not None:
+            section[m.group(1).strip()] = line.split('=', 1)[1].strip()
+    return profiles
+
+
+def read_profiles(path=None):
+    """Reads a credentials file, returning a dictionary mapping profile names
+    to a dictionary of their settings. Returns an empty dictionary if the file
+    doesn't exist.
+
+    path - the credentials file to read (defaults to credentials_path())
+    """
+    try:
+        with open(path or credentials_path()) as fh:
+            return parse_profiles(fh.read())
+    except FileNotFoundError:
+        return {}
+
+
+def merge_profiles(content, updates):
+    """Returns content with the settings in updates applied to it. Settings
+    that already exist are changed in place, new settings are added to the end
+    of their profile, and new profiles are added to the end of the file.
+
+    content - the existing contents of the credentials file
+    updates - a dictionary mapping profile names to a dictionary of settings
+              to change in that profile
+    """
+    lines = content.splitlines()
+    out = []
+    pending = {}
+    handled = set()
+    section = None
+
+    def finish_section():
+        # Add any settings that weren't already present in the section,
+        # keeping trailing blank lines and comments (which usually belong to
+        # the next section) after them.
+        if section is None or not pending.get(section):
+            return
+        trailing = []
+        while out and (out[-1].strip() == '' or
+                       out[-1].lstrip().startswith(('#', ';'))):
+            trailing.insert(0, out.pop())
+        for key, value in pending.pop(section).items():
+            out.append('%s = %s' % (key, value))
+        out.extend(trailing)
+
+    skipping_continuation = False
+    for line in lines:
+        m = SECTION_RE.match(line)
+        if m:
+            finish_section()
+            section = m.group(1).strip()
+            if section in updates and section not in handled:
+                pending[section] = dict(updates[section])
+                handled.add(section)
+            out.append(line)
+            skipping_continuation = False
+            continue
+        if skipping_continuation:
+            # Drop continuation lines belonging to a value we replaced
+            if line[:1] in (' ', '\t') and line.strip():
+                continue
+            skipping_continuation = False
+        m = KEY_RE.match(line)
+        if m and section in pending and m.group(1).strip() in pending[section]:
+            key = m.group(1).strip()
+            out.append('%s = %s' % (key, pending[section].pop(key)))
+            skipping_continuation = True
+            continue
+        out.append(line)
+    finish_section()
+
+    for profile, settings in updates.items():
+        if profile in handled:
+            continue
+        if out and out[-1].strip() != '':
+            out.append('')
+        out.append('[%s]' % profile)
+        for key, value in settings.items():
+            out.append('%s = %s' % (key, value))
+    return '\n'.join(out) + '\n'
+
+
+def update_profiles(updates, path=None):
+    """Applies updates to the credentials file in a single locked, atomic
+    read-modify-write.
+
+    updates - a dictionary mapping profile names to a dictionary of settings
+              to change in that profile
+    path    - the credentials file to update (defaults to credentials_path())
+    """
+    path = path or credentials_path()
+    os.makedirs(os.path.dirname(os.path.abspath(path)), mode=0o700,
+                exist_ok=True)
+    with file_lock(path):
+        try:
+            with open(path) as fh:
+                content = fh.read()
+        except FileNotFoundError:
+            content = ''
+        atomic_write(path, merge_profiles(content, updates))
@@ -0,0 +1,114 @@
+#
+# Copyright 2017 Chef Software
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Scheduling for okta_aws --daemon, which keeps credentials for a set of
+profiles fresh by renewing them shortly before they expire."""
+
+import heapq
+import itertools
+import logging
+import time
+
+from okta_aws import exceptions
+
+# Sleep in short steps, so that we notice if the clock jumps forward (e.g.
+# after a laptop wakes up from sleep) and catch up straight away.
+MAX_SLEEP = 60
+
+
+class RefreshScheduler(object):
+    """Calls refresh for each profile a little before its credentials
+    expire, and keepalive at a regular interval, using a single heap of
+    next-run times.
+
+    refresh            - called with a profile name; must return the
+                         expiration time of the new credentials in seconds
+                         since the epoch
+    keepalive          - called with no arguments to keep the okta session
+                         alive, or None. It should raise
+                         exceptions.LoginError if the session can't be kept
+                         alive, which stops the scheduler.
+    margin             - how many seconds before expiry to refresh
+    keepalive_interval - how many seconds between calls to keepalive
+    retry_interval     - how many seconds to wait before trying again if
+                         refresh or keepalive fails
+    clock, sleep       - time functions, replaceable for testing
+    """
+    KEEPALIVE = object()
+
+    def __init__(self, refresh, keepalive=None, margin=300,
+                 keepalive_interval=300, retry_interval=60, clock=time.time,
+                 sleep=time.sleep):
+        self.refresh = refresh
+        self.keepalive = keepalive
+        self.margin = margin
+        self.keepalive_interval = keepalive_interval
+        self.retry_interval = retry_interval
+        self.clock = clock
+        self.sleep = sleep
+        self._heap = []
+        # Tie breaker so that the heap never compares the items themselves
+        self._counter = itertools.count()
+        if keepalive is not None:
+            self.schedule(self.KEEPALIVE, clock() + keepalive_interval)
+
+    def schedule(self, item, when):
+        """Schedules item (a profile name or KEEPALIVE) to run at when
+        (seconds since the epoch)"""
+        heapq.heappush(self._heap, (when, next(self._counter), item))
+
+    def next_run(self):
+        """Returns the time the next item is due to run, or None if nothing
+        is scheduled"""
+        return self._heap[0][0] if self._heap else None
+
+    def run_once(self):
+        """Waits until the next item is due, then runs it and schedules its
+        next run."""
+        when, _, item = self._heap[0]
+        while self.clock() < when:
+            self.sleep(min(when - self.clock(), MAX_SLEEP))
+        heapq.heappop(self._heap)
+
+        if item is self.KEEPALIVE:
+            try:
+                self.keepalive()
+            except exceptions.LoginError:
+                raise
+            except exceptions.Error as e:
+                # e.g. okta timing out, which doesn't mean the session has
+                # expired
+                logging.error("Unable to keep the okta session alive: %s", e)
+                self.schedule(item, self.clock() + self.retry_interval)
+                return
+            self.schedule(item, self.clock() + self.keepalive_interval)
+            return
+
+        try:
+            expiration = self.refresh(item)
+        except Exception as e:  # pylint: disable=broad-except
+            logging.error("Unable to refresh credentials for %s: %s",
+                          item, e)
+            self.schedule(item, self.clock() + self.retry_interval)
+            return
+        # Never schedule in the past, even if the credentials are shorter
+        # lived than the margin.
+        self.schedule(item, max(expiration - self.margin,
+                                self.clock() + self.retry_interval))
+
+    def run(self):
+        """Runs scheduled items forever, or until keepalive raises
+        exceptions.LoginError because the okta session has expired"""
+        while self._heap:
+            self.run_once()
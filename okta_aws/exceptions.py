@@ -3,13 +3,72 @@ class Error(Exception):
     pass
 
 
+class ConfigError(Error):
+    "Missing or invalid configuration"
+    def __init__(self, message):
+        self.message = message
+
+
 class LoginError(Error):
     "Error logging in to okta"
     def __init__(self, message):
         self.message = message
 
 
+class SessionError(LoginError):
+    "Okta rejected the session, e.g. because it expired or was revoked"
+    def __init__(self, message):
+        self.message = message
+
+
 class AssumeRoleError(Error):
     "Error running aws assume-role-with-saml"
     def __init__(self, message):
         self.message = message
+
+
+class DurationError(AssumeRoleError):
+    "The requested session duration is longer than AWS allows for the role"
+    def __init__(self, message):
+        self.message = message
+
+
+class ApplicationError(Error):
+    "Error getting the list of applications assigned in okta"
+    def __init__(self, message):
+        self.message = message
+
+
+class ProfileError(Error):
+    "Unknown or invalid profile name"
+    def __init__(self, message):
+        self.message = message
+
+
+class RoleError(Error):
+    "Unable to choose a role to assume"
+    def __init__(self, message):
+        self.message = message
+
+
+class SAMLError(Error):
+    "Error obtaining a SAML assertion from okta"
+    def __init__(self, message):
+        self.message = message
+
+
+class NetworkError(Error):
+    "Error communicating with okta"
+    def __init__(self, message):
+        self.message = message
+
+
+class BatchError(Error):
+    """Credentials couldn't be fetched for some of the profiles in a batch.
+    The credentials that were fetched are available in `credentials`, and the
+    exception raised for each failed profile in `errors`."""
+    def __init__(self, message, credentials, errors):
+        super().__init__(message)
+        self.message = message
+        self.credentials = credentials
+        self.errors = errors
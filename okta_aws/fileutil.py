@@ -0,0 +1,84 @@
+#
+# Copyright 2017 Chef Software
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Helpers for safely updating files that other okta_aws processes (or the
+AWS tools) may be reading or writing at the same time."""
+
+import contextlib
+import os
+import stat
+import tempfile
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - windows
+    fcntl = None
+    import msvcrt
+
+
+@contextlib.contextmanager
+def file_lock(path):
+    """Holds an exclusive lock on path while the with block runs. The lock is
+    taken on a separate '.lock' file next to path, so that path itself can be
+    replaced with a rename while the lock is held.
+
+    path - the file to lock
+    """
+    lock_path = path + '.lock'
+    with open(lock_path, 'a') as fh:
+        if fcntl is not None:
+            fcntl.flock(fh.fileno(), fcntl.LOCK_EX)
+        else:  # pragma: no cover - windows
+            msvcrt.locking(fh.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(fh.fileno(), fcntl.LOCK_UN)
+            else:  # pragma: no cover - windows
+                fh.seek(0)
+                msvcrt.locking(fh.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def atomic_write(path, data, mode=None):
+    """Replaces the contents of path with data in a single step, by writing
+    to a temporary file in the same directory and renaming it over the top of
+    path. Readers will see either the old or the new contents, never a
+    partially written file.
+
+    path - the file to write
+    data - the new contents of the file (str or bytes)
+    mode - the permissions to give the file. Defaults to the permissions of
+           the existing file, or 0600 for a new file.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    if mode is None:
+        try:
+            mode = stat.S_IMODE(os.stat(path).st_mode)
+        except FileNotFoundError:
+            mode = 0o600
+    fd, tmp_path = tempfile.mkstemp(
+        dir=directory, prefix='.%s.' % os.path.basename(path))
+    try:
+        with os.fdopen(fd, 'wb' if isinstance(data, bytes) else 'w') as fh:
+            fh.write(data)
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(tmp_path)
+        raise
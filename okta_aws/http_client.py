@@ -0,0 +1,135 @@
+#
+# Copyright 2017 Chef Software
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""A shared HTTP session for talking to okta, with connection pooling,
+timeouts and retries for rate limited or failed requests."""
+
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from okta_aws import exceptions
+
+DEFAULT_CONNECT_TIMEOUT = 10
+DEFAULT_READ_TIMEOUT = 30
+DEFAULT_RETRIES = 3
+DEFAULT_POOL_SIZE = 10
+
+
+class OktaRetry(Retry):
+    """Retry policy for okta API calls.
+
+    Requests that fail with a 429 or 5xx status are retried with exponential
+    backoff. When okta rate limits a request, it sends an X-Rate-Limit-Reset
+    header (the time in seconds since the epoch when the limit resets) rather
+    than Retry-After, so we wait until then before retrying.
+
+    POST requests are only retried when rate limited, as the request won't
+    have been acted on. Other failures could mean that a login attempt was
+    counted, and it isn't safe to send it again.
+    """
+    # Never wait longer than this for a rate limit to reset
+    MAX_RATE_LIMIT_WAIT = 60
+
+    def is_retry(self, method, status_code, has_retry_after=False):
+        if method.upper() == 'POST':
+            return status_code == 429 and bool(self.total)
+        return super().is_retry(method, status_code, has_retry_after)
+
+    def get_retry_after(self, response):
+        retry_after = super().get_retry_after(response)
+        if retry_after is not None:
+            return retry_after
+        reset = response.headers.get('X-Rate-Limit-Reset')
+        if reset is None:
+            return None
+        try:
+            wait = float(reset) - time.time()
+        except ValueError:
+            return None
+        return min(max(wait, 0), self.MAX_RATE_LIMIT_WAIT)
+
+
+class OktaSession(requests.Session):
+    """A requests session that keeps connections to okta alive between
+    calls, applies a default timeout to every request, and retries requests
+    that are rate limited or fail with a server error.
+
+    timeout   - a (connect, read) tuple of timeouts in seconds
+    retries   - how many times to retry a failed request
+    pool_size - how many connections to keep open to each host. This should
+                be at least the number of threads making requests at once.
+    metrics   - a metrics.Metrics to record each request in, or None
+    """
+    def __init__(self, timeout=(DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT),
+                 retries=DEFAULT_RETRIES, pool_size=DEFAULT_POOL_SIZE,
+                 metrics=None):
+        super().__init__()
+        self.timeout = timeout
+        self.metrics = metrics
+        adapter = HTTPAdapter(
+            pool_connections=pool_size,
+            pool_maxsize=pool_size,
+            max_retries=OktaRetry(
+                total=retries,
+                backoff_factor=0.5,
+                status_forcelist=[429, 500, 502, 503, 504],
+                raise_on_status=False))
+        self.mount('https://', adapter)
+        self.mount('http://', adapter)
+
+    def request(self, method, url, *args, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        start = time.monotonic()
+        try:
+            r = super().request(method, url, *args, **kwargs)
+        except requests.exceptions.RequestException as e:
+            if self.metrics is not None:
+                self.metrics.http(method, url, None, None, 0,
+                                  time.monotonic() - start)
+            raise exceptions.NetworkError(
+                "Error connecting to %s: %s" % (url, e))
+        if self.metrics is not None:
+            self.metrics.http(method, url, r.status_code,
+                              response_size(r, kwargs.get('stream')),
+                              retry_count(r), time.monotonic() - start)
+        return r
+
+
+def response_size(r, stream=False):
+    """Returns the size of a response body in bytes, or None if it isn't
+    known yet (a streamed response without a Content-Length header).
+
+    r      - a requests.Response
+    stream - whether the body is being streamed, and so hasn't been read
+    """
+    if not stream:
+        return len(r.content or b'')
+    try:
+        return int(r.headers['Content-Length'])
+    except (KeyError, ValueError):
+        return None
+
+
+def retry_count(r):
+    """Returns how many times the request for a response was retried
+
+    r - a requests.Response
+    """
+    retries = getattr(r.raw, 'retries', None)
+    if retries is None:
+        return 0
+    return len(retries.history)
@@ -0,0 +1,75 @@
+#
+# Copyright 2017 Chef Software
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Incremental parsing of JSON arrays, so that items from a large API
+response can be used as they arrive instead of after the whole response has
+been downloaded and parsed."""
+
+import codecs
+import json
+
+WHITESPACE = ' \t\n\r'
+
+
+def iter_json_array(chunks):
+    """Yields each element of a JSON array, given the document as an
+    iterable of chunks of bytes or text. Raises ValueError if the document
+    isn't a valid JSON array.
+
+    chunks - an iterable of pieces of the document, such as
+             requests.Response.iter_content()
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    buf = ''
+    # What we expect next: '[', a value or ']', a value, ',' or ']'
+    state = 'start'
+    for chunk in chunks:
+        buf += utf8.decode(chunk) if isinstance(chunk, bytes) else chunk
+        pos = 0
+        while True:
+            while pos < len(buf) and buf[pos] in WHITESPACE:
+                pos += 1
+            if pos >= len(buf) or state == 'end':
+                break
+            char = buf[pos]
+            if state == 'start':
+                if char != '[':
+                    raise ValueError("Expected a JSON array")
+                state = 'first'
+                pos += 1
+            elif state in ('first', 'separator') and char == ']':
+                state = 'end'
+                pos += 1
+            elif state == 'separator':
+                if char != ',':
+                    raise ValueError("Expected ',' or ']' at %r" % buf[pos:])
+                state = 'value'
+                pos += 1
+            else:
+                try:
+                    value, end = decoder.raw_decode(buf, pos)
+                except ValueError:
+                    # Probably an incomplete value; wait for more data
+                    break
+                if end >= len(buf):
+                    # A number could continue in the next chunk
+                    break
+                yield value
+                state = 'separator'
+                pos = end
+        buf = buf[pos:]
+    buf += utf8.decode(b'', final=True)
+    if state != 'end' or buf.strip():
+        raise ValueError("Incomplete or invalid JSON array")
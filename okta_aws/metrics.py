@@ -0,0 +1,182 @@
+#
+# Copyright 2017 Chef Software
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Timing of each stage of fetching credentials, for okta_aws --timings and
+--metrics-file."""
+
+import contextlib
+import datetime
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+
+class PhaseStats(object):
+    """Totals for one phase of a run"""
+    __slots__ = ('calls', 'seconds', 'max_seconds', 'errors', 'requests',
+                 'bytes', 'retries')
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.errors = 0
+        self.requests = 0
+        self.bytes = 0
+        self.retries = 0
+
+
+class Metrics(object):
+    """Times the phases of a run (logging in, listing applications, getting
+    SAML assertions, calling STS and so on), along with the HTTP requests
+    made during each phase. Totals for each phase are kept in memory for
+    format_summary, and if path is set every phase and request is also
+    appended to that file as a line of JSON.
+
+    Phases can be timed from several threads at once. HTTP requests are
+    counted against whichever phase is running in the thread that made them.
+
+    path - a file to append JSON lines to, or None
+    """
+    def __init__(self, path=None):
+        self.path = path
+        self.run_id = uuid.uuid4().hex[:12]
+        self.phases = {}
+        self._order = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._fh = None
+
+    @contextlib.contextmanager
+    def phase(self, name, profile=None, **fields):
+        """Times the code run inside the with block as phase name. Yields a
+        dictionary that extra fields for the JSON output can be added to.
+
+        name    - the name of the phase
+        profile - the profile the phase is for. Defaults to the profile of
+                  the phase this one is part of, if any.
+        fields  - extra fields to include in the JSON output
+        """
+        record = dict(fields)
+        stack = self._local.__dict__.setdefault('stack', [])
+        if profile is None and stack:
+            profile = stack[-1][1]
+        stack.append((name, profile))
+        start = time.monotonic()
+        try:
+            yield record
+        except BaseException as e:
+            if not isinstance(e, (SystemExit, GeneratorExit)):
+                record.setdefault('error', type(e).__name__)
+            raise
+        finally:
+            seconds = time.monotonic() - start
+            stack.pop()
+            with self._lock:
+                stats = self._stats(name)
+                stats.calls += 1
+                stats.seconds += seconds
+                stats.max_seconds = max(stats.max_seconds, seconds)
+                stats.retries += record.get('retries', 0)
+                if 'error' in record:
+                    stats.errors += 1
+            self.write(event='phase', phase=name, profile=profile,
+                       seconds=seconds, **record)
+
+    def http(self, method, url, status, nbytes, retries, seconds):
+        """Records an HTTP request made in the current phase
+
+        method  - the HTTP method
+        url     - the URL requested
+        status  - the HTTP status of the response, or None if it failed
+        nbytes  - the size of the response body, or None if it isn't known
+        retries - how many times the request was retried
+        seconds - how long the request took, including retries
+        """
+        stack = getattr(self._local, 'stack', None)
+        phase, profile = stack[-1] if stack else ('other', None)
+        with self._lock:
+            stats = self._stats(phase)
+            stats.requests += 1
+            stats.bytes += nbytes or 0
+            stats.retries += retries
+        self.write(event='http', phase=phase, profile=profile, method=method,
+                   url=url.split('?', 1)[0], status=status, bytes=nbytes,
+                   retries=retries, seconds=seconds)
+
+    def _stats(self, phase):
+        stats = self.phases.get(phase)
+        if stats is None:
+            stats = self.phases[phase] = PhaseStats()
+            self._order.append(phase)
+        return stats
+
+    def write(self, **fields):
+        """Appends a line of JSON to the metrics file, if there is one"""
+        if not self.path:
+            return
+        fields = dict(
+            time=datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            run=self.run_id, **fields)
+        if 'seconds' in fields:
+            fields['seconds'] = round(fields['seconds'], 6)
+        line = json.dumps(fields, default=str) + "\n"
+        with self._lock:
+            try:
+                if self._fh is None:
+                    self._fh = open(os.path.expanduser(self.path), 'a',
+                                    buffering=1)
+                self._fh.write(line)
+            except OSError as e:
+                # Not being able to record metrics shouldn't stop us getting
+                # credentials
+                logging.warning("Unable to write metrics to %s: %s",
+                                self.path, e)
+                self.path = None
+
+    def close(self):
+        with self._lock:
+            if self._fh is not None:
+                self._fh.close()
+                self._fh = None
+
+    def format_summary(self, total=None):
+        """Returns a table of the time spent in each phase, in the order the
+        phases first ran. When phases run in parallel the time spent in each
+        thread is added together, so they can add up to more than the total.
+
+        total - the elapsed time of the whole run in seconds, if known
+        """
+        rows = [('phase', 'calls', 'total ms', 'max ms', 'requests', 'bytes',
+                 'retries', 'errors')]
+        with self._lock:
+            for name in self._order:
+                s = self.phases[name]
+                rows.append((name, str(s.calls), "%.1f" % (s.seconds * 1000),
+                             "%.1f" % (s.max_seconds * 1000),
+                             str(s.requests), str(s.bytes), str(s.retries),
+                             str(s.errors)))
+        if total is not None:
+            rows.append(('total', '', "%.1f" % (total * 1000), '', '', '', '',
+                         ''))
+        widths = [max(len(row[i]) for row in rows)
+                  for i in range(len(rows[0]))]
+        return "\n".join(
+            "  ".join([row[0].ljust(widths[0])] +
+                      [cell.rjust(width)
+                       for cell, width in zip(row[1:], widths[1:])]).rstrip()
+            for row in rows)
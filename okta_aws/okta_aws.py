@@ -13,27 +13,49 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+# Heavy dependencies (requests, botocore, toml, xml.etree, asyncio) are
+# imported by the methods that use them rather than here, so that commands
+# that don't need them, such as --version, --list or a cache hit, start
+# quickly.
 import argparse
-import base64
+import fnmatch
 import getpass
-import html
+import json
 import logging
 import os
 import re
-import shutil
-import subprocess
 import sys
-import xml.etree.ElementTree as ET
+import threading
+import time
+from collections.abc import Mapping
 
-import requests
-import toml
-import boto3
-
-from okta_aws import exceptions
+from okta_aws import (cache, config, credentials_file, daemon, exceptions,
+                      jsonstream, metrics)
 
 
 __VERSION__ = '0.7.0'
 
+# Session duration to ask for when okta doesn't say how long is allowed
+DEFAULT_SESSION_DURATION = 3600
+# Shorter session durations to try, longest first, when AWS says that the
+# requested duration is longer than a role allows. Every role allows at least
+# an hour.
+FALLBACK_DURATIONS = (43200, 28800, 21600, 14400, 10800, 7200, 3600)
+# AWS doesn't allow role chaining sessions to last longer than an hour
+CHAINED_SESSION_DURATION = 3600
+
+# MFA factor types we can verify, in the order they are tried unless
+# factor_preference says otherwise
+DEFAULT_FACTOR_PREFERENCE = ('token:software:totp', 'push')
+# How long to wait for a push notification to be approved, in seconds
+DEFAULT_PUSH_TIMEOUT = 60
+# How long to wait between polls for the result of a push notification. The
+# wait starts short, as most pushes are approved in a few seconds, and backs
+# off to avoid using up okta's rate limit.
+PUSH_POLL_INITIAL = 1.0
+PUSH_POLL_BACKOFF = 1.5
+PUSH_POLL_MAX = 5.0
+
 
 class OktaAWS(object):
     def __init__(self, argv=None):
@@ -42,7 +64,33 @@ class OktaAWS(object):
         argv - command line arguments (or None to use sys.argv)
         """
         self.args = self.parse_args(argv)
-        self.profile = self.args.profile
+        self.profile = self.args.credential_process or self.args.profile
+        # Whether we can prompt the user for input
+        self.interactive = self.args.credential_process is None
+        # Whether the okta session in use was saved by an earlier run, rather
+        # than created by logging in during this one
+        self.saved_session = False
+        # Whether credentials are read from and saved to the credential
+        # cache. --serve only keeps credentials in memory.
+        self.use_credential_cache = True
+        # Used to serialize interactive prompts when fetching credentials
+        # for several profiles at once.
+        self._prompt_lock = threading.Lock()
+        self._http = None
+        self._assertion_cache = None
+        self._assertion_cache_lock = threading.Lock()
+        # The stores the caches are kept in, see cache_store()
+        self._stores = {}
+        self._stores_lock = threading.Lock()
+        # Credentials for the source profiles of role chains, so that each
+        # is only fetched once
+        self._source_creds = {}
+        self._source_locks = {}
+        self._source_lock = threading.Lock()
+        # Timings of each phase of the run, for --timings and --metrics-file
+        self.metrics = metrics.Metrics(self.args.metrics_file)
+        # Replaced by the contents of the config file in run()
+        self.config = config.Config({})
 
     def parse_args(self, argv):
         """Parses command line arguments using argparse
@@ -68,8 +116,47 @@ class OktaAWS(object):
                             "applications in okta")
         parser.add_argument('--all', '-a', action='store_true',
                             help='Assume a role in all assigned accounts')
-        parser.add_argument('--role_arn', '-r',
-                            help='Role name or ARN to assume')
+        parser.add_argument('--select', '-S', action='append',
+                            metavar='PATTERN',
+                            help='Assume a role in the accounts whose '
+                            'profile names match PATTERN, a glob such as '
+                            '"*-prod" or a regular expression starting with '
+                            '"re:". Can be given more than once.')
+        parser.add_argument('--group', '-g', action='append',
+                            metavar='GROUP',
+                            help='Assume a role in the accounts listed in '
+                            'GROUP in the [groups] section of the config '
+                            'file. Can be given more than once.')
+        parser.add_argument('--jobs', '-j', type=int, default=4,
+                            help='Number of accounts to fetch credentials '
+                            'for in parallel when using --all, --select or '
+                            '--group')
+        parser.add_argument('--daemon', action='store_true',
+                            help='Keep running, and renew credentials for '
+                            'the profile (or the profiles listed in '
+                            'daemon_profiles) before they expire')
+        parser.add_argument('--serve', action='store_true',
+                            help='Run a local credentials server for the AWS '
+                            'SDKs instead of writing ~/.aws/credentials')
+        parser.add_argument('--force', '-f', action='store_true',
+                            help='Fetch new credentials even if the current '
+                            'ones are still valid')
+        parser.add_argument('--role_arn', '-r', action='append',
+                            help='Role name or ARN to assume. Use '
+                            'ROLE=PROFILE to store the credentials for ROLE '
+                            'in PROFILE. Can be given more than once to '
+                            'assume several roles in the same account.')
+        parser.add_argument('--credential-process', metavar='PROFILE',
+                            help='Print credentials for PROFILE in the '
+                            'format used by the credential_process AWS '
+                            'config setting, without prompting for input '
+                            'or writing to ~/.aws/credentials')
+        parser.add_argument('--timings', action='store_true',
+                            help='Show how long each stage of fetching '
+                            'credentials took')
+        parser.add_argument('--metrics-file', metavar='FILE',
+                            help='Append timings for each stage and HTTP '
+                            'request to FILE as JSON lines')
         parser.add_argument('--version', '-v', action='version',
                             version=__VERSION__,
                             help='Show version of okta_aws and exit')
@@ -83,13 +170,12 @@ class OktaAWS(object):
             logging.basicConfig(
                 format='%(asctime)s %(levelname)s %(message)s',
                 level=logging.DEBUG)
-        elif self.args.quiet:
+        elif self.args.quiet or self.args.credential_process:
             logging.basicConfig(format='%(message)s', level=logging.ERROR)
         else:
             logging.basicConfig(format='%(message)s', level=logging.INFO)
 
         if not self.args.debug:
-            logging.getLogger('boto3').setLevel(logging.ERROR)
             logging.getLogger('botocore').setLevel(logging.ERROR)
 
     def preflight_checks(self):
@@ -98,12 +184,11 @@ class OktaAWS(object):
         a hint for how the user can fix the problem.
         """
         errors = []
-        # AWS cli
-        if shutil.which("aws") is None:
-            errors.append("The AWS CLI (the 'aws' command) cannot be found. "
-                          "see http://docs.aws.amazon.com/cli/latest/"
-                          "userguide/installing.html for information on "
-                          "installing it.")
+        # AWS credentials file
+        creds_path = credentials_file.credentials_path()
+        if os.path.exists(creds_path) and not os.access(creds_path, os.W_OK):
+            errors.append("The AWS credentials file (%s) isn't writable. "
+                          "Check the permissions on the file." % creds_path)
         if errors:
             print("Preflight check failed")
             print("======================")
@@ -115,6 +200,8 @@ class OktaAWS(object):
         """Performs first-time setup for users who haven't set up a config
         file yet, by asking some simple questions.
         """
+        import toml
+
         try:
             toml_config = toml.load(os.path.expanduser(config_file))
         except FileNotFoundError:
@@ -149,53 +236,258 @@ class OktaAWS(object):
               "you can use.")
 
     def load_config(self, config_file):
-        """Loads the config file and returns a dictionary containing its
-        contents.
+        """Loads the config file and returns a config.Config containing its
+        contents. Raises exceptions.ConfigError if there is a problem with
+        it.
 
         config_file - path to the configuration file to load
         """
         try:
-            config = toml.load(os.path.expanduser(config_file))
+            return config.load(config_file)
         except FileNotFoundError:
+            if not self.interactive:
+                raise exceptions.ConfigError(
+                    "Config file %s not found. Run okta_aws --setup to "
+                    "create it." % config_file)
             self.interactive_setup(config_file)
             sys.exit(0)
 
-        config.setdefault('general', {})
-        config.setdefault('aliases', {})
-
-        required_config_options = [
-            'username',
-            'okta_server'
-        ]
+    def get_config(self, key, default=None, profile=None):
+        """Obtain a profile specific configuration value, falling back to the
+        general config or a default value
 
-        missing_options = [k for k in required_config_options
-                           if k not in config['general']]
-        if missing_options:
-            logging.error("Missing required configuration settings: %s",
-                          ', '.join(missing_options))
-            sys.exit(1)
+        key     - the configuration option to look up
+        default - the value to return if the option isn't set anywhere
+        profile - the profile to look up the option for (defaults to the
+                  profile given on the command line)
+        """
+        if profile is None:
+            profile = self.profile
+        return self.config.setting(key, default, profile)
+
+    @property
+    def http(self):
+        """The HTTP session used for all requests to okta. It is created on
+        first use, so that it picks up timeout and retry settings from the
+        config file."""
+        if self._http is None:
+            from okta_aws import http_client
+            self._http = http_client.OktaSession(
+                timeout=(self.get_config('connect_timeout',
+                                         http_client.DEFAULT_CONNECT_TIMEOUT),
+                         self.get_config('read_timeout',
+                                         http_client.DEFAULT_READ_TIMEOUT)),
+                retries=self.get_config('http_retries',
+                                        http_client.DEFAULT_RETRIES),
+                pool_size=max(self.args.jobs,
+                              http_client.DEFAULT_POOL_SIZE),
+                metrics=self.metrics)
+        return self._http
+
+    def cache_store(self, name):
+        """Returns the store.Store the cache called name is kept in, which
+        depends on the cache_store setting.
+
+        name - the name of the cache, such as 'credentials'
+        """
+        from okta_aws.store import open_store
+
+        key = (self.get_config('cache_store', 'file'),
+               self.get_config('cache_dir'), name)
+        with self._stores_lock:
+            if key not in self._stores:
+                self._stores[key] = open_store(*key)
+            return self._stores[key]
+
+    @property
+    def credential_cache(self):
+        """The cache of temporary credentials that have already been
+        fetched"""
+        return cache.CredentialCache(self.cache_store('credentials'))
+
+    @property
+    def assertion_cache(self):
+        """The cache of SAML assertions for each okta application. Profiles
+        fetched in parallel must share it, so it is only created once."""
+        with self._assertion_cache_lock:
+            if self._assertion_cache is None:
+                # With --force, assertions saved by earlier runs are ignored,
+                # but new ones are still shared between the roles assumed in
+                # this run.
+                self._assertion_cache = cache.AssertionCache(
+                    self.cache_store('saml'), read_store=not self.args.force)
+            return self._assertion_cache
+
+    def role_targets(self):
+        """Returns a dictionary mapping profile names to roles, for roles
+        given on the command line as ROLE=PROFILE. Role names can contain
+        '=', but profile names can't, so the value is split on the last
+        '='."""
+        targets = {}
+        for value in self.args.role_arn or []:
+            role, _, profile = value.rpartition('=')
+            if role and profile:
+                targets[profile] = role
+        return targets
+
+    def requested_role(self, profile=None):
+        """Returns the role name or ARN that was requested for a profile,
+        either on the command line or in the config file, or None if no role
+        was requested.
+
+        profile - the profile to look up the role for
+        """
+        if profile is None:
+            profile = self.profile
+        targets = self.role_targets()
+        if profile in targets:
+            return targets[profile]
+        cli_roles = [r for r in self.args.role_arn or [] if '=' not in r]
+        return self.get_config('role_arn', profile=profile) or \
+            (cli_roles[-1] if cli_roles else None)
+
+    def source_profile(self, profile=None):
+        """Returns the profile (with any alias resolved) whose credentials
+        are used to assume the role for a profile in a role chain, or None if
+        the credentials for the profile come straight from okta.
+
+        profile - the profile to look up (defaults to the profile given on
+                  the command line)
+        """
+        if profile is None:
+            profile = self.profile
+        real_profile = self.config['aliases'].get(profile, profile)
+        if real_profile in config.SPECIAL_SECTIONS:
+            return None
+        settings = self.config.get(real_profile)
+        if not isinstance(settings, Mapping) or \
+                'source_profile' not in settings:
+            return None
+        source = settings['source_profile']
+        return self.config['aliases'].get(source, source)
 
-        # Default configuration values
-        config['general'].setdefault('cookie_file', '~/.okta_aws_cookie')
-        config['general'].setdefault('short_profile_names', True)
-        config['general'].setdefault('session_duration', 3600)
+    def chain_root(self, profile=None):
+        """Returns the profile at the start of a profile's role chain,
+        which is the one credentials are fetched for using okta. This is the
+        profile itself (with any alias resolved) if it isn't part of a role
+        chain.
 
-        config['general']['cookie_file'] = os.path.expanduser(
-            config['general']['cookie_file'])
+        profile - the profile to look up (defaults to the profile given on
+                  the command line)
+        """
+        if profile is None:
+            profile = self.profile
+        source = self.source_profile(profile)
+        while source is not None:
+            profile = source
+            source = self.source_profile(profile)
+        return self.config['aliases'].get(profile, profile)
+
+    def chain_levels(self, profiles):
+        """Groups profiles in role chains by how far along their chain they
+        are, returning a list of lists of profiles. The source_profile of
+        each profile is either in an earlier list or not in a role chain at
+        all, so each list can be fetched in parallel once the lists before
+        it have been fetched.
+
+        profiles - the profiles in role chains to fetch
+        """
+        levels = {}
+        for profile in profiles:
+            depth = 0
+            source = self.source_profile(profile)
+            while source is not None:
+                depth += 1
+                source = self.source_profile(source)
+            levels.setdefault(depth, []).append(profile)
+        return [sorted(levels[depth]) for depth in sorted(levels)]
+
+    def role_chains(self):
+        """Returns every profile in the config file that is in a role
+        chain"""
+        return sorted(profile for profile in self.config
+                      if self.source_profile(profile) is not None)
+
+    def selection_patterns(self):
+        """Returns the profile names and patterns chosen with --select and
+        --group. Raises exceptions.ConfigError if a group isn't in the
+        [groups] section of the config file, or a regular expression isn't
+        valid."""
+        patterns = list(self.args.select or [])
+        groups = self.config.get('groups', {})
+        for group in self.args.group or []:
+            if group not in groups:
+                raise exceptions.ConfigError(
+                    "There is no group called %s in the [groups] section of "
+                    "the config file" % group)
+            patterns.extend(groups[group])
+        for pattern in patterns:
+            if pattern.startswith('re:'):
+                try:
+                    re.compile(pattern[3:])
+                except re.error as e:
+                    raise exceptions.ConfigError(
+                        "Invalid regular expression %s: %s" % (pattern, e))
+        return patterns
+
+    def select_profiles(self, profiles):
+        """Returns the profiles chosen with --select and --group. Each
+        pattern can be a profile name (or alias), a glob such as '*-prod',
+        or a regular expression starting with 're:' that has to match the
+        whole profile name. Globs and regular expressions choose from
+        profiles. A profile is only chosen once, even if it is matched by
+        its own name and an alias.
+
+        profiles - the names of the profiles that can be chosen, such as
+                   those returned by get_applinks and role_chains
+        """
+        selected = []
+        seen = set()
+        for pattern in self.selection_patterns():
+            if pattern.startswith('re:'):
+                regex = re.compile(pattern[3:])
+                matches = [p for p in profiles if regex.fullmatch(p)]
+            elif any(c in pattern for c in '*?['):
+                matches = [p for p in profiles
+                           if fnmatch.fnmatchcase(p, pattern)]
+            else:
+                matches = [pattern]
+            if not matches:
+                logging.warning("No profiles match %s", pattern)
+            for profile in matches:
+                # A profile and its alias are the same account, so only the
+                # first of them is used
+                real_profile = self.config['aliases'].get(profile, profile)
+                if real_profile not in seen:
+                    seen.add(real_profile)
+                    selected.append(profile)
+        return selected
 
-        return config
+    def get_cached_credentials(self, profile, check_file=True):
+        """Returns credentials previously fetched for a profile, as long as
+        they are valid for at least another refresh_threshold seconds and are
+        still the credentials stored in ~/.aws/credentials. Returns None if
+        new credentials need to be fetched, if --force was given, or if the
+        credential cache isn't being used.
 
-    def get_config(self, key, default=None):
-        """Obtain a profile specific configuration value, falling back to the
-        general config or a default value"""
-        try:
-            return self.config[self.profile][key]
-        except KeyError:
-            try:
-                real_profile = self.config['aliases'][self.profile]
-                return self.config[real_profile][key]
-            except KeyError:
-                return self.config['general'].get(key, default)
+        profile    - the profile to look up credentials for
+        check_file - whether the credentials must also be the ones stored in
+                     ~/.aws/credentials
+        """
+        if self.args.force or not self.use_credential_cache:
+            return None
+        creds = self.credential_cache.get(
+            profile, self.requested_role(profile),
+            self.get_config('session_duration', profile=profile),
+            self.get_config('refresh_threshold', profile=profile))
+        if creds is None or not check_file:
+            return creds
+        stored = credentials_file.read_profiles().get(profile, {})
+        if stored.get('aws_access_key_id') != creds['AccessKeyId']:
+            logging.debug("Cached credentials for %s don't match those in "
+                          "the credentials file", profile)
+            return None
+        return creds
 
     def choose_from_menu(self, choices, prompt="Select an option: "):
         """Present an interactive menu of choices for the user to pick from.
@@ -217,18 +509,19 @@ class OktaAWS(object):
                 pass
         return response - 1
 
-    def select_role(self, arns):
+    def select_role(self, arns, profile=None):
         """Returns the role to use from a list of principal/role arn pairs,
         based on either a configuration option, user selecting from a menu,
         or simply returning the only arn pair in the list if there is only
         one.
 
-        arns - a list of arn pairs (each pair should be a princpal/role arn)
+        arns    - a list of arn pairs (each pair should be a princpal/role arn)
+        profile - the profile the role is being selected for
         """
         selected = None
         if len(arns) > 1:
             # Get role via config, but allow commandline override
-            role_arn = self.get_config('role_arn') or self.args.role_arn
+            role_arn = self.requested_role(profile)
             if role_arn is not None:
                 # First check to see if we configured a default role
                 logging.debug("Looking for configured role: %s", role_arn)
@@ -237,39 +530,148 @@ class OktaAWS(object):
                     # instead of the full ARN.
                     if arn[1].endswith(role_arn):
                         selected = arn
+            if selected is None and not self.interactive:
+                raise exceptions.RoleError(
+                    "More than one role is available. Set role_arn in the "
+                    "config file to choose one.")
             if selected is None:
                 # We either didn't configure a default role or the configured
                 # default role didn't match any available roles. Ask the user
-                # to pick one.
-                print("Available roles")
-                response = self.choose_from_menu(
-                    [arn[1].split('/')[-1] for arn in arns],
-                    "Select role to log in with: ")
+                # to pick one. Only one menu can be shown at a time when
+                # fetching credentials in parallel.
+                with self._prompt_lock:
+                    if profile is None:
+                        print("Available roles")
+                    else:
+                        print("Available roles for %s" % profile)
+                    response = self.choose_from_menu(
+                        [arn[1].split('/')[-1] for arn in arns],
+                        "Select role to log in with: ")
                 selected = arns[response]
         else:
             selected = arns[0]
         return selected
 
-    def get_arns(self, saml_assertion):
+    @staticmethod
+    def parse_assertion(saml_assertion):
+        """Returns a saml.AssertionInfo for a SAML assertion, raising
+        SAMLError if it can't be read, e.g. because it was truncated.
+
+        saml_assertion - the saml asssertion given by okta, base64 encoded.
+        """
+        from okta_aws import saml
+
+        try:
+            return saml.parse_assertion(saml_assertion)
+        except (ValueError, saml.ET.ParseError) as e:
+            raise exceptions.SAMLError(
+                "Unable to read the SAML assertion from okta: %s" % e)
+
+    def get_arns(self, saml_assertion, profile=None):
         """Extracts the available principal/role ARNS for a user given a
         base64 encoded SAML assertion returned by okta.
 
         saml_assertion - the saml asssertion given by okta, base64 encoded.
+        profile        - the profile the role is being selected for
         """
-        parsed = ET.fromstring(base64.b64decode(saml_assertion))
-        # Horrible xpath expression to dig into the ARNs
-        elems = parsed.findall(
-            ".//{urn:oasis:names:tc:SAML:2.0:assertion}Attribute["
-            "@Name='https://aws.amazon.com/SAML/Attributes/Role']//*")
-        # text contains Principal ARN, Role ARN separated by a comma
-        arns = [e.text.split(",", 1) for e in elems]
-        selected = self.select_role(arns)
+        with self.metrics.phase('parse'):
+            arns = [list(role) for role in
+                    self.parse_assertion(saml_assertion).roles]
+        selected = self.select_role(arns, profile)
         # Returns principal_arn, role_arn
         logging.debug("Principal ARN: %s", selected[0])
         logging.debug("Role ARN: %s", selected[1])
         return selected
 
-    def aws_assume_role(self, principal_arn, role_arn, assertion, duration):
+    def sts_region(self, profile=None):
+        """Returns the preferred AWS region for STS calls for a profile. This
+        is the sts_region setting if it is set (the first one, if it is a
+        list), otherwise us-gov-east-1 for profiles with 'govcloud' in their
+        name, otherwise the region in AWS_REGION or AWS_DEFAULT_REGION, and
+        us-east-1 if neither is set.
+
+        profile - the profile credentials are being fetched for
+        """
+        if profile is None:
+            profile = self.profile
+        region_name = self.get_config('sts_region', profile=profile)
+        if isinstance(region_name, (list, tuple)):
+            region_name = region_name[0] if region_name else None
+        if region_name:
+            return region_name
+        if 'govcloud' in profile:
+            return 'us-gov-east-1'
+        return os.environ.get('AWS_REGION') or \
+            os.environ.get('AWS_DEFAULT_REGION') or 'us-east-1'
+
+    def sts_regions(self, arn, profile=None):
+        """Returns the AWS regions to try STS calls in for a profile, in
+        order. These are the preferred regions (see sts_region), followed by
+        fallback regions. Only regions in the same partition as arn are
+        used, so GovCloud and China roles go to the right endpoints.
+
+        arn     - the ARN of the principal or role being used, which says
+                  which partition it is in
+        profile - the profile credentials are being fetched for
+        """
+        from okta_aws import sts
+
+        configured = self.get_config('sts_region', profile=profile)
+        if isinstance(configured, (list, tuple)) and configured:
+            preferred = configured
+        else:
+            preferred = [self.sts_region(profile)]
+        partition = sts.arn_partition(arn) or \
+            sts.region_partition(preferred[0])
+        return sts.regions(partition, preferred)
+
+    def call_sts(self, operation, arn, profile=None, credentials=None,
+                 **params):
+        """Calls an STS operation, returning the response. If the STS
+        endpoint in a region times out or returns a server error, the next
+        region from sts_regions is tried. Raises exceptions.AssumeRoleError
+        (see sts_error) if the call fails.
+
+        operation   - the name of the STS client method, e.g. assume_role
+        arn         - the ARN that says which partition to use (see
+                      sts_regions)
+        profile     - the profile credentials are being fetched for
+        credentials - credentials to sign the request with, if needed
+        params      - the parameters for the operation
+        """
+        import botocore.exceptions
+        from okta_aws import sts
+
+        regions = self.sts_regions(arn, profile)
+        for i, region_name in enumerate(regions):
+            with self.metrics.phase('sts', region=region_name,
+                                    operation=operation) as record:
+                if credentials is None:
+                    client = sts.get_client(region_name)
+                else:
+                    client = sts.get_client(region_name, credentials)
+                try:
+                    response = getattr(client, operation)(**params)
+                except (botocore.exceptions.ClientError,
+                        botocore.exceptions.ConnectionError,
+                        botocore.exceptions.HTTPClientError) as e:
+                    if isinstance(e, botocore.exceptions.ClientError):
+                        error = self.sts_error(e, record)
+                    else:
+                        record['error'] = type(e).__name__
+                        error = exceptions.AssumeRoleError(str(e))
+                    if sts.should_fall_back(e) and i + 1 < len(regions):
+                        logging.warning(
+                            "STS in %s is unavailable (%s), trying %s",
+                            region_name, e, regions[i + 1])
+                        continue
+                    raise error
+                record['retries'] = response.get(
+                    'ResponseMetadata', {}).get('RetryAttempts', 0)
+            return response
+
+    def aws_assume_role(self, principal_arn, role_arn, assertion, duration,
+                        profile=None):
         """Gets temporary credentials from aws. Returns a dictionary
         containing the temporary credentials.
 
@@ -280,31 +682,11 @@ class OktaAWS(object):
         duration  - how long to request the credentials be valid for in
                     seconds. This can't be longer than AWS allows (3600 by
                     default, may be configured to be as long as 43200)
+        profile   - the profile credentials are being fetched for, used to
+                    choose the STS region
         """
-
-        # Override AWS_PROFILE so boto3 doesn't complain if we have it set
-        # to a new profile that doesn't yet exist. This is needed because
-        # boto3 will use environment variables if you don't pass in a profile,
-        # but will complain if you do pass in a profile that doesn't exist.
-        oldenv = os.environ
-        if 'AWS_PROFILE' in os.environ:
-            del os.environ['AWS_PROFILE']
-        if 'AWS_DEFAULT_PROFILE' in os.environ:
-            del os.environ['AWS_DEFAULT_PROFILE']
-        if 'govcloud' in self.profile:
-            region_name = 'us-gov-east-1'
-        else:
-            region_name = 'us-east-1'
-
-        client = boto3.client('sts', region_name=region_name)
-
-        # And restore them once more
-        if 'AWS_PROFILE' in oldenv:
-            os.environ['AWS_PROFILE'] = oldenv['AWS_PROFILE']
-        if 'AWS_DEFAULT_PROFILE' in oldenv:
-            os.environ['AWS_DEFAULT_PROFILE'] = oldenv['AWS_DEFAULT_PROFILE']
-
-        aws_creds = client.assume_role_with_saml(
+        aws_creds = self.call_sts(
+            'assume_role_with_saml', principal_arn, profile,
             RoleArn=role_arn,
             PrincipalArn=principal_arn,
             SAMLAssertion=assertion,
@@ -318,25 +700,161 @@ class OktaAWS(object):
 
         return aws_creds['Credentials']
 
-    def set_aws_config(self, profile, key, value):
-        """Sets a single AWS configuration option. Used to store the temporary
-        credentials in ~/.aws/credentials.
+    def sts_error(self, error, record):
+        """Returns the exceptions.AssumeRoleError to raise for an error
+        returned by STS, noting the error in the metrics for the call.
 
-        profile - the profile to set the configuration option under
-        key     - the option to change
-        value   - the value to change it to
+        error  - the botocore ClientError raised by the STS client
+        record - the metrics record for the STS call
+        """
+        details = error.response.get('Error', {})
+        record['error'] = details.get('Code')
+        record['retries'] = error.response.get(
+            'ResponseMetadata', {}).get('RetryAttempts', 0)
+        if details.get('Code') == 'ValidationError' and \
+                'DurationSeconds' in details.get('Message', ''):
+            return exceptions.DurationError(str(error))
+        return exceptions.AssumeRoleError(str(error))
+
+    def role_session_name(self, profile=None):
+        """Returns the session name to use when assuming a role in a role
+        chain. This is the role_session_name setting if it is set, otherwise
+        the okta username, which makes it easy to see who assumed the role
+        in CloudTrail.
+
+        profile - the profile credentials are being fetched for
+        """
+        name = self.get_config('role_session_name', profile=profile) or \
+            self.get_config('username')
+        # Only some characters are allowed in session names
+        return re.sub(r'[^\w+=,.@-]', '-', name)[:64]
+
+    def assume_chained_role(self, source_creds, profile=None):
+        """Assumes the role given in role_arn for a profile in a role chain,
+        using the credentials of its source_profile. Returns the credentials
+        and the duration they were requested for.
+
+        source_creds - the credentials for the profile's source_profile, as
+                       returned by AWS
+        profile      - the profile credentials are being fetched for
+        """
+        if profile is None:
+            profile = self.profile
+        role_arn = self.get_config('role_arn', profile=profile)
+        duration = self.get_config('session_duration', profile=profile)
+        if duration == 'auto' or int(duration) > CHAINED_SESSION_DURATION:
+            duration = CHAINED_SESSION_DURATION
+        params = {
+            'RoleArn': role_arn,
+            'RoleSessionName': self.role_session_name(profile),
+            'DurationSeconds': int(duration),
+        }
+        external_id = self.get_config('external_id', profile=profile)
+        if external_id:
+            params['ExternalId'] = external_id
+
+        logging.info("Assuming AWS role %s using %s...",
+                     role_arn.split("/")[-1], self.source_profile(profile))
+        aws_creds = self.call_sts('assume_role', role_arn, profile,
+                                  credentials=source_creds, **params)
+
+        if 'Credentials' not in aws_creds:
+            logging.debug("aws_creds json is: %s" % aws_creds)
+            raise exceptions.AssumeRoleError("Credentials key not in returned"
+                                             " json")
+        return aws_creds['Credentials'], params['DurationSeconds']
+
+    def get_source_credentials(self, applinks, session_id, profile):
+        """Returns credentials for the source_profile of a role chain,
+        fetching them if there aren't any valid ones. However many roles are
+        assumed from the same source_profile, its credentials are only
+        fetched once.
+
+        applinks   - a mapping of profile names to application links
+        session_id - okta session ID needed to make API calls
+        profile    - the source profile to get credentials for
+        """
+        with self._source_lock:
+            lock = self._source_locks.setdefault(profile, threading.Lock())
+        with lock:
+            creds = self._source_creds.get(profile)
+            if creds is None or cache.seconds_until(creds['Expiration']) < \
+                    self.get_config('refresh_threshold', profile=profile):
+                creds = self.get_cached_credentials(profile,
+                                                    check_file=False)
+                if creds is None:
+                    creds = self.fetch_credentials(applinks, session_id,
+                                                   profile, store=False,
+                                                   use_cache=False)
+                self._source_creds[profile] = creds
+            return creds
+
+    @property
+    def duration_cache(self):
+        """The cache of the longest session durations roles allow"""
+        return cache.RoleDurationCache(os.path.join(
+            self.get_config('cache_dir'), 'durations.json'))
+
+    def session_duration(self, saml_assertion, role_arn, profile=None):
+        """Returns how long, in seconds, to ask for credentials to be valid
+        for. okta says how long a session it allows in the SessionDuration
+        attribute of the SAML assertion. When session_duration is 'auto',
+        that is what we ask for; otherwise session_duration is used, but cut
+        short to what okta allows. Either way, the duration is also cut short
+        to the longest duration AWS has previously allowed for the role.
+
+        saml_assertion - the saml assertion given by okta, base64 encoded
+        role_arn       - the ARN of the role being assumed
+        profile        - the profile credentials are being fetched for
         """
-        # Override AWS_PROFILE so aws sts doesn't complain if we have it set
-        # to a new profile that doesn't yet exist
-        newenv = os.environ.copy()
-        if 'AWS_PROFILE' in newenv:
-            del newenv['AWS_PROFILE']
-        if 'AWS_DEFAULT_PROFILE' in newenv:
-            del newenv['AWS_DEFAULT_PROFILE']
+        configured = self.get_config('session_duration', profile=profile)
+        allowed = self.parse_assertion(saml_assertion).session_duration
+        if configured == 'auto':
+            duration = allowed or DEFAULT_SESSION_DURATION
+        else:
+            duration = int(configured)
+            if allowed is not None and duration > allowed:
+                logging.debug("okta only allows sessions of %d seconds",
+                              allowed)
+                duration = allowed
+        role_max = self.duration_cache.get(role_arn)
+        if role_max is not None and duration > role_max:
+            logging.debug("%s only allows sessions of %d seconds", role_arn,
+                          role_max)
+            duration = role_max
+        return duration
+
+    def assume_role(self, principal_arn, role_arn, assertion, duration,
+                    profile=None):
+        """Gets temporary credentials from aws like aws_assume_role, but if
+        AWS says that the duration is longer than the role allows, tries
+        again with shorter durations, and remembers the duration that worked
+        for next time. Returns the credentials and the duration they were
+        requested for.
 
-        subprocess.call([shutil.which("aws"), "configure", "set",
-                         "--profile", profile, key, value],
-                        env=newenv)
+        principal_arn - the principal_arn (obtained from saml assertion)
+        role_arn      - the arn of the role to assume
+        assertion     - the saml assertion itself (base64 encoded)
+        duration      - how long to request the credentials be valid for
+        profile       - the profile credentials are being fetched for
+        """
+        requested = duration
+        while True:
+            try:
+                aws_creds = self.aws_assume_role(principal_arn, role_arn,
+                                                 assertion, duration, profile)
+                break
+            except exceptions.DurationError:
+                shorter = [d for d in FALLBACK_DURATIONS if d < duration]
+                if not shorter:
+                    raise
+                logging.debug("%s doesn't allow sessions of %d seconds, "
+                              "trying %d", role_arn, duration, shorter[0])
+                duration = shorter[0]
+        if duration != requested:
+            # Only remember a duration once AWS has accepted it
+            self.duration_cache.put(role_arn, duration)
+        return aws_creds, duration
 
     def store_aws_creds_in_profile(self, profile, aws_creds):
         """Stores the temporary AWS credentials in ~/.aws/credentials.
@@ -344,27 +862,35 @@ class OktaAWS(object):
         profile - the profile to store the credentials under
         aws_creds - a dictionary containing the credentials returned from AWS
         """
-        self.set_aws_config(profile, "aws_access_key_id",
-                            aws_creds['AccessKeyId'])
-        self.set_aws_config(profile, "aws_secret_access_key",
-                            aws_creds['SecretAccessKey'])
-        self.set_aws_config(profile, "aws_session_token",
-                            aws_creds['SessionToken'])
+        self.store_aws_creds_in_profiles({profile: aws_creds})
 
-    def is_logged_in(self, session_id):
-        """Checks to see if a given okta session ID is still valid. Will return
-        false if the session has expired and we are no longer logged in to
-        okta.
+    def store_aws_creds_in_profiles(self, creds_by_profile):
+        """Stores temporary AWS credentials for several profiles in
+        ~/.aws/credentials with a single write to the file.
 
-        session_id - the session token that we are verifying
+        creds_by_profile - a dictionary mapping profile names to the
+                           credentials returned from AWS for that profile
         """
-        logging.debug("Verifying if we are already logged in")
-        r = requests.get("https://%s/api/v1/sessions/me" %
-                         self.get_config('okta_server'),
-                         cookies={"sid": session_id})
-        logged_in = r.status_code == 200
-        logging.debug("Logged in: %s", logged_in)
-        return logged_in
+        with self.metrics.phase('store', profiles=len(creds_by_profile)):
+            credentials_file.update_profiles({
+                profile: {
+                    'aws_access_key_id': aws_creds['AccessKeyId'],
+                    'aws_secret_access_key': aws_creds['SecretAccessKey'],
+                    'aws_session_token': aws_creds['SessionToken'],
+                } for profile, aws_creds in creds_by_profile.items()})
+
+    def okta_url(self, path):
+        """Returns the full URL for a path on the okta server. The okta_server
+        setting is normally just a hostname, in which case https is used, but
+        it may also include a scheme and port (e.g. http://localhost:8080),
+        which is useful when testing against a local server.
+
+        path - the path (and query string) to request
+        """
+        server = self.get_config('okta_server').rstrip('/')
+        if '://' not in server:
+            server = "https://%s" % server
+        return server + path
 
     def verify_totp_factor(self, url, statetoken):
         """Verifies the totp factor passcode, returning a single use session
@@ -374,11 +900,12 @@ class OktaAWS(object):
         statetoken - the state token provided when verifying totp factor
         """
         passcode = input("Enter your passcode: ")
-        r = requests.post(url,
-                          json={
-                              "stateToken": statetoken,
-                              "passCode": passcode
-                          })
+        with self.metrics.phase('mfa'):
+            r = self.http.post(url,
+                               json={
+                                   "stateToken": statetoken,
+                                   "passCode": passcode
+                               })
         if r.status_code == 403:
             raise exceptions.LoginError("Incorrect passcode")
         if r.status_code != 200:
@@ -387,18 +914,102 @@ class OktaAWS(object):
                 "Login request returned HTTP status %s" % r.status_code)
         return r.json()
 
+    def verify_push_factor(self, url, statetoken):
+        """Sends an Okta Verify push notification and waits for the user to
+        approve it, polling okta with exponential backoff. Returns the
+        authn response containing a single use session token. Raises
+        exceptions.LoginError if the push is rejected or isn't approved
+        within push_timeout seconds.
+
+        url        - the push factor verification url
+        statetoken - the state token provided when verifying the factor
+        """
+        from okta_aws import spinner
+
+        def post(url):
+            with self.metrics.phase('mfa'):
+                r = self.http.post(url, json={"stateToken": statetoken})
+            if r.status_code != 200:
+                logging.debug(r.text)
+                raise exceptions.LoginError(
+                    "Push request returned HTTP status %s" % r.status_code)
+            return r.json()
+
+        session_data = post(url)
+        deadline = time.monotonic() + self.get_config('push_timeout',
+                                                      DEFAULT_PUSH_TIMEOUT)
+        delay = PUSH_POLL_INITIAL
+        waiting = spinner.Spinner("Waiting for Okta Verify push approval")
+        try:
+            while session_data['status'] == 'MFA_CHALLENGE':
+                result = session_data.get('factorResult')
+                if result == 'REJECTED':
+                    raise exceptions.LoginError("Push notification rejected")
+                if result == 'TIMEOUT':
+                    raise exceptions.LoginError(
+                        "Push notification timed out")
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise exceptions.LoginError(
+                        "Timed out waiting for push notification approval")
+                waiting.wait(min(delay, remaining))
+                delay = min(delay * PUSH_POLL_BACKOFF, PUSH_POLL_MAX)
+                session_data = post(session_data['_links']['next']['href'])
+        except exceptions.LoginError:
+            waiting.finish('failed')
+            raise
+        waiting.finish('approved')
+        return session_data
+
+    def factor_preference(self):
+        """Returns the MFA factor types to try, most preferred first, from
+        the factor_preference setting. Factors that need typing in a code
+        are left out when stdin isn't a terminal."""
+        preference = self.get_config('factor_preference',
+                                     DEFAULT_FACTOR_PREFERENCE)
+        if isinstance(preference, str):
+            preference = [p.strip() for p in preference.split(',')]
+        if not sys.stdin.isatty():
+            preference = [p for p in preference if p != 'token:software:totp']
+        return [p for p in preference if p in DEFAULT_FACTOR_PREFERENCE]
+
+    def verify_mfa(self, session_data):
+        """Verifies one of the user's MFA factors, choosing the first one
+        in factor_preference that the user is enrolled in. Returns the authn
+        response containing a single use session token.
+
+        session_data - the MFA_REQUIRED response from the authn API
+        """
+        statetoken = session_data["stateToken"]
+        factors = session_data["_embedded"]["factors"]
+        for factor_type in self.factor_preference():
+            for factor in factors:
+                if factor["factorType"] != factor_type:
+                    continue
+                logging.debug("Using MFA factor %s (%s)", factor_type,
+                              factor.get("provider"))
+                url = factor["_links"]["verify"]["href"]
+                if factor_type == 'push':
+                    return self.verify_push_factor(url, statetoken)
+                return self.verify_totp_factor(url, statetoken)
+        raise exceptions.LoginError(
+            "None of your MFA factors (%s) can be used. Supported factors "
+            "are: %s" % (', '.join(f["factorType"] for f in factors),
+                         ', '.join(self.factor_preference())))
+
     def log_in_to_okta(self, password):
         """Logs in to okta using the authn API, returning a single use session
         token that can be exchanged for a long lived session ID.
 
         password - the user's okta password
         """
-        r = requests.post(
-            "https://%s/api/v1/authn" % self.get_config('okta_server'),
-            json={
-                "username": self.get_config('username'),
-                "password": password
-            })
+        with self.metrics.phase('authn'):
+            r = self.http.post(
+                self.okta_url("/api/v1/authn"),
+                json={
+                    "username": self.get_config('username'),
+                    "password": password
+                })
         if r.status_code == 401:
             raise exceptions.LoginError("Incorrect password")
         if r.status_code != 200:
@@ -412,12 +1023,7 @@ class OktaAWS(object):
                 "Unknown error (missing status field in response)")
         if session_data['status'] == 'MFA_REQUIRED':
             logging.debug('MFA Required')
-            statetoken = session_data["stateToken"]
-            for factor in session_data["_embedded"]["factors"]:
-                # TODO - Add other factors
-                if factor["factorType"] == "token:software:totp":
-                    url = factor["_links"]["verify"]["href"]
-                    session_data = self.verify_totp_factor(url, statetoken)
+            session_data = self.verify_mfa(session_data)
         if session_data['status'] != 'SUCCESS':
             raise exceptions.LoginError(
                 session_data['status'].title().replace('_', ' '))
@@ -426,77 +1032,238 @@ class OktaAWS(object):
             raise exceptions.LoginError("Missing session token")
         return session_data['sessionToken']
 
-    def get_session_id(self, session_token):
-        """Returns a (long lived) session ID given a (single use) session
-        token.
+    def create_session(self, session_token):
+        """Exchanges a (single use) session token for a (long lived)
+        session. Returns okta's description of the session, which includes
+        the session ID and when it expires, or None if it failed.
 
         session_token - the single use token returned when logging in to okta
         """
-        r = requests.post(
-            "https://%s/api/v1/sessions" % self.get_config('okta_server'),
-            json={"sessionToken": session_token})
+        with self.metrics.phase('sessions'):
+            r = self.http.post(
+                self.okta_url("/api/v1/sessions"),
+                json={"sessionToken": session_token})
         if r.status_code != 200:
             logging.debug(r.text)
             return None
-        return r.json()['id']
+        return r.json()
 
-    def get_assigned_applications(self, session_id):
-        """Queries okta to get a list of AWS applications that have been
-        assigned to the user. Returns a dictionary mapping the profile names
-        to log in URLs for each assigned application.
+    def iter_assigned_applications(self, session_id):
+        """Queries okta for the AWS applications that have been assigned to
+        the user, yielding (application name, log in URL) pairs as each page
+        of results arrives. Follows the Link headers okta uses to paginate
+        results, and parses each page as it is downloaded. Raises
+        exceptions.ApplicationError if the list can't be fetched.
 
         session_id - the okta session ID needed to make api calls
         """
-        # TODO - proper pagination on this
         logging.debug("Getting assigned application links from okta")
-        r = requests.get("https://%s/api/v1/users/me/appLinks?limit=1000" %
-                         self.get_config('okta_server'),
-                         cookies={"sid": session_id})
-        if r.status_code != 200:
-            logging.error("Error getting assigned application list")
-            logging.debug(r.text)
+        url = self.okta_url("/api/v1/users/me/appLinks?limit=%d" %
+                            self.get_config('applinks_page_size', 200))
+        while url is not None:
+            with self.metrics.phase('applinks'), \
+                    self.http.get(url, cookies={"sid": session_id},
+                                  stream=True) as r:
+                if r.status_code in (401, 403):
+                    logging.debug(r.text)
+                    self.forget_session_expiry()
+                    raise exceptions.SessionError(
+                        "Okta rejected the session when getting the "
+                        "assigned application list (HTTP status %s)" %
+                        r.status_code)
+                if r.status_code != 200:
+                    logging.debug(r.text)
+                    raise exceptions.ApplicationError(
+                        "Error getting assigned application list (HTTP "
+                        "status %s)" % r.status_code)
+                try:
+                    for i in jsonstream.iter_json_array(
+                            r.iter_content(chunk_size=16384)):
+                        if i['appName'] == 'amazon_aws':
+                            yield i['label'], i['linkUrl']
+                except ValueError as e:
+                    raise exceptions.ApplicationError(
+                        "Invalid assigned application list: %s" % e)
+                url = r.links.get('next', {}).get('url')
+
+    def shorten_appname(self, appname):
+        """Converts a long application name such as
+        'Company Engineering (dev use) AWS' to something suitable for use in
+        an aws profile such as 'company-engineering'.
+
+        appname - the application name to shorten
+        """
+        newname = re.sub(" *AWS$", "", appname)  # Remove AWS suffix
+        newname = re.sub(r" *\(.*\)", "", newname)  # Remove anything in parens
+        newname = newname.lower()
+        newname = re.sub(" +", "-", newname)
+        logging.debug("%s => %s", appname, newname)
+        return newname
+
+    @property
+    def applinks_cache(self):
+        """The cache of the list of assigned applications"""
+        return self.cache_store('applinks')
+
+    def applinks_cache_key(self):
+        """Returns the key the application list is cached under. The list
+        depends on who we log in as, and whether names are shortened."""
+        return "%s|%s|%s" % (self.get_config('okta_server'),
+                             self.get_config('username'),
+                             bool(self.get_config('short_profile_names')))
+
+    def load_cached_applinks(self):
+        """Returns the cached mapping of profile names to application links,
+        or None if it isn't cached or is older than applinks_ttl seconds.
+        """
+        entry = self.applinks_cache.get(self.applinks_cache_key())
+        if entry is None:
+            return None
+        if time.time() - entry['fetched_at'] > self.get_config('applinks_ttl'):
+            logging.debug("Cached application list has expired")
             return None
-        applinks = {i['label']: i['linkUrl'] for i in r.json()
-                    if i['appName'] == 'amazon_aws'}
-        return applinks
+        logging.debug("Using cached application list")
+        return entry['applinks']
 
-    def shorten_appnames(self, applinks):
-        """Converts long application names such as
-        'Company Engineering AWS (dev use)' to something suitable for use in
-        an aws profile such as 'company-engineering'.
+    def iter_applinks(self, session_id, profile=None):
+        """Yields (profile name, log in URL) pairs for each AWS application
+        assigned to the user, shortening the names if short_profile_names is
+        set. When the list has to be fetched from okta, pairs are yielded as
+        soon as each page arrives.
+
+        The list is cached for applinks_ttl seconds. It is fetched from okta
+        again if the cache has expired, if --force was given, or if profile
+        isn't in the cached list (in case it was assigned recently).
+
+        session_id - the okta session ID needed to make api calls
+        profile    - the profile that needs to be in the list, if any
+        """
+        if not self.args.force:
+            applinks = self.load_cached_applinks()
+            # For a profile in a role chain, what matters is the profile
+            # whose credentials come from okta
+            real_profile = profile and self.chain_root(profile)
+            if applinks is not None and \
+                    (profile is None or real_profile in applinks):
+                yield from applinks.items()
+                return
+        applinks = {}
+        for name, url in self.iter_assigned_applications(session_id):
+            if self.get_config('short_profile_names'):
+                name = self.shorten_appname(name)
+            applinks[name] = url
+            yield name, url
+        self.applinks_cache.set(self.applinks_cache_key(), {
+            'fetched_at': time.time(),
+            'applinks': applinks,
+        }, self.get_config('applinks_ttl'))
+
+    def get_applinks(self, session_id, profile=None):
+        """Returns a dictionary mapping profile names to log in URLs for each
+        AWS application assigned to the user. See iter_applinks.
+
+        session_id - the okta session ID needed to make api calls
+        profile    - the profile that needs to be in the list, if any
+        """
+        return dict(self.iter_applinks(session_id, profile))
+
+    def list_profiles(self, applinks, names_only=False):
+        """Prints the available profiles along with any aliases.
 
-        applinks - a dictionary mapping application names to application links.
+        applinks   - a mapping of profile names to application links
+        names_only - print only the profile names, one per line (for use
+                     in shell completion)
         """
-        logging.debug("Shortening application names")
-        newapplinks = {}
-        for k, v in applinks.items():
-            newk = re.sub(" *AWS$", "", k)  # Remove AWS suffix
-            newk = re.sub(r" *\(.*\)", "", newk)  # Remove anything in parens
-            newk = newk.lower()
-            newk = re.sub(" +", "-", newk)
-            newapplinks[newk] = v
-            logging.debug("%s => %s", k, newk)
-        return newapplinks
+        if names_only:
+            for profile in applinks.keys():
+                print(profile)
+            return
+        print("Available profiles:")
+        reverse_aliases = {}
+        for k, v in self.config['aliases'].items():
+            reverse_aliases.setdefault(v, []).append(k)
+        for profile in applinks.keys():
+            if profile in reverse_aliases:
+                print("%s (Aliases: %s)" % (profile, ', '.join(
+                    reverse_aliases[profile])))
+            else:
+                print(profile)
 
     def get_saml_assertion(self, session_id, app_url):
         """Sends a request to the application link, and extracts a SAML
-        assertion from the response.
+        assertion from the response. Raises exceptions.SAMLError if okta
+        won't give an assertion for the application, or
+        exceptions.SessionError if that's because it doesn't accept the
+        session (see saml_refused).
 
         session_id - okta session ID needed to make api calls
         app_url    - The URL used to log in to the okta application
         """
-        r = requests.post(app_url, cookies={"sid": session_id})
-
+        from okta_aws import saml
+
+        with self.metrics.phase('saml'):
+            r = self.http.post(app_url, cookies={"sid": session_id})
+            assertion = None
+            if r.status_code == 200:
+                assertion = saml.form_value(r.text, 'SAMLResponse')
+
+        if r.status_code in (401, 403):
+            raise self.saml_refused(
+                session_id, "Okta refused to give a SAML assertion (HTTP "
+                "status %s)" % r.status_code)
         if r.status_code != 200:
-            logging.error("Error getting saml assertion. HTML response %s",
-                          r.status_code)
+            logging.error("Error getting saml assertion. HTML response "
+                          "%s", r.status_code)
             return None
+        if assertion is None:
+            # e.g. a login page, or a sign on policy asking for another
+            # factor
+            raise self.saml_refused(
+                session_id, "Okta didn't return a SAML assertion")
+        return assertion
+
+    def saml_refused(self, session_id, reason):
+        """Returns the exception to raise when okta won't give a SAML
+        assertion for an application. That might be because the okta
+        session is no longer valid, which affects every application, or
+        because of something that only affects this application, such as a
+        sign on policy. okta is asked to refresh the session to find out
+        which, and exceptions.SessionError is returned only if it doesn't
+        accept the session. Otherwise it is exceptions.SAMLError, which
+        only fails this application.
+
+        session_id - the okta session ID that was used
+        reason     - why there is no SAML assertion
+        """
+        if self.refresh_session(session_id):
+            return exceptions.SAMLError(reason)
+        return exceptions.SessionError(
+            "%s: okta no longer accepts the session" % reason)
 
-        match = re.search(r'<input name="SAMLResponse".*value="([^"]*)"',
-                          r.text)
-        if not match:
-            return None
-        return html.unescape(match.group(1))
+    def saml_expiry(self, saml_assertion):
+        """Returns the time (as an ISO 8601 timestamp) after which a SAML
+        assertion can no longer be used, or None if it doesn't say.
+
+        saml_assertion - the saml asssertion given by okta, base64 encoded.
+        """
+        with self.metrics.phase('parse'):
+            return self.parse_assertion(saml_assertion).not_on_or_after
+
+    def get_assertion(self, session_id, app_url):
+        """Returns a SAML assertion for an okta application, reusing a
+        previous assertion for the same application if it is still valid.
+
+        session_id - okta session ID needed to make api calls
+        app_url    - The URL used to log in to the okta application
+        """
+        def fetch():
+            saml_assertion = self.get_saml_assertion(session_id, app_url)
+            if saml_assertion is None:
+                return None, None
+            return saml_assertion, self.saml_expiry(saml_assertion)
+
+        key = "%s|%s" % (self.get_config('username'), app_url)
+        return self.assertion_cache.get_or_fetch(key, fetch)
 
     def friendly_interval(self, seconds):
         """Converts a number of seconds into something a little friendlier,
@@ -512,129 +1279,741 @@ class OktaAWS(object):
             return "1 minute"
         return "%.2g minutes" % (seconds / 60.0)
 
-    def fetch_credentials(self, applinks, session_id):
+    @property
+    def session_store(self):
+        """Where the okta session is saved between runs. This is
+        cookie_file, unless cache_store says the caches should be kept
+        somewhere more secure."""
+        from okta_aws import session
+
+        store = None
+        if self.get_config('cache_store', 'file') != 'file':
+            store = self.cache_store('session')
+        return session.SessionStore(self.get_config('cookie_file'), store)
+
+    def load_session_id(self):
+        """Loads the okta session ID saved in the cookie file by a previous
+        run. Returns None if there is no saved session or it has expired.
+
+        If the session is known to be valid for at least another
+        session_refresh_threshold seconds, it is used without contacting
+        okta. Otherwise okta is asked to refresh the session, which also
+        tells us whether it is still valid.
+        """
+        store = self.session_store
+        session_id = store.load()
+        if session_id is None:
+            return None
+        expires_at = store.expires_at(session_id)
+        if expires_at is not None:
+            try:
+                remaining = cache.seconds_until(expires_at)
+            except (TypeError, ValueError):
+                remaining = 0
+            if remaining > self.get_config('session_refresh_threshold'):
+                logging.debug("Okta session is valid for another %s",
+                              self.friendly_interval(remaining))
+                return session_id
+        if not self.refresh_session(session_id):
+            return None
+        return session_id
+
+    def refresh_session(self, session_id):
+        """Asks okta to extend a session, recording when it now expires.
+        Returns False if the session is no longer valid.
+
+        session_id - the okta session ID to refresh
+        """
+        logging.debug("Refreshing okta session")
+        with self.metrics.phase('session refresh'):
+            r = self.http.post(
+                self.okta_url("/api/v1/sessions/me/lifecycle/refresh"),
+                cookies={"sid": session_id})
+        if r.status_code != 200:
+            logging.debug("Okta session refresh returned HTTP status %s",
+                          r.status_code)
+            self.forget_session_expiry()
+            return False
+        expires_at = r.json().get('expiresAt')
+        if expires_at is not None and not self.args.no_cookies:
+            self.session_store.save_expiry(session_id, expires_at)
+        return True
+
+    def forget_session_expiry(self):
+        """Called when okta rejects the session, so that it is checked again
+        before it is next used instead of being assumed to be valid."""
+        if not self.args.no_cookies and self.get_config('cookie_file'):
+            self.session_store.forget_expiry()
+
+    def log_in(self):
+        """Prompts the user for their password and logs in to okta, saving
+        the new session ID to the cookie file. Returns the session ID.
+        """
+        print("Okta Username:", self.get_config('username'))
+        password = ""
+        while password == "":
+            password = getpass.getpass("Okta Password: ")
+        sys.stdout.flush()
+
+        try:
+            onetimetoken = self.log_in_to_okta(password)
+        except (exceptions.LoginError, exceptions.NetworkError) as e:
+            logging.error("Error logging into okta: %s", e.message)
+            sys.exit(1)
+
+        session = self.create_session(onetimetoken)
+        if session is None:
+            logging.error("Error creating okta session")
+            sys.exit(1)
+        session_id = session['id']
+        if not self.args.no_cookies:
+            self.session_store.save(session_id, session.get('expiresAt'))
+        return session_id
+
+    def get_okta_session(self):
+        """Returns a valid okta session ID, reusing the saved session if
+        possible and logging in to okta otherwise. When not running
+        interactively, raises exceptions.LoginError instead of prompting for
+        a password.
+        """
+        session_id = None
+        if not self.args.no_cookies:
+            session_id = self.load_session_id()
+        self.saved_session = session_id is not None
+        if session_id is None:
+            session_id = self.log_in_if_possible()
+        return session_id
+
+    def log_in_if_possible(self):
+        """Logs in to okta, returning the new session ID. When not running
+        interactively, raises exceptions.LoginError instead of prompting for
+        a password."""
+        if not self.interactive:
+            raise exceptions.LoginError(
+                "Not logged in to okta. Run 'okta_aws %s' to log in." %
+                self.profile)
+        return self.log_in()
+
+    def renew_session(self, session_id):
+        """Called when okta rejects a saved session that was expected to be
+        valid, e.g. because it was revoked. Asks okta to refresh the session,
+        and logs in again if that fails. Returns the session ID to use.
+
+        session_id - the okta session ID that was rejected
+        """
+        if self.refresh_session(session_id):
+            return session_id
+        self.saved_session = False
+        return self.log_in_if_possible()
+
+    def with_okta_session(self, action):
+        """Calls action with an okta session ID from get_okta_session,
+        returning what it returns. If okta rejects a saved session (action
+        raises exceptions.SessionError), the session is renewed with
+        renew_session and action is called once more.
+
+        action - called with the okta session ID
+        """
+        session_id = self.get_okta_session()
+        try:
+            return action(session_id)
+        except exceptions.SessionError as e:
+            if not self.saved_session:
+                raise
+            logging.debug("%s, renewing the session", e.message)
+            return action(self.renew_session(session_id))
+
+    def retry_rejected(self, results, session_id, retry):
+        """Fetches credentials again for the profiles in results that failed
+        because okta stopped accepting a saved session part way through,
+        after renewing the session. Profiles that failed for other reasons,
+        or that succeeded, aren't fetched again. Returns results, updated
+        with the new results for those profiles.
+
+        results    - a mapping of profiles to exceptions (or None on success)
+                     as returned by fetch_all_credentials
+        session_id - the okta session ID that was used
+        retry      - called with the renewed session ID and the list of
+                     profiles to fetch again, returning their results
+        """
+        rejected = [p for p, e in results.items()
+                    if isinstance(e, exceptions.SessionError)]
+        if not rejected or not self.saved_session:
+            return results
+        logging.info("Okta no longer accepts the session, renewing it to "
+                     "fetch credentials for %d profiles", len(rejected))
+        try:
+            session_id = self.renew_session(session_id)
+        except exceptions.LoginError as e:
+            logging.error(e.message)
+            return results
+        results.update(retry(session_id, rejected))
+        return results
+
+    def fetch_credentials(self, applinks, session_id, profile=None,
+                          store=True, use_cache=True, source_creds=None):
         """Performs the various steps needed to actually get a set of
-        temporary credentials and store them. Doesn't return anything, but
-        temporary credentials should be stored in ~/.aws/credentials by the
-        time this method has finished.
+        temporary credentials and store them. Returns the credentials, which
+        will also have been stored in ~/.aws/credentials by the time this
+        method has finished unless store is False. Raises an exceptions.Error
+        subclass if credentials couldn't be obtained.
 
         applinks   - a mapping of profile names to application links
         session_id - okta session ID needed to make API calls
+        profile    - the profile to fetch credentials for (defaults to the
+                     profile given on the command line)
+        store      - whether to store the credentials in ~/.aws/credentials
+        use_cache  - whether to return cached credentials if they are still
+                     valid
+        source_creds - for a profile in a role chain, credentials for its
+                       source_profile (fetched if not given)
+        """
+        if profile is None:
+            profile = self.profile
+
+        with self.metrics.phase('fetch', profile) as record:
+            cached_creds = None
+            if use_cache:
+                cached_creds = self.get_cached_credentials(profile)
+            if cached_creds is not None:
+                logging.info(
+                    "Credentials for %s are still valid for %s", profile,
+                    self.friendly_interval(
+                        cache.seconds_until(cached_creds['Expiration'])))
+                record['cached'] = True
+                return cached_creds
+
+            source = self.source_profile(profile)
+            if source is not None:
+                if source_creds is None:
+                    source_creds = self.get_source_credentials(
+                        applinks, session_id, source)
+                aws_creds, session_duration = self.assume_chained_role(
+                    source_creds, profile)
+            else:
+                aws_creds, session_duration = self.assume_okta_role(
+                    applinks, session_id, profile)
+            if self.use_credential_cache:
+                self.credential_cache.put(
+                    profile, self.requested_role(profile),
+                    self.get_config('session_duration', profile=profile),
+                    aws_creds)
+            if store:
+                self.store_aws_creds_in_profile(profile, aws_creds)
+                logging.info("Temporary credentials stored in profile %s",
+                             profile)
+                logging.info("Credentials expire in %s",
+                             self.friendly_interval(session_duration))
+            return aws_creds
+
+    def assume_okta_role(self, applinks, session_id, profile):
+        """Assumes a role using a SAML assertion from okta. Returns the
+        credentials and the duration they were requested for.
+
+        applinks   - a mapping of profile names to application links
+        session_id - okta session ID needed to make API calls
+        profile    - the profile to fetch credentials for
         """
         # Resolve any profile alias and store it in real_profile
-        real_profile = self.config['aliases'].get(self.profile, self.profile)
+        real_profile = self.config['aliases'].get(profile, profile)
 
         if real_profile not in applinks:
             alias_msg = ""
-            if real_profile != self.profile:
+            if real_profile != profile:
                 alias_msg = " (an alias that resolved to %s)" % real_profile
-            print("ERROR: %s%s isn't a valid profile name" % (
-                self.profile, alias_msg))
-            print("Valid profiles:", ', '.join(list(applinks.keys())))
-            sys.exit(1)
+            raise exceptions.ProfileError(
+                "%s%s isn't a valid profile name" % (profile, alias_msg))
 
-        saml_assertion = self.get_saml_assertion(
-            session_id, applinks[real_profile])
+        saml_assertion = self.get_assertion(session_id,
+                                            applinks[real_profile])
         if saml_assertion is None:
-            logging.error("Problem getting SAML assertion")
-            sys.exit(1)
+            raise exceptions.SAMLError("Problem getting SAML assertion")
 
-        principal_arn, role_arn = self.get_arns(saml_assertion)
+        principal_arn, role_arn = self.get_arns(saml_assertion, profile)
 
         logging.info("Assuming AWS role %s...", role_arn.split("/")[-1])
-        session_duration = self.get_config('session_duration')
-        try:
-            aws_creds = self.aws_assume_role(principal_arn, role_arn,
-                                             saml_assertion, session_duration)
-        except exceptions.AssumeRoleError as e:
-            logging.error("Unable to get temporary credentials: %s", e)
+        return self.assume_role(
+            principal_arn, role_arn, saml_assertion,
+            self.session_duration(saml_assertion, role_arn, profile),
+            profile)
+
+    def fetch_all_credentials(self, applinks, session_id, jobs=1,
+                              chained=(), source_applinks=None):
+        """Fetches credentials for every profile in applinks, using up to
+        `jobs` worker threads, and stores them all in ~/.aws/credentials with
+        a single write. A failure for one profile doesn't stop
+        credentials being fetched for the others. Returns a dictionary
+        mapping each profile to the exception raised while fetching its
+        credentials, or None if fetching succeeded.
+
+        Profiles in role chains are fetched once the profiles in applinks
+        are done, a level of the chains at a time (see chain_levels), so the
+        credentials for each source_profile are fetched once and then used
+        for all of the roles assumed from it in parallel.
+
+        applinks   - a mapping of profile names to application links, or an
+                     iterable of (profile, application link) pairs. Fetching
+                     starts as soon as the first pair is available.
+        session_id - okta session ID needed to make API calls
+        jobs       - the maximum number of profiles to fetch at once
+        chained    - profiles in role chains to fetch as well
+        source_applinks - application links for source profiles of the
+                          role chains that aren't in applinks
+        """
+        from concurrent.futures import ThreadPoolExecutor, as_completed
+
+        if hasattr(applinks, 'items'):
+            applinks = applinks.items()
+        results = {}
+        creds_by_profile = {}
+        listing_error = None
+        known_applinks = dict(source_applinks or {})
+
+        def collect(futures):
+            for future in as_completed(futures):
+                profile = futures[future]
+                try:
+                    creds_by_profile[profile] = future.result()
+                    results[profile] = None
+                except Exception as e:  # pylint: disable=broad-except
+                    # Any failure is reported against its profile rather
+                    # than aborting the whole run.
+                    logging.error("%s: %s", profile, e)
+                    results[profile] = e
+
+        with ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+            futures = {}
+            try:
+                for profile, app_url in applinks:
+                    logging.info("Fetching credentials for: %s", profile)
+                    real_profile = self.config['aliases'].get(profile,
+                                                              profile)
+                    known_applinks[real_profile] = app_url
+                    futures[executor.submit(self.fetch_credentials,
+                                            {real_profile: app_url},
+                                            session_id, profile,
+                                            store=False)] = profile
+            except exceptions.Error as e:
+                # Still finish (and store) the profiles we already know about
+                listing_error = e
+            collect(futures)
+
+            for level in self.chain_levels(chained):
+                futures = {}
+                for profile in level:
+                    source = self.source_profile(profile)
+                    if results.get(source) is not None:
+                        logging.error("%s: no credentials for %s", profile,
+                                      source)
+                        if isinstance(results[source],
+                                      exceptions.SessionError):
+                            # So that it is fetched again if the session is
+                            # renewed (see retry_rejected)
+                            results[profile] = results[source]
+                        else:
+                            results[profile] = exceptions.ProfileError(
+                                "Couldn't fetch credentials for source "
+                                "profile %s" % source)
+                        continue
+                    logging.info("Fetching credentials for: %s", profile)
+                    futures[executor.submit(
+                        self.fetch_credentials, known_applinks, session_id,
+                        profile, store=False,
+                        source_creds=creds_by_profile.get(source))] = \
+                        profile
+                collect(futures)
+
+        if creds_by_profile:
+            self.store_aws_creds_in_profiles(creds_by_profile)
+            logging.info("Temporary credentials stored in %d profiles",
+                         len(creds_by_profile))
+        if listing_error is not None:
+            raise listing_error
+        return results
+
+    def fetch_selected_credentials(self, applinks, session_id):
+        """Fetches credentials for the profiles chosen with --select and
+        --group (see select_profiles), and stores them all in
+        ~/.aws/credentials with a single write. Returns a dictionary
+        mapping each profile to the exception raised while fetching its
+        credentials, or None if fetching succeeded.
+
+        applinks   - a mapping of profile names to application links
+        session_id - okta session ID needed to make API calls
+        """
+        return self.fetch_profiles(
+            applinks, session_id,
+            self.select_profiles(list(applinks) + self.role_chains()))
+
+    def fetch_profiles(self, applinks, session_id, profiles):
+        """Fetches credentials for a list of profiles, which can be in
+        applinks or in role chains, in the same way as
+        fetch_selected_credentials.
+
+        applinks   - a mapping of profile names to application links
+        session_id - okta session ID needed to make API calls
+        profiles   - the profiles to fetch credentials for
+        """
+        okta_profiles = []
+        chained = []
+        unknown = {}
+        for profile in profiles:
+            if self.source_profile(profile) is not None:
+                chained.append(profile)
+            elif self.config['aliases'].get(profile, profile) in applinks:
+                okta_profiles.append(profile)
+            else:
+                unknown[profile] = exceptions.ProfileError(
+                    "%s isn't a valid profile name" % profile)
+        logging.info("Fetching credentials for %d profiles", len(profiles))
+        results = self.fetch_all_credentials(
+            [(p, applinks[self.config['aliases'].get(p, p)])
+             for p in okta_profiles],
+            session_id, self.args.jobs, chained=chained,
+            source_applinks=applinks)
+        results.update(unknown)
+        return results
+
+    def fetch_role_targets(self, applinks, session_id):
+        """Assumes each role given on the command line as ROLE=PROFILE in
+        the account for the profile given on the command line, storing the
+        credentials for each role in its own profile. A single SAML assertion
+        is used for all of the roles. Exits when finished.
+
+        applinks   - a mapping of profile names to application links
+        session_id - okta session ID needed to make API calls
+        """
+        real_profile = self.config['aliases'].get(self.profile, self.profile)
+        if real_profile not in applinks:
+            print("ERROR: %s isn't a valid profile name" % self.profile)
+            print("Valid profiles:", ', '.join(list(applinks.keys())))
             sys.exit(1)
-        self.store_aws_creds_in_profile(self.profile, aws_creds)
-        logging.info("Temporary credentials stored in profile %s",
-                     self.profile)
-        logging.info("Credentials expire in %s",
-                     self.friendly_interval(session_duration))
+        app_url = applinks[real_profile]
+
+        def fetch(session_id, targets):
+            return self.fetch_all_credentials(
+                [(target, app_url) for target in targets], session_id,
+                self.args.jobs)
+
+        results = self.retry_rejected(
+            fetch(session_id, list(self.role_targets())), session_id, fetch)
+        sys.exit(0 if self.report_results(results) else 1)
+
+    def report_results(self, results):
+        """Prints a per-profile summary of a --all run. Returns True if
+        credentials were fetched for every profile.
+
+        results - a mapping of profiles to exceptions (or None on success) as
+                  returned by fetch_all_credentials
+        """
+        failed = sorted(p for p, e in results.items() if e is not None)
+        succeeded = sorted(p for p, e in results.items() if e is None)
+        print("Fetched credentials for %d of %d profiles" % (
+            len(succeeded), len(results)))
+        for profile in succeeded:
+            print("  OK      %s" % profile)
+        for profile in failed:
+            print("  FAILED  %s: %s" % (profile, results[profile]))
+        return not failed
+
+    def daemon(self, applinks, session_id):
+        """Runs forever, renewing credentials for each profile in
+        daemon_profiles (or the profile given on the command line)
+        refresh_margin seconds before they expire. The okta session is
+        checked every session_check_interval seconds to keep it alive.
+
+        applinks   - a mapping of profile names to application links
+        session_id - okta session ID needed to make API calls
+        """
+        profiles = self.get_config('daemon_profiles') or [self.profile]
+        state = {'session_id': session_id, 'fetched': set()}
+
+        def refresh(profile):
+            # Valid cached credentials are fine when starting up, but once
+            # we're due to refresh they're about to expire.
+            aws_creds = self.fetch_credentials(
+                applinks, state['session_id'], profile,
+                use_cache=profile not in state['fetched'])
+            state['fetched'].add(profile)
+            expiration = cache.parse_timestamp(aws_creds['Expiration'])
+            logging.info("Credentials for %s renewed, valid until %s",
+                         profile, expiration.astimezone().strftime('%X'))
+            return expiration.timestamp()
+
+        def keepalive():
+            if self.refresh_session(state['session_id']):
+                return
+            if not self.interactive or not sys.stdin.isatty():
+                raise exceptions.LoginError("Okta session has expired")
+            logging.info("Okta session has expired, please log in again")
+            state['session_id'] = self.log_in()
+
+        scheduler = daemon.RefreshScheduler(
+            refresh, keepalive,
+            margin=self.get_config('refresh_margin'),
+            keepalive_interval=self.get_config('session_check_interval'))
+        now = scheduler.clock()
+        for profile in profiles:
+            scheduler.schedule(profile, now)
+        logging.info("Keeping credentials fresh for: %s",
+                     ', '.join(profiles))
+        scheduler.run()
+
+    def serve(self, applinks, session_id):
+        """Runs a local HTTP server that hands out credentials for any
+        assigned profile using the container credentials protocol. Credentials
+        are kept in memory only, and are fetched when first requested and
+        again when they are about to expire. If okta stops accepting the okta
+        session, e.g. because it expired while the server was idle, it is
+        renewed with renew_session.
+
+        applinks   - a mapping of profile names to application links
+        session_id - okta session ID needed to make API calls
+        """
+        import secrets
+        from okta_aws import server
+
+        # Nothing secret is written to disk: credentials are only kept by
+        # the server, and SAML assertions only in memory
+        self.use_credential_cache = False
+        with self._assertion_cache_lock:
+            self._assertion_cache = cache.AssertionCache()
+
+        state = {'session_id': session_id}
+        # Stops requests being handled at once each renewing the session
+        renew_lock = threading.Lock()
+
+        def fetch(profile):
+            used = state['session_id']
+            try:
+                return self.fetch_credentials(applinks, used, profile,
+                                              store=False, use_cache=False)
+            except exceptions.SessionError as e:
+                with renew_lock:
+                    # Another request may have renewed it already
+                    if state['session_id'] == used:
+                        logging.info("%s, renewing the session", e.message)
+                        state['session_id'] = self.renew_session(used)
+            return self.fetch_credentials(applinks, state['session_id'],
+                                          profile, store=False,
+                                          use_cache=False)
+
+        store = server.CredentialStore(
+            fetch, min_lifetime=self.get_config('refresh_margin'))
+        token = self.get_config('serve_token') or secrets.token_urlsafe(32)
+        httpd = server.CredentialServer(
+            ('127.0.0.1', self.get_config('serve_port')), store, token)
+        url = "http://127.0.0.1:%d%s" % (httpd.server_address[1],
+                                          server.PATH_PREFIX)
+        print("Serving credentials on %sPROFILE. To use them, run:" % url)
+        print()
+        print("export AWS_CONTAINER_CREDENTIALS_FULL_URI=%s%s" % (
+            url, self.profile))
+        print("export AWS_CONTAINER_AUTHORIZATION_TOKEN=%s" % token)
+        sys.stdout.flush()
+        try:
+            httpd.serve_forever()
+        finally:
+            httpd.server_close()
+
+    def credential_process_output(self, aws_creds):
+        """Returns credentials in the JSON format expected from a
+        credential_process program by the AWS SDKs.
+
+        aws_creds - a dictionary containing the credentials returned from AWS
+        """
+        expiration = aws_creds['Expiration']
+        if not isinstance(expiration, str):
+            expiration = expiration.isoformat()
+        return json.dumps({
+            'Version': 1,
+            'AccessKeyId': aws_creds['AccessKeyId'],
+            'SecretAccessKey': aws_creds['SecretAccessKey'],
+            'SessionToken': aws_creds['SessionToken'],
+            'Expiration': expiration,
+        })
+
+    def credential_process(self):
+        """Prints credentials for the selected profile for use by the AWS
+        SDKs' credential_process setting. Cached credentials are used if they
+        are still valid. This never prompts for input, and fails if there is
+        no valid okta session.
+        """
+        aws_creds = self.get_cached_credentials(self.profile,
+                                                check_file=False)
+        if aws_creds is None:
+            aws_creds = self.with_okta_session(
+                lambda session_id: self.fetch_credentials(
+                    self.get_applinks(session_id, self.profile), session_id,
+                    store=False))
+        print(self.credential_process_output(aws_creds))
+
+    def aio(self, concurrency=None):
+        """Returns an aio.AsyncOktaAWS for fetching credentials from asyncio
+        code without blocking the event loop.
+
+        concurrency - the maximum number of accounts to fetch at once
+        """
+        from okta_aws import aio
+        return aio.AsyncOktaAWS(self, concurrency or aio.DEFAULT_CONCURRENCY)
 
     def run(self):
         """Main entry point for the application after parsing command line
         arguments."""
         self.setup_logging()
 
-        self.preflight_checks()
+        start = time.monotonic()
+        status = 0
+        try:
+            self.run_command()
+        except SystemExit as e:
+            status = e.code
+            raise
+        except BaseException as e:
+            status = type(e).__name__
+            raise
+        finally:
+            self.report_metrics(time.monotonic() - start, status)
+
+    def report_metrics(self, seconds, status):
+        """Prints the --timings summary, and records the end of the run in
+        the metrics file.
+
+        seconds - how long the run took
+        status  - the exit status, or the name of the exception that ended
+                  the run
+        """
+        self.metrics.write(event='run', seconds=seconds, status=status or 0,
+                           version=__VERSION__,
+                           okta_server=self.get_config('okta_server'))
+        self.metrics.close()
+        if self.args.timings:
+            print(self.metrics.format_summary(seconds), file=sys.stderr)
+
+    def run_command(self):
+        """Does whatever was asked for on the command line"""
+        if not self.args.credential_process:
+            self.preflight_checks()
 
         if self.args.setup:
             self.interactive_setup(self.args.config)
             sys.exit(0)
 
-        self.config = self.load_config(self.args.config)
-
-        if not self.args.no_cookies:
-            if os.path.exists(self.get_config('cookie_file')):
-                logging.debug("Loading session ID from %s",
-                              self.get_config('cookie_file'))
-                with open(self.get_config('cookie_file')) as fh:
-                    session_id = fh.read().rstrip("\n")
-                    # Support old cookie file format
-                    if session_id.startswith('#LWP-Cookies-2.0'):
-                        logging.debug("Converting old cookie file format")
-                        m = re.search(r'sid="([^"]*)"', session_id)
-                        if m:
-                            logging.debug("Found session ID in old cookies")
-                            session_id = m.group(1)
-                        else:
-                            logging.debug("Didn't find session ID in cookies")
-                            session_id = None
-                if session_id is not None \
-                        and not self.is_logged_in(session_id):
-                    session_id = None
-            else:
-                session_id = None
-        else:
-            session_id = None
-
-        if session_id is None:
-            print("Okta Username:", self.get_config('username'))
-            password = ""
-            while password == "":
-                password = getpass.getpass("Okta Password: ")
-            sys.stdout.flush()
+        try:
+            with self.metrics.phase('config'):
+                self.config = self.load_config(self.args.config)
+        except exceptions.ConfigError as e:
+            logging.error(e.message)
+            sys.exit(1)
+        if self.metrics.path is None:
+            self.metrics.path = self.get_config('metrics_file')
+        selecting = self.args.select or self.args.group
+        if selecting:
+            try:
+                self.selection_patterns()
+            except exceptions.ConfigError as e:
+                logging.error(e.message)
+                sys.exit(1)
 
+        if self.args.credential_process:
             try:
-                onetimetoken = self.log_in_to_okta(password)
-            except exceptions.LoginError as e:
-                logging.error("Error logging into okta: %s", e.message)
+                self.credential_process()
+            except exceptions.Error as e:
+                logging.error("%s", e)
                 sys.exit(1)
+            sys.exit(0)
 
-            session_id = self.get_session_id(onetimetoken)
-            if not self.args.no_cookies:
-                logging.debug("Saving session cookie to %s",
-                              self.get_config('cookie_file'))
-                with open(self.get_config('cookie_file'), 'w') as fh:
-                    fh.write(session_id)
+        if not (self.args.all or self.args.list or self.args.daemon or
+                self.args.serve or self.role_targets() or selecting):
+            cached_creds = self.get_cached_credentials(self.profile)
+            if cached_creds is not None:
+                logging.info(
+                    "Credentials for %s are still valid for %s. Use --force "
+                    "to fetch new credentials anyway.", self.profile,
+                    self.friendly_interval(
+                        cache.seconds_until(cached_creds['Expiration'])))
+                sys.exit(0)
 
-        applinks = self.get_assigned_applications(session_id)
-        if self.get_config('short_profile_names'):
-            applinks = self.shorten_appnames(applinks)
+        try:
+            if self.args.list:
+                applinks = None
+                if not self.args.force:
+                    applinks = self.load_cached_applinks()
+                if applinks is None:
+                    applinks = self.with_okta_session(self.get_applinks)
+                if selecting:
+                    applinks = {p: applinks[p]
+                                for p in self.select_profiles(list(applinks))
+                                if p in applinks}
+                self.list_profiles(applinks, names_only=self.args.quiet)
+                sys.exit(0)
+
+            self.with_okta_session(self.run_with_session)
+        except exceptions.SessionError as e:
+            logging.error(e.message)
+            sys.exit(1)
 
-        if self.args.all:
-            for profile in applinks.keys():
-                print("Fetching credentials for:", profile)
-                self.profile = profile
-                self.fetch_credentials(applinks, session_id)
-            sys.exit(0)
+    def run_with_session(self, session_id):
+        """Does whatever was asked for on the command line that needs an okta
+        session, after the config file has been loaded. Raises
+        exceptions.SessionError if okta rejects the session before anything
+        is fetched, or while fetching credentials for a single profile.
+        When fetching several profiles, only the ones okta rejected the
+        session for are retried (see retry_rejected).
 
-        if self.args.list:
-            print("Available profiles:")
-            reverse_aliases = {}
-            for k, v in self.config['aliases'].items():
-                reverse_aliases.setdefault(v, []).append(k)
-            for profile in applinks.keys():
-                if profile in reverse_aliases:
-                    print("%s (Aliases: %s)" % (profile, ', '.join(
-                        reverse_aliases[profile])))
-                else:
-                    print(profile)
+        session_id - okta session ID needed to make API calls
+        """
+        if self.args.select or self.args.group or self.args.all:
+            applinks = {}
+
+            def listed():
+                for profile, app_url in self.iter_applinks(session_id):
+                    applinks[profile] = app_url
+                    yield profile, app_url
+
+            if self.args.all:
+                # Start fetching credentials as soon as the first accounts
+                # are known, rather than waiting for the whole application
+                # list.
+                results = self.fetch_all_credentials(
+                    listed(), session_id, self.args.jobs,
+                    chained=self.role_chains())
+            else:
+                applinks = dict(listed())
+                results = self.fetch_selected_credentials(applinks,
+                                                          session_id)
+            results = self.retry_rejected(
+                results, session_id,
+                lambda session_id, profiles: self.fetch_profiles(
+                    applinks, session_id, profiles))
+            sys.exit(0 if self.report_results(results) else 1)
+
+        if self.args.daemon or self.args.serve:
+            applinks = self.get_applinks(session_id)
+        else:
+            applinks = self.get_applinks(session_id, self.profile)
 
-            sys.exit(0)
+        if self.role_targets():
+            self.fetch_role_targets(applinks, session_id)
+
+        if self.args.daemon:
+            self.daemon(applinks, session_id)
+
+        if self.args.serve:
+            self.serve(applinks, session_id)
 
-        self.fetch_credentials(applinks, session_id)
+        try:
+            self.fetch_credentials(applinks, session_id)
+        except exceptions.SessionError:
+            raise
+        except exceptions.ProfileError as e:
+            print("ERROR: %s" % e.message)
+            print("Valid profiles:", ', '.join(list(applinks.keys())))
+            sys.exit(1)
+        except exceptions.AssumeRoleError as e:
+            logging.error("Unable to get temporary credentials: %s",
+                          e.message)
+            sys.exit(1)
+        except exceptions.Error as e:
+            logging.error(e.message)
+            sys.exit(1)
@@ -0,0 +1,134 @@
+#
+# Copyright 2017 Chef Software
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Extracting the parts of a SAML assertion that okta_aws needs, without
+building a tree for the whole document."""
+
+import base64
+import collections
+import functools
+import html
+import re
+import xml.etree.ElementTree as ET
+
+from okta_aws import cache
+
+ASSERTION_NS = 'urn:oasis:names:tc:SAML:2.0:assertion'
+ATTRIBUTE_TAG = '{%s}Attribute' % ASSERTION_NS
+ATTRIBUTE_VALUE_TAG = '{%s}AttributeValue' % ASSERTION_NS
+ATTRIBUTE_STATEMENT_TAG = '{%s}AttributeStatement' % ASSERTION_NS
+
+ROLE_ATTRIBUTE = 'https://aws.amazon.com/SAML/Attributes/Role'
+SESSION_DURATION_ATTRIBUTE = \
+    'https://aws.amazon.com/SAML/Attributes/SessionDuration'
+
+# How much of the base64 encoded assertion to decode and parse at a time.
+# This must be a multiple of 4.
+CHUNK_SIZE = 65536
+
+_VALUE_RE = re.compile(r'\svalue="([^"]*)"')
+
+
+class AssertionInfo(collections.namedtuple(
+        'AssertionInfo', ['roles', 'session_duration', 'not_on_or_after'])):
+    """What okta_aws needs to know from a SAML assertion
+
+    roles            - a tuple of (principal ARN, role ARN) pairs
+    session_duration - the longest session AWS will allow, in seconds, from
+                       the SessionDuration attribute, or None if it wasn't
+                       given
+    not_on_or_after  - the earliest NotOnOrAfter time in the assertion (as
+                       an ISO 8601 timestamp), or None if there isn't one
+    """
+    __slots__ = ()
+
+
+def form_value(page, name):
+    """Returns the (unescaped) value of a form field in an HTML page, or None
+    if the page doesn't have that field. This only looks at the input tag
+    for the field, rather than searching the whole page with a regular
+    expression.
+
+    page - the HTML page
+    name - the name of the form field
+    """
+    pos = page.find('name="%s"' % name)
+    if pos == -1:
+        return None
+    start = page.rfind('<', 0, pos)
+    end = page.find('>', pos)
+    if start == -1 or end == -1:
+        return None
+    match = _VALUE_RE.search(page, start, end)
+    if not match:
+        return None
+    return html.unescape(match.group(1))
+
+
+def _decoded_chunks(saml_assertion):
+    data = b''.join(saml_assertion.encode('ascii').split())
+    for i in range(0, len(data), CHUNK_SIZE):
+        yield base64.b64decode(data[i:i + CHUNK_SIZE], validate=True)
+
+
+@functools.lru_cache(maxsize=64)
+def parse_assertion(saml_assertion):
+    """Returns an AssertionInfo for a base64 encoded SAML assertion.
+
+    The assertion is decoded and parsed a chunk at a time, and parsing stops
+    as soon as the AWS attributes have been read, so the rest of the document
+    is never decoded. Raises ValueError if the assertion isn't valid base64,
+    or xml.etree.ElementTree.ParseError if it isn't valid XML. Results are
+    cached, as the same assertion is usually looked at more than once.
+
+    saml_assertion - the saml assertion given by okta, base64 encoded
+    """
+    parser = ET.XMLPullParser(events=('end',))
+    roles = []
+    session_duration = None
+    not_on_or_after = None
+    # The values of the attribute being read. Its name isn't known until it
+    # ends, as only end events are used.
+    values = []
+    done = False
+    for chunk in _decoded_chunks(saml_assertion):
+        parser.feed(chunk)
+        for _, elem in parser.read_events():
+            tag = elem.tag
+            if tag == ATTRIBUTE_VALUE_TAG:
+                values.append((elem.text or '').strip())
+            elif tag == ATTRIBUTE_TAG:
+                name = elem.get('Name')
+                if name == ROLE_ATTRIBUTE:
+                    roles.extend(tuple(v.split(',', 1)) for v in values)
+                elif name == SESSION_DURATION_ATTRIBUTE and values:
+                    session_duration = int(values[0])
+                values = []
+            elif tag == ATTRIBUTE_STATEMENT_TAG and roles:
+                done = True
+                break
+            else:
+                value = elem.get('NotOnOrAfter')
+                if value is not None and (
+                        not_on_or_after is None or
+                        cache.parse_timestamp(value) <
+                        cache.parse_timestamp(not_on_or_after)):
+                    not_on_or_after = value
+            # Nothing needs the contents of elements once they are closed
+            elem.clear()
+        if done:
+            break
+    else:
+        parser.close()
+    return AssertionInfo(tuple(roles), session_duration, not_on_or_after)
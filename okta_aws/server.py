@@ -0,0 +1,134 @@
+#
+# Copyright 2017 Chef Software
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""A local HTTP server for okta_aws --serve, which hands out credentials
+using the same protocol as the ECS container credentials endpoint. Point
+AWS_CONTAINER_CREDENTIALS_FULL_URI at http://127.0.0.1:PORT/creds/PROFILE
+(and set AWS_CONTAINER_AUTHORIZATION_TOKEN) and the AWS SDKs will fetch
+credentials from here instead of ~/.aws/credentials."""
+
+import collections
+import hmac
+import http.server
+import json
+import logging
+import threading
+import urllib.parse
+
+from okta_aws import cache, exceptions
+
+PATH_PREFIX = '/creds/'
+
+
+class CredentialStore(object):
+    """Keeps credentials for each profile in memory, fetching them the
+    first time they are asked for and again once they are about to expire.
+    Only one fetch per profile runs at a time; other requests for the same
+    profile wait for it rather than fetching their own copy.
+
+    fetch        - called with a profile name, returns credentials as returned
+                   by AWS (with an Expiration)
+    min_lifetime - credentials expiring within this many seconds are fetched
+                   again
+    """
+    def __init__(self, fetch, min_lifetime=300):
+        self.fetch = fetch
+        self.min_lifetime = min_lifetime
+        self._creds = {}
+        self._locks = collections.defaultdict(threading.Lock)
+        self._locks_lock = threading.Lock()
+
+    def _valid(self, creds):
+        return creds is not None and \
+            cache.seconds_until(creds['Expiration']) >= self.min_lifetime
+
+    def get(self, profile):
+        """Returns valid credentials for profile"""
+        creds = self._creds.get(profile)
+        if self._valid(creds):
+            return creds
+        with self._locks_lock:
+            lock = self._locks[profile]
+        with lock:
+            # Another thread may have fetched them while we waited
+            creds = self._creds.get(profile)
+            if not self._valid(creds):
+                logging.info("Fetching credentials for %s", profile)
+                creds = self.fetch(profile)
+                self._creds[profile] = creds
+        return creds
+
+
+class CredentialRequestHandler(http.server.BaseHTTPRequestHandler):
+    """Serves GET /creds/PROFILE in the container credentials format"""
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        token = self.server.token
+        if token is not None and not hmac.compare_digest(
+                self.headers.get('Authorization', ''), token):
+            self.send_json(401, {'message': 'Unauthorized'})
+            return
+        path = urllib.parse.urlsplit(self.path).path
+        if not path.startswith(PATH_PREFIX):
+            self.send_json(404, {'message': 'Not found'})
+            return
+        profile = urllib.parse.unquote(path[len(PATH_PREFIX):])
+        if not profile or '/' in profile:
+            self.send_json(404, {'message': 'Invalid profile name'})
+            return
+        try:
+            creds = self.server.store.get(profile)
+        except exceptions.ProfileError as e:
+            self.send_json(404, {'message': e.message})
+            return
+        except Exception as e:  # pylint: disable=broad-except
+            logging.error("Unable to get credentials for %s: %s", profile, e)
+            self.send_json(500, {'message': str(e)})
+            return
+        expiration = creds['Expiration']
+        if not isinstance(expiration, str):
+            expiration = expiration.isoformat()
+        self.send_json(200, {
+            'AccessKeyId': creds['AccessKeyId'],
+            'SecretAccessKey': creds['SecretAccessKey'],
+            'Token': creds['SessionToken'],
+            'Expiration': expiration,
+        })
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        logging.debug("%s - %s", self.address_string(), format % args)
+
+
+class CredentialServer(http.server.ThreadingHTTPServer):
+    """HTTP server for CredentialRequestHandler
+
+    address - a (host, port) tuple to listen on
+    store   - the CredentialStore to serve credentials from
+    token   - the value clients must send in the Authorization header, or
+              None to allow any client
+    """
+    daemon_threads = True
+
+    def __init__(self, address, store, token=None):
+        super().__init__(address, CredentialRequestHandler)
+        self.store = store
+        self.token = token
@@ -0,0 +1,160 @@
+#
+# Copyright 2017 Chef Software
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Saving the okta session between runs, along with when it expires, so
+that a session that is known to be valid can be used without asking okta
+about it first."""
+
+import hashlib
+import json
+import logging
+import os
+import re
+
+from okta_aws.cache import seconds_until
+from okta_aws.fileutil import atomic_write
+
+# The key the session is kept under in a store
+STORE_KEY = 'session'
+
+
+def session_hash(session_id):
+    """Returns a hash identifying a session ID without revealing it"""
+    return hashlib.sha256(session_id.encode()).hexdigest()
+
+
+class SessionStore(object):
+    """Stores the okta session ID in cookie_file, and the time the session
+    expires in a file next to it (cookie_file + '.expiry'). The session ID
+    is kept on its own in cookie_file, as earlier versions of okta_aws
+    expect. The expiry is tied to the session it was recorded for, so it is
+    ignored if cookie_file is replaced by something else.
+
+    If store is given, the session ID and its expiry are kept there instead
+    (e.g. encrypted, or in the OS keyring), and cookie_file is only read to
+    pick up a session saved before the store was used. It is removed once
+    the session is saved to the store.
+
+    cookie_file - the file the session ID is saved in
+    store       - the store.Store to keep the session in, if any
+    """
+    def __init__(self, cookie_file, store=None):
+        self.cookie_file = cookie_file
+        self.expiry_file = cookie_file + '.expiry'
+        self.store = store
+
+    def _stored(self):
+        entry = self.store.get(STORE_KEY)
+        if isinstance(entry, dict) and isinstance(entry.get('id'), str):
+            return entry
+        return None
+
+    def _remove_files(self):
+        for path in (self.cookie_file, self.expiry_file):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def load(self):
+        """Returns the saved session ID, or None if there isn't one"""
+        if self.store is not None:
+            entry = self._stored()
+            if entry is not None:
+                return entry['id']
+        if not os.path.exists(self.cookie_file):
+            return None
+        logging.debug("Loading session ID from %s", self.cookie_file)
+        with open(self.cookie_file) as fh:
+            session_id = fh.read().rstrip("\n")
+        # Support old cookie file format
+        if session_id.startswith('#LWP-Cookies-2.0'):
+            logging.debug("Converting old cookie file format")
+            m = re.search(r'sid="([^"]*)"', session_id)
+            if m:
+                logging.debug("Found session ID in old cookies")
+                return m.group(1)
+            logging.debug("Didn't find session ID in cookies")
+            return None
+        return session_id or None
+
+    def save(self, session_id, expires_at=None):
+        """Saves a session ID, and when it expires if that is known
+
+        session_id - the okta session ID
+        expires_at - when the session expires, as an ISO 8601 timestamp
+        """
+        if self.store is not None:
+            logging.debug("Saving session ID to %s", self.store)
+            self.save_expiry(session_id, expires_at)
+            return
+        logging.debug("Saving session cookie to %s", self.cookie_file)
+        atomic_write(self.cookie_file, session_id, mode=0o600)
+        if expires_at is not None:
+            self.save_expiry(session_id, expires_at)
+        else:
+            self.forget_expiry()
+
+    def expires_at(self, session_id):
+        """Returns when session_id expires as recorded by save_expiry, or
+        None if it isn't known.
+
+        session_id - the okta session ID
+        """
+        if self.store is not None:
+            entry = self._stored()
+            if entry is None or entry['id'] != session_id:
+                return None
+            return entry.get('expires_at')
+        try:
+            with open(self.expiry_file) as fh:
+                expiry = json.load(fh)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(expiry, dict) or \
+                expiry.get('session') != session_hash(session_id):
+            return None
+        return expiry.get('expires_at')
+
+    def save_expiry(self, session_id, expires_at):
+        """Records when a session expires
+
+        session_id - the okta session ID
+        expires_at - when the session expires, as an ISO 8601 timestamp,
+                     or None if it isn't known
+        """
+        if self.store is not None:
+            ttl = None if expires_at is None else seconds_until(expires_at)
+            self.store.set(STORE_KEY, {'id': session_id,
+                                       'expires_at': expires_at}, ttl)
+            # The session is only kept in the store from now on
+            self._remove_files()
+            return
+        atomic_write(self.expiry_file, json.dumps({
+            'session': session_hash(session_id),
+            'expires_at': expires_at,
+        }), mode=0o600)
+
+    def forget_expiry(self):
+        """Forgets when the saved session expires, so that it is checked with
+        okta before it is used again"""
+        if self.store is not None:
+            entry = self._stored()
+            if entry is not None and entry.get('expires_at') is not None:
+                self.save_expiry(entry['id'], None)
+            return
+        try:
+            os.remove(self.expiry_file)
+        except FileNotFoundError:
+            pass
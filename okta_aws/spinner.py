@@ -0,0 +1,71 @@
+#
+# Copyright 2017 Chef Software
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""A progress spinner to show while waiting for something, such as the user
+approving an Okta Verify push notification."""
+
+import sys
+import time
+
+
+class Spinner(object):
+    """Shows a message with a spinner after it while waiting. The spinner
+    only moves when writing to a terminal; otherwise the message is shown
+    once.
+
+    message - what we are waiting for
+    stream  - where to write the message (defaults to stderr)
+    """
+    FRAMES = '|/-\\'
+    # How often to move the spinner, in seconds
+    INTERVAL = 0.1
+
+    def __init__(self, message, stream=None):
+        self.message = message
+        self.stream = stream or sys.stderr
+        self.frame = 0
+        self.started = False
+        self.tty = hasattr(self.stream, 'isatty') and self.stream.isatty()
+
+    def draw(self):
+        if self.tty:
+            self.stream.write("\r%s %s" % (
+                self.message, self.FRAMES[self.frame % len(self.FRAMES)]))
+            self.frame += 1
+        elif not self.started:
+            self.stream.write("%s...\n" % self.message)
+        self.started = True
+        self.stream.flush()
+
+    def wait(self, seconds):
+        """Sleeps for the given number of seconds, moving the spinner
+
+        seconds - how long to wait
+        """
+        deadline = time.monotonic() + seconds
+        while True:
+            self.draw()
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            time.sleep(min(self.INTERVAL, remaining))
+
+    def finish(self, result=''):
+        """Stops the spinner, replacing it with result
+
+        result - a word to show after the message, such as 'done'
+        """
+        if self.tty and self.started:
+            self.stream.write("\r%s %s\n" % (self.message, result))
+            self.stream.flush()
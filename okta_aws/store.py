@@ -0,0 +1,413 @@
+#
+# Copyright 2017 Chef Software
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Stores for the caches that hold secrets: the okta session, the list of
+assigned applications, SAML assertions and temporary AWS credentials.
+
+A store is a dictionary in which every entry can have its own expiry time.
+Expired entries are dropped, and the least recently used entries are
+evicted when there are more than max_entries. Every update is a locked
+read-modify-write, so several okta_aws processes can share a store.
+
+There are three kinds of store, chosen with the cache_store setting:
+
+* file - a JSON file only readable by the current user
+* encrypted - a compressed file encrypted with AES-GCM, using a key kept in
+  the OS keyring if there is one, or in a key file otherwise. This needs
+  the cryptography package.
+* keyring - the OS keyring (e.g. the macOS keychain or the Windows
+  credential locker) for the okta session. Keyring entries can be small
+  (the Windows credential locker allows 2560 bytes), so the other caches,
+  which hold SAML assertions of several KB each, are kept in encrypted files
+  with the key in the keyring. This needs the keyring and cryptography
+  packages.
+
+The caches are only there to save time, so failing to save one is logged
+rather than raised.
+"""
+
+import base64
+import json
+import logging
+import os
+import threading
+import time
+import zlib
+
+from okta_aws import exceptions
+from okta_aws.fileutil import atomic_write, file_lock
+
+STORE_TYPES = ('file', 'encrypted', 'keyring')
+DEFAULT_MAX_ENTRIES = 256
+# The service name okta_aws uses for entries in the OS keyring
+KEYRING_SERVICE = 'okta_aws'
+# The keyring entry holding the key for encrypted stores
+KEYRING_KEY_NAME = 'cache-key'
+# The stores small enough to be kept in a keyring entry with
+# cache_store = "keyring"
+KEYRING_STORES = ('session',)
+# The start of every encrypted store, which is also authenticated along
+# with the contents. The last byte is the format version.
+MAGIC = b'OKAS\x01'
+NONCE_SIZE = 12
+KEY_SIZE = 32
+
+# Encryption keys that have already been loaded, by key file
+_keys = {}
+
+
+def _missing_package(store_type, package):
+    return exceptions.ConfigError(
+        'cache_store = "%s" needs the %s package, which can be installed '
+        'with: pip install %s' % (store_type, package, package))
+
+
+def _aesgcm_class(store_type):
+    try:
+        from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+    except ImportError:
+        raise _missing_package(store_type, 'cryptography')
+    return AESGCM
+
+
+def _import_keyring():
+    try:
+        import keyring
+        import keyring.errors
+    except ImportError:
+        raise _missing_package('keyring', 'keyring')
+    return keyring
+
+
+class Store(object):
+    """The parts common to every kind of store. Subclasses read and write
+    the encoded entries with _read() and _write().
+
+    Entries are kept as [value, expires, last used], where expires and last
+    used are unix timestamps and expires is null for entries that don't
+    expire. When an entry is read, the time is only remembered in memory,
+    and saved with the next update, so that reading a store never writes
+    to it. A store can be shared by several threads.
+
+    lock_path   - the file to lock while the store is updated
+    max_entries - the most entries to keep
+    """
+    def __init__(self, lock_path, max_entries=DEFAULT_MAX_ENTRIES):
+        self.lock_path = lock_path
+        self.max_entries = max_entries
+        self._used = {}
+        # Guards _used, which threads using the store update
+        self._used_lock = threading.Lock()
+
+    def _read(self):
+        """Returns the encoded entries, or None if the store is empty"""
+        raise NotImplementedError
+
+    def _write(self, data):
+        """Replaces the encoded entries
+
+        data - the encoded entries (bytes)
+        """
+        raise NotImplementedError
+
+    def encode(self, entries):
+        """Returns entries encoded as compact JSON"""
+        return json.dumps(entries, separators=(',', ':'),
+                          sort_keys=True).encode()
+
+    def decode(self, data):
+        """Returns the entries encoded in data. Raises ValueError if data
+        can't be decoded."""
+        return json.loads(data.decode())
+
+    def entries(self):
+        """Returns all unexpired entries. A corrupt or unreadable store is
+        treated as empty."""
+        try:
+            data = self._read()
+            entries = {} if data is None else self.decode(data)
+        except (OSError, ValueError) as e:
+            logging.debug("Ignoring unreadable %s: %s", self, e)
+            return {}
+        if not isinstance(entries, dict):
+            return {}
+        now = time.time()
+        return {k: e for k, e in entries.items()
+                if isinstance(e, list) and len(e) == 3 and
+                (e[1] is None or e[1] > now)}
+
+    def load(self):
+        """Returns the whole contents of the store as a dictionary"""
+        return {k: e[0] for k, e in self.entries().items()}
+
+    def get(self, key, default=None):
+        """Returns a single value from the store"""
+        entry = self.entries().get(key)
+        if entry is None:
+            return default
+        with self._used_lock:
+            self._used[key] = time.time()
+        return entry[0]
+
+    def _modify(self, change):
+        try:
+            self._locked_modify(change)
+        except OSError as e:
+            logging.warning("Unable to save to %s: %s", self, e)
+
+    def _locked_modify(self, change):
+        os.makedirs(os.path.dirname(os.path.abspath(self.lock_path)),
+                    mode=0o700, exist_ok=True)
+        with file_lock(self.lock_path):
+            entries = self.entries()
+            now = time.time()
+            with self._used_lock:
+                used_times, self._used = self._used, {}
+            for key, used in used_times.items():
+                if key in entries:
+                    entries[key][2] = max(entries[key][2], used)
+            change(entries, now)
+            if len(entries) > self.max_entries:
+                by_use = sorted(entries, key=lambda k: entries[k][2])
+                for key in by_use[:len(entries) - self.max_entries]:
+                    logging.debug("Evicting %s from %s", key, self)
+                    del entries[key]
+            self._write(self.encode(entries))
+
+    def update(self, entries, ttl=None):
+        """Stores several values at once
+
+        entries - a dictionary of keys and values to store
+        ttl     - how many seconds the values should be kept for, or None
+                  to keep them until they are evicted
+        """
+        def change(stored, now):
+            expires = None if ttl is None else now + ttl
+            for key, value in entries.items():
+                stored[key] = [value, expires, now]
+        self._modify(change)
+
+    def set(self, key, value, ttl=None):
+        """Stores a single value
+
+        key   - the key to store the value under
+        value - the value, which must be serializable as JSON
+        ttl   - how many seconds the value should be kept for, or None to
+                keep it until it is evicted
+        """
+        self.update({key: value}, ttl)
+
+    def delete(self, key):
+        """Removes a value from the store, if it is present"""
+        with self._used_lock:
+            self._used.pop(key, None)
+        self._modify(lambda stored, now: stored.pop(key, None))
+
+
+class FileStore(Store):
+    """A store kept as a JSON file that only the current user can read
+
+    path        - the file to keep the store in
+    max_entries - the most entries to keep
+    """
+    def __init__(self, path, max_entries=DEFAULT_MAX_ENTRIES):
+        super().__init__(path, max_entries)
+        self.path = path
+
+    def __str__(self):
+        return self.path
+
+    def _read(self):
+        try:
+            with open(self.path, 'rb') as fh:
+                return fh.read()
+        except FileNotFoundError:
+            return None
+
+    def _write(self, data):
+        atomic_write(self.path, data, mode=0o600)
+
+
+def encryption_key(key_file, use_keyring=True):
+    """Returns the key used to encrypt stores, creating one if there isn't
+    one yet. The key is kept in the OS keyring if there is one, and in
+    key_file (only readable by the current user) otherwise.
+
+    key_file    - the file to keep the key in if there is no keyring
+    use_keyring - whether to try the OS keyring first
+    """
+    if key_file in _keys:
+        return _keys[key_file]
+    os.makedirs(os.path.dirname(os.path.abspath(key_file)), mode=0o700,
+                exist_ok=True)
+    # Stop two processes from each creating a different key
+    with file_lock(key_file):
+        key = None
+        if use_keyring:
+            key = _keyring_encryption_key()
+        if key is None:
+            key = _file_encryption_key(key_file)
+    _keys[key_file] = key
+    return key
+
+
+def _keyring_encryption_key():
+    try:
+        import keyring
+        import keyring.errors
+    except ImportError:
+        return None
+    try:
+        encoded = keyring.get_password(KEYRING_SERVICE, KEYRING_KEY_NAME)
+        if encoded is None:
+            logging.debug("Creating a new cache key in the OS keyring")
+            encoded = base64.b64encode(os.urandom(KEY_SIZE)).decode()
+            keyring.set_password(KEYRING_SERVICE, KEYRING_KEY_NAME, encoded)
+        key = base64.b64decode(encoded)
+    except (keyring.errors.KeyringError, ValueError) as e:
+        logging.debug("Not using the OS keyring for the cache key: %s", e)
+        return None
+    return key if len(key) == KEY_SIZE else None
+
+
+def _file_encryption_key(key_file):
+    try:
+        with open(key_file, 'rb') as fh:
+            key = fh.read()
+        if len(key) == KEY_SIZE:
+            return key
+        logging.debug("Replacing invalid cache key in %s", key_file)
+    except FileNotFoundError:
+        logging.debug("Creating a new cache key in %s", key_file)
+    key = os.urandom(KEY_SIZE)
+    atomic_write(key_file, key, mode=0o600)
+    return key
+
+
+class EncryptedFileStore(FileStore):
+    """A store kept in a file encrypted with AES-GCM. The entries are
+    compressed before they are encrypted. See encryption_key for where the
+    key is kept.
+
+    path        - the file to keep the store in
+    key_file    - the file to keep the key in if there is no OS keyring
+    max_entries - the most entries to keep
+    use_keyring - whether to keep the key in the OS keyring if possible
+    store_type  - the cache_store setting to name if cryptography is missing
+    """
+    def __init__(self, path, key_file, max_entries=DEFAULT_MAX_ENTRIES,
+                 use_keyring=True, store_type='encrypted'):
+        super().__init__(path, max_entries)
+        self._aesgcm_class = _aesgcm_class(store_type)
+        self.key_file = key_file
+        self.use_keyring = use_keyring
+        self._aesgcm = None
+
+    @property
+    def aesgcm(self):
+        """The cipher used to encrypt and decrypt the store"""
+        if self._aesgcm is None:
+            self._aesgcm = self._aesgcm_class(
+                encryption_key(self.key_file, self.use_keyring))
+        return self._aesgcm
+
+    def encode(self, entries):
+        nonce = os.urandom(NONCE_SIZE)
+        return MAGIC + nonce + self.aesgcm.encrypt(
+            nonce, zlib.compress(super().encode(entries)), MAGIC)
+
+    def decode(self, data):
+        from cryptography.exceptions import InvalidTag
+
+        if not data.startswith(MAGIC):
+            raise ValueError("not an encrypted okta_aws store")
+        nonce = data[len(MAGIC):len(MAGIC) + NONCE_SIZE]
+        try:
+            plain = self.aesgcm.decrypt(
+                nonce, data[len(MAGIC) + NONCE_SIZE:], MAGIC)
+            return super().decode(zlib.decompress(plain))
+        except InvalidTag:
+            raise ValueError("encrypted with a different key, or corrupt")
+        except zlib.error as e:
+            raise ValueError(str(e))
+
+
+class KeyringStore(Store):
+    """A store kept in the OS keyring as a single compressed entry, which
+    some keyrings limit to a few KB. Keyrings can't be locked, so a lock
+    file is used to stop okta_aws processes updating the store at the same
+    time.
+
+    name        - the name of the keyring entry
+    lock_path   - the file to lock while the store is updated
+    max_entries - the most entries to keep
+    """
+    def __init__(self, name, lock_path, max_entries=DEFAULT_MAX_ENTRIES):
+        super().__init__(lock_path, max_entries)
+        self.name = name
+        self.keyring = _import_keyring()
+
+    def __str__(self):
+        return "keyring entry %s" % self.name
+
+    def _read(self):
+        try:
+            encoded = self.keyring.get_password(KEYRING_SERVICE, self.name)
+        except self.keyring.errors.KeyringError as e:
+            raise OSError(str(e))
+        if encoded is None:
+            return None
+        try:
+            return zlib.decompress(base64.b64decode(encoded))
+        except zlib.error as e:
+            raise ValueError(str(e))
+
+    def _write(self, data):
+        encoded = base64.b64encode(zlib.compress(data)).decode()
+        try:
+            self.keyring.set_password(KEYRING_SERVICE, self.name, encoded)
+        except self.keyring.errors.KeyringError as e:
+            raise OSError(str(e))
+
+
+def open_store(store_type, cache_dir, name,
+               max_entries=DEFAULT_MAX_ENTRIES):
+    """Returns a store of the given kind. Raises exceptions.ConfigError if
+    store_type isn't known, or needs a package that isn't installed. With
+    store_type 'keyring', only the stores in KEYRING_STORES are kept in the
+    keyring, and the others are encrypted files with the key in the keyring.
+
+    store_type  - one of STORE_TYPES
+    cache_dir   - the directory to keep files for the store in
+    name        - the name of the store, such as 'credentials'
+    max_entries - the most entries to keep
+    """
+    path = os.path.join(cache_dir, name)
+    if store_type == 'file':
+        return FileStore(path + '.json', max_entries)
+    if store_type == 'encrypted':
+        return EncryptedFileStore(path + '.enc',
+                                  os.path.join(cache_dir, 'cache.key'),
+                                  max_entries)
+    if store_type == 'keyring':
+        if name in KEYRING_STORES:
+            return KeyringStore(name, path + '.keyring', max_entries)
+        # The key has to go in the keyring
+        _import_keyring()
+        return EncryptedFileStore(path + '.enc',
+                                  os.path.join(cache_dir, 'cache.key'),
+                                  max_entries, store_type='keyring')
+    raise exceptions.ConfigError(
+        "cache_store should be one of %s, not %r" % (
+            ', '.join(STORE_TYPES), store_type))
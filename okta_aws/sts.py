@@ -0,0 +1,172 @@
+#
+# Copyright 2017 Chef Software
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Shared STS clients, one per region.
+
+Creating a botocore client is slow (it loads the endpoint and service
+models), so each client is created once and reused for every role we assume
+in that region. AssumeRoleWithSAML doesn't need AWS credentials, so the
+clients are unsigned and come from a botocore session that ignores
+AWS_PROFILE and AWS_DEFAULT_PROFILE. This means we don't have to touch the
+environment (which isn't thread safe), and botocore won't complain when
+AWS_PROFILE names a profile that doesn't exist yet.
+
+Role chains (assuming a role using credentials from another role) need
+signed clients. Those are cached per region and access key, so fanning out
+from one hub account to many target roles uses a single client.
+
+Each region has its own STS endpoint. Older botocore releases send all
+requests in the aws partition to the global endpoint unless told otherwise,
+so the session asks for regional endpoints. The clients give up on a region
+quickly, so that another region in the same partition can be tried when
+one is unavailable (see regions and should_fall_back).
+"""
+
+import re
+import threading
+
+import botocore.exceptions
+import botocore.session
+from botocore import UNSIGNED
+from botocore.config import Config
+
+_lock = threading.Lock()
+_session = None
+_clients = {}
+
+# How many clients signed with temporary credentials to keep
+MAX_SIGNED_CLIENTS = 16
+
+# Timeouts (in seconds) and retries for each region, before falling back to
+# the next one
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 15
+RETRIES = 1
+
+# The regions to fall back to in each partition, in order
+PARTITION_REGIONS = {
+    'aws': ('us-east-1', 'us-west-2', 'eu-west-1'),
+    'aws-us-gov': ('us-gov-west-1', 'us-gov-east-1'),
+    'aws-cn': ('cn-north-1', 'cn-northwest-1'),
+}
+
+
+def arn_partition(arn):
+    """Returns the partition (e.g. aws, aws-us-gov or aws-cn) an ARN is in,
+    or None if it isn't an ARN.
+
+    arn - the ARN, e.g. arn:aws-us-gov:iam::012345678901:saml-provider/OKTA
+    """
+    match = re.match(r'arn:([\w-]+):', arn or '')
+    return match.group(1) if match else None
+
+
+def region_partition(region_name):
+    """Returns the partition a region is in
+
+    region_name - the AWS region, e.g. us-gov-east-1
+    """
+    if region_name.startswith('us-gov-'):
+        return 'aws-us-gov'
+    if region_name.startswith('cn-'):
+        return 'aws-cn'
+    return 'aws'
+
+
+def regions(partition, preferred=()):
+    """Returns the regions to try STS calls in, in order: the preferred
+    regions that are in the partition, followed by the partition's fallback
+    regions.
+
+    partition - the partition the role being assumed is in
+    preferred - the regions to try first
+    """
+    result = []
+    for region_name in list(preferred) + \
+            list(PARTITION_REGIONS.get(partition, ())):
+        if region_name and region_name not in result and \
+                region_partition(region_name) == partition:
+            result.append(region_name)
+    return result
+
+
+def should_fall_back(error):
+    """Returns True if an error from an STS call means that the region's
+    endpoint is unavailable (it timed out, couldn't be reached, or returned
+    a server error), so it is worth trying another region.
+
+    error - the exception raised by the STS client
+    """
+    if isinstance(error, botocore.exceptions.ClientError):
+        status = error.response.get('ResponseMetadata', {}).get(
+            'HTTPStatusCode')
+        return status is not None and status >= 500
+    return isinstance(error, (botocore.exceptions.ConnectionError,
+                              botocore.exceptions.HTTPClientError))
+
+
+def _get_session():
+    global _session  # pylint: disable=global-statement
+    if _session is None:
+        # Don't look up a profile from the environment
+        session = botocore.session.Session(
+            session_vars={'profile': (None, None, None, None)})
+        # Otherwise falling back to another region could just try the
+        # global endpoint again
+        session.set_config_variable('sts_regional_endpoints', 'regional')
+        _session = session
+    return _session
+
+
+def get_client(region_name, credentials=None):
+    """Returns an STS client for region_name, creating it the first time it
+    is needed. The client is unsigned unless credentials are given.
+
+    region_name - the AWS region to use, e.g. us-east-1
+    credentials - temporary credentials, as returned by AWS, to sign
+                  requests with
+    """
+    if credentials is None:
+        key = region_name
+    else:
+        key = (region_name, credentials['AccessKeyId'])
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            config = Config(connect_timeout=CONNECT_TIMEOUT,
+                            read_timeout=READ_TIMEOUT,
+                            retries={'max_attempts': RETRIES})
+            if credentials is None:
+                client = _get_session().create_client(
+                    'sts', region_name=region_name,
+                    config=config.merge(Config(signature_version=UNSIGNED)))
+            else:
+                signed = [k for k in _clients if isinstance(k, tuple)]
+                if len(signed) >= MAX_SIGNED_CLIENTS:
+                    # Credentials expire, so forget the oldest client
+                    del _clients[signed[0]]
+                client = _get_session().create_client(
+                    'sts', region_name=region_name,
+                    aws_access_key_id=credentials['AccessKeyId'],
+                    aws_secret_access_key=credentials['SecretAccessKey'],
+                    aws_session_token=credentials['SessionToken'],
+                    config=config)
+            _clients[key] = client
+        return client
+
+
+def clear_clients():
+    """Forgets all cached clients"""
+    with _lock:
+        _clients.clear()
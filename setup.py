@@ -23,8 +23,12 @@ setup(
     packages=['okta_aws'],
     entry_points={"console_scripts": ['okta_aws=okta_aws.__main__:main']},
     url='https://github.com/chef/okta_aws',
-    python_requires='>=3',
+    python_requires='>=3.7',
     setup_requires=['pytest-runner'],
     tests_require=['pytest', 'pytest_datadir'],
-    install_requires=['requests>=2.21.0', 'toml>=0.10.0', 'boto3>=1.9.93']
+    install_requires=['requests>=2.21.0', 'toml>=0.10.0', 'botocore>=1.13.25'],
+    extras_require={
+        'encrypted': ['cryptography>=2.0'],
+        'keyring': ['keyring>=15.0', 'cryptography>=2.0'],
+    }
 )
@@ -1,8 +1,26 @@
 import pytest
 
-from okta_aws import okta_aws
+from okta_aws import config, okta_aws
+
+
+@pytest.fixture(autouse=True)
+def config_cache(tmp_path, monkeypatch):
+    # Don't cache compiled config files in the real home directory
+    monkeypatch.setattr(config, 'CACHE_FILE',
+                        str(tmp_path / "compiled_config.json"))
 
 
 @pytest.fixture
 def oa():
     return okta_aws.OktaAWS([])
+
+
+@pytest.fixture
+def set_config():
+    # Configs can't be changed in place, so this builds a new one with
+    # some settings changed, e.g. set_config(oa, 'general', cache_dir=path)
+    def set_config(oa, section, **settings):
+        sections = oa.config.sections()
+        sections.setdefault(section, {}).update(settings)
+        oa.config = config.Config(sections)
+    return set_config
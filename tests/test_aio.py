@@ -0,0 +1,81 @@
+# pylint: disable=invalid-name,missing-docstring
+import asyncio
+import threading
+from unittest.mock import patch
+
+import pytest
+
+from okta_aws import aio, exceptions
+
+
+APPLINKS = {'one': 'url1', 'two': 'url2', 'three': 'url3'}
+
+
+def fake_fetch(applinks, session_id, profile, store=True):
+    if profile == 'two':
+        raise exceptions.SAMLError("Problem getting SAML assertion")
+    return {'AccessKeyId': profile}
+
+
+def test_prepare_overlaps_session_check_and_cache_load(oa):
+    session_checked = threading.Event()
+    cache_loaded = threading.Event()
+
+    def get_okta_session():
+        session_checked.set()
+        # Only succeeds if the cache is being loaded at the same time
+        assert cache_loaded.wait(5)
+        return 'session_id'
+
+    def load_cached_applinks():
+        cache_loaded.set()
+        assert session_checked.wait(5)
+        return APPLINKS
+
+    with patch.object(oa, 'get_okta_session', get_okta_session), \
+            patch.object(oa, 'load_cached_applinks', load_cached_applinks):
+        result = aio.run_sync(oa.aio().prepare('one'))
+    assert result == ('session_id', APPLINKS)
+
+
+def test_prepare_refreshes_missing_profile(oa):
+    with patch.object(oa, 'get_okta_session', return_value='session_id'), \
+            patch.object(oa, 'load_cached_applinks', return_value={}), \
+            patch.object(oa, 'get_applinks',
+                         return_value=APPLINKS) as patched_get:
+        aio.run_sync(oa.aio().prepare('one'))
+    patched_get.assert_called_once_with('session_id', 'one')
+
+
+def test_fetch_all_credentials(oa):
+    with patch.object(oa, 'get_okta_session', return_value='session_id'), \
+            patch.object(oa, 'load_cached_applinks', return_value=APPLINKS), \
+            patch.object(oa, 'fetch_credentials', side_effect=fake_fetch), \
+            patch.object(oa, 'store_aws_creds_in_profiles') as patched_store:
+        results = aio.run_sync(oa.aio(concurrency=2).fetch_all_credentials())
+
+    assert results['one'] == {'AccessKeyId': 'one'}
+    assert isinstance(results['two'], exceptions.SAMLError)
+    patched_store.assert_called_once_with({
+        'one': {'AccessKeyId': 'one'}, 'three': {'AccessKeyId': 'three'}})
+
+
+def test_fetch_credentials_raises(oa):
+    with patch.object(oa, 'get_okta_session', return_value='session_id'), \
+            patch.object(oa, 'load_cached_applinks', return_value=APPLINKS), \
+            patch.object(oa, 'fetch_credentials', side_effect=fake_fetch):
+        engine = oa.aio()
+        assert aio.run_sync(engine.fetch_credentials('one')) == \
+            {'AccessKeyId': 'one'}
+        with pytest.raises(exceptions.SAMLError):
+            aio.run_sync(engine.fetch_credentials('two'))
+
+
+def test_run_sync_inside_event_loop():
+    async def outer():
+        async def inner():
+            return 1
+        with pytest.raises(RuntimeError):
+            aio.run_sync(inner())
+
+    asyncio.run(outer())
@@ -0,0 +1,89 @@
+# pylint: disable=invalid-name,missing-docstring
+import datetime
+from unittest.mock import patch
+
+import pytest
+
+from okta_aws import api, exceptions, okta_aws
+
+
+AWS_CREDS = {
+    'AccessKeyId': 'ASIAABCDEFG123456789',
+    'SecretAccessKey': 'secret',
+    'SessionToken': 'token',
+    'Expiration': '2018-04-24T00:00:00Z',
+}
+
+
+@pytest.fixture
+def config_file(tmp_path):
+    path = tmp_path / "okta_aws.toml"
+    path.write_text('[general]\nusername="fakey"\n'
+                    'okta_server="example.okta.com"\n'
+                    'cache_dir="%s"\ncookie_file="%s"\n' % (
+                        tmp_path / "cache", tmp_path / "cookie"))
+    return str(path)
+
+
+def test_credentials():
+    creds = api.Credentials.from_aws('dev', AWS_CREDS)
+    assert creds.expiration == datetime.datetime(
+        2018, 4, 24, tzinfo=datetime.timezone.utc)
+    assert creds.boto3_kwargs() == {
+        'aws_access_key_id': 'ASIAABCDEFG123456789',
+        'aws_secret_access_key': 'secret',
+        'aws_session_token': 'token'}
+    assert creds.seconds_remaining < 0
+    assert 'secret' not in repr(creds)
+    assert not hasattr(creds, '__dict__')
+    with pytest.raises(AttributeError):
+        creds.profile = 'other'
+
+
+def test_client_is_not_interactive(config_file):
+    oa = api.client('dev', config_file=config_file)
+    assert not oa.interactive
+    assert oa.profile == 'dev'
+    assert oa.get_config('username') == 'fakey'
+
+
+def test_client_missing_config(tmp_path):
+    with pytest.raises(exceptions.ConfigError, match="not found"):
+        api.client(config_file=str(tmp_path / "missing.toml"))
+
+
+def test_get_credentials_not_logged_in(config_file):
+    with pytest.raises(exceptions.LoginError):
+        api.get_credentials('dev', config_file=config_file)
+
+
+def test_get_credentials(config_file):
+    with patch.object(okta_aws.OktaAWS, 'get_okta_session',
+                      return_value='session_id'), \
+            patch.object(okta_aws.OktaAWS, 'get_applinks',
+                         return_value={'dev': 'url'}), \
+            patch.object(okta_aws.OktaAWS, 'fetch_credentials',
+                         return_value=AWS_CREDS) as patched_fetch:
+        creds = api.get_credentials('dev', config_file=config_file)
+    assert creds.access_key_id == 'ASIAABCDEFG123456789'
+    patched_fetch.assert_called_once_with({'dev': 'url'}, 'session_id',
+                                          'dev', store=False)
+
+
+def test_get_all_credentials_partial_failure(config_file):
+    def fake_fetch(self, applinks, session_id, profile, store=True):
+        if profile == 'prod':
+            raise exceptions.AssumeRoleError("Access denied")
+        return AWS_CREDS
+
+    with patch.object(okta_aws.OktaAWS, 'get_okta_session',
+                      return_value='session_id'), \
+            patch.object(okta_aws.OktaAWS, 'load_cached_applinks',
+                         return_value={'dev': 'url1', 'prod': 'url2'}), \
+            patch.object(okta_aws.OktaAWS, 'fetch_credentials', fake_fetch):
+        with pytest.raises(exceptions.BatchError) as e:
+            api.get_all_credentials(config_file=config_file)
+
+    assert list(e.value.credentials.keys()) == ['dev']
+    assert isinstance(e.value.errors['prod'], exceptions.AssumeRoleError)
+    assert str(e.value) == "Unable to fetch credentials for prod"
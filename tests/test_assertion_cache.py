@@ -0,0 +1,112 @@
+# pylint: disable=invalid-name,missing-docstring
+import datetime
+import threading
+import time
+from unittest.mock import patch
+
+from okta_aws import cache, okta_aws, store
+
+
+def in_seconds(seconds):
+    return (datetime.datetime.now(datetime.timezone.utc) +
+            datetime.timedelta(seconds=seconds)).isoformat()
+
+
+def test_assertion_cache_expiry():
+    ac = cache.AssertionCache()
+    ac.put('app', 'assertion', in_seconds(300))
+    assert ac.get('app') == 'assertion'
+    ac.put('app', 'assertion', in_seconds(10))
+    assert ac.get('app') is None
+
+
+def test_assertion_cache_on_disk(tmp_path):
+    path = str(tmp_path / "saml.json")
+    cache.AssertionCache(path).put('app', 'assertion', in_seconds(300))
+    assert cache.AssertionCache(path).get('app') == 'assertion'
+    assert cache.AssertionCache(path, read_store=False).get('app') is None
+
+
+def test_assertion_cache_get_or_fetch():
+    ac = cache.AssertionCache()
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        return 'assertion', in_seconds(300)
+
+    assert ac.get_or_fetch('app', fetch) == 'assertion'
+    assert ac.get_or_fetch('app', fetch) == 'assertion'
+    assert len(calls) == 1
+
+
+def test_assertion_cache_failed_fetch_not_cached():
+    ac = cache.AssertionCache()
+    assert ac.get_or_fetch('app', lambda: (None, None)) is None
+    assert ac.get_or_fetch(
+        'app', lambda: ('assertion', in_seconds(300))) == 'assertion'
+
+
+def test_saml_expiry(oa, shared_datadir):
+    with open("%s/saml_assertion.txt" % shared_datadir) as fh:
+        assertion = fh.read()
+    assert oa.saml_expiry(assertion) == "2018-04-21T00:00:00.000Z"
+
+
+def test_get_assertion_reuses_assertion(tmp_path, set_config):
+    oa = okta_aws.OktaAWS([])
+    set_config(oa, 'general', cache_dir=str(tmp_path))
+    with patch.object(oa, 'get_saml_assertion',
+                      return_value='assertion') as patched_get, \
+            patch.object(oa, 'saml_expiry', return_value=in_seconds(300)):
+        assert oa.get_assertion('session_id', 'app_url') == 'assertion'
+        assert oa.get_assertion('session_id', 'app_url') == 'assertion'
+        assert patched_get.call_count == 1
+
+
+def test_one_assertion_cache(tmp_path, set_config):
+    oa = okta_aws.OktaAWS([])
+    set_config(oa, 'general', cache_dir=str(tmp_path))
+    caches = []
+
+    def slow_open_store(*args):
+        # Opening some stores is slow, e.g. while cryptography is imported
+        time.sleep(0.001)
+        return store.FileStore(str(tmp_path / "saml.json"))
+
+    with patch.object(store, 'open_store', side_effect=slow_open_store):
+        threads = [threading.Thread(
+            target=lambda: caches.append(oa.assertion_cache))
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    assert len(caches) == 8
+    assert all(c is caches[0] for c in caches)
+
+
+def test_role_targets():
+    oa = okta_aws.OktaAWS(['dev', '-r', 'Okta_ReadOnly=dev-ro',
+                           '-r', 'Okta_Admin=dev-admin'])
+    assert oa.role_targets() == {'dev-ro': 'Okta_ReadOnly',
+                                 'dev-admin': 'Okta_Admin'}
+    assert oa.requested_role('dev-ro') == 'Okta_ReadOnly'
+    assert oa.requested_role('dev-admin') == 'Okta_Admin'
+    assert oa.requested_role('dev') is None
+
+
+def test_role_targets_with_equals_in_role():
+    oa = okta_aws.OktaAWS(['dev', '-r', 'Deploy=Role=prod',
+                           '-r', 'arn:aws:iam::123456789012:role/A=B=ab'])
+    assert oa.role_targets() == {
+        'prod': 'Deploy=Role',
+        'ab': 'arn:aws:iam::123456789012:role/A=B',
+    }
+    assert oa.requested_role('prod') == 'Deploy=Role'
+
+
+def test_requested_role_without_profile():
+    oa = okta_aws.OktaAWS(['dev', '-r', 'Okta_ReadOnly'])
+    assert oa.role_targets() == {}
+    assert oa.requested_role() == 'Okta_ReadOnly'
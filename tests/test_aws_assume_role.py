@@ -2,12 +2,16 @@
 import pytest
 import json
 
+import botocore.exceptions
+
 from okta_aws import exceptions
 
 from unittest.mock import patch
 
+GOV_PRINCIPAL = 'arn:aws-us-gov:iam::012345678901:saml-provider/OKTA'
+
 
-@patch('boto3.client')
+@patch('okta_aws.sts.get_client')
 def test_aws_assume_role(patched_client, oa, shared_datadir):
     with open("%s/sts_creds.json" % shared_datadir, 'rb') as fh:
         patched_client('sts').assume_role_with_saml.return_value = \
@@ -36,7 +40,7 @@ def test_aws_assume_role(patched_client, oa, shared_datadir):
     assert credentials['Expiration'] == '2018-04-24T00:00:00Z'
 
 
-@patch('boto3.client')
+@patch('okta_aws.sts.get_client')
 def test_aws_assume_role_no_credentials(patched_client, oa, shared_datadir):
     patched_client('sts').assume_role_with_saml.return_value = {}
 
@@ -47,3 +51,89 @@ def test_aws_assume_role_no_credentials(patched_client, oa, shared_datadir):
             'arn:aws:iam::012345678901:role/Okta_AdministratorAccess',
             'fake_assertion',
             3600)
+
+
+def test_sts_region(oa, monkeypatch, set_config):
+    monkeypatch.delenv('AWS_REGION', raising=False)
+    monkeypatch.delenv('AWS_DEFAULT_REGION', raising=False)
+    assert oa.sts_region('mycompany-dev') == 'us-east-1'
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'ap-southeast-2')
+    assert oa.sts_region('mycompany-dev') == 'ap-southeast-2'
+    assert oa.sts_region('mycompany-govcloud') == 'us-gov-east-1'
+    set_config(oa, 'mycompany-eu', **{'sts_region': 'eu-west-1'})
+    assert oa.sts_region('mycompany-eu') == 'eu-west-1'
+
+
+@patch('okta_aws.sts.get_client')
+def test_aws_assume_role_uses_profile_region(patched_client, oa,
+                                             shared_datadir):
+    with open("%s/sts_creds.json" % shared_datadir, 'rb') as fh:
+        patched_client.return_value.assume_role_with_saml.return_value = \
+            json.load(fh)
+    oa.aws_assume_role('principal', 'role', 'assertion', 3600,
+                       'mycompany-govcloud')
+    patched_client.assert_called_once_with('us-gov-east-1')
+
+
+def test_sts_regions(oa, monkeypatch, set_config):
+    monkeypatch.setenv('AWS_REGION', 'eu-central-1')
+    assert oa.sts_regions('arn:aws:iam::012345678901:saml-provider/OKTA',
+                          'mycompany-dev') == \
+        ['eu-central-1', 'us-east-1', 'us-west-2', 'eu-west-1']
+    # The partition comes from the ARN, not the profile name
+    assert oa.sts_regions(GOV_PRINCIPAL, 'mycompany-dev') == \
+        ['us-gov-west-1', 'us-gov-east-1']
+    assert oa.sts_regions('arn:aws-cn:iam::012345678901:saml-provider/OKTA',
+                          'mycompany-dev') == ['cn-north-1', 'cn-northwest-1']
+    set_config(oa, 'mycompany-gov', **{'sts_region': ['us-gov-east-1']})
+    assert oa.sts_regions(GOV_PRINCIPAL, 'mycompany-gov') == \
+        ['us-gov-east-1', 'us-gov-west-1']
+
+
+def server_error():
+    return botocore.exceptions.ClientError({
+        'Error': {'Code': 'ServiceUnavailable', 'Message': 'Unavailable'},
+        'ResponseMetadata': {'HTTPStatusCode': 503}}, 'AssumeRoleWithSAML')
+
+
+@patch('okta_aws.sts.get_client')
+def test_aws_assume_role_falls_back_to_other_regions(patched_client, oa,
+                                                     shared_datadir,
+                                                     set_config):
+    with open("%s/sts_creds.json" % shared_datadir, 'rb') as fh:
+        creds = json.load(fh)
+    patched_client.return_value.assume_role_with_saml.side_effect = [
+        botocore.exceptions.ConnectTimeoutError(endpoint_url='https://sts'),
+        server_error(),
+        creds]
+    set_config(oa, 'mycompany-dev', **{'sts_region': 'eu-west-2'})
+    credentials = oa.aws_assume_role(
+        'arn:aws:iam::012345678901:saml-provider/OKTA', 'role', 'assertion',
+        3600, 'mycompany-dev')
+    assert credentials['AccessKeyId'] == 'ASIAABCDEFG123456789'
+    assert [c[0][0] for c in patched_client.call_args_list] == \
+        ['eu-west-2', 'us-east-1', 'us-west-2']
+    assert oa.metrics.phases['sts'].errors == 2
+
+
+@patch('okta_aws.sts.get_client')
+def test_aws_assume_role_gives_up_after_last_region(patched_client, oa):
+    patched_client.return_value.assume_role_with_saml.side_effect = \
+        server_error()
+    with pytest.raises(exceptions.AssumeRoleError, match="ServiceUnavailable"):
+        oa.aws_assume_role(GOV_PRINCIPAL, 'role', 'assertion', 3600,
+                           'mycompany-dev')
+    assert patched_client.call_count == 2
+
+
+@patch('okta_aws.sts.get_client')
+def test_aws_assume_role_client_errors_not_retried(patched_client, oa):
+    patched_client.return_value.assume_role_with_saml.side_effect = \
+        botocore.exceptions.ClientError({
+            'Error': {'Code': 'AccessDenied', 'Message': 'Not allowed'},
+            'ResponseMetadata': {'HTTPStatusCode': 403}},
+                                        'AssumeRoleWithSAML')
+    with pytest.raises(exceptions.AssumeRoleError, match="AccessDenied"):
+        oa.aws_assume_role(GOV_PRINCIPAL, 'role', 'assertion', 3600,
+                           'mycompany-dev')
+    assert patched_client.call_count == 1
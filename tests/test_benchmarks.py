@@ -0,0 +1,35 @@
+# pylint: disable=invalid-name,missing-docstring
+from benchmarks import harness
+
+
+def by_mode(results):
+    return {r['mode']: r for r in results}
+
+
+def test_benchmark_single():
+    results = by_mode(harness.benchmark(3, 'single', repeat=1, page_size=2))
+    assert results['cold']['requests'] == {
+        'authn': 1, 'sessions': 1, 'appLinks': 2, 'saml': 1, 'sts': 1}
+    # Cached credentials are still valid, so nothing is fetched
+    assert results['warm']['requests'] == {'sts': 0}
+    # The okta session is known to be valid, so isn't checked
+    assert results['force']['requests'] == {
+        'appLinks': 2, 'saml': 1, 'sts': 1}
+    assert results['cold']['phases']['authn'] > 0
+    assert results['warm']['phases']['saml'] == 0
+
+
+def test_benchmark_all():
+    results = by_mode(harness.benchmark(5, 'all', repeat=1, jobs=2,
+                                        page_size=2))
+    assert results['cold']['requests']['saml'] == 5
+    assert results['cold']['requests']['sts'] == 5
+    assert results['warm']['requests'] == {'sts': 0}
+    assert results['force']['requests']['sts'] == 5
+
+
+def test_format_results():
+    results = harness.benchmark(1, 'single', repeat=1)
+    lines = harness.format_results(results).splitlines()
+    assert lines[0].split()[:4] == ['command', 'accounts', 'mode', 'total']
+    assert [line.split()[2] for line in lines[1:]] == list(harness.MODES)
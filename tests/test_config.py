@@ -0,0 +1,160 @@
+# pylint: disable=invalid-name,missing-docstring
+import logging
+import os
+from unittest.mock import patch
+
+import pytest
+
+from okta_aws import config, exceptions, okta_aws
+
+CONFIG = """
+[general]
+username = "jdoe"
+okta_server = "example.okta.com"
+session_duration = 7200
+sts_region = ["eu-west-2", "eu-west-1"]
+
+[aliases]
+eng = "company-engineering"
+
+[company-engineering]
+role_arn = "Okta_ReadOnly"
+session_duration = 3600
+
+[eng]
+role_arn = "Okta_PowerUser"
+"""
+
+
+@pytest.fixture
+def config_file(tmp_path):
+    path = tmp_path / "okta_aws.toml"
+    path.write_text(CONFIG)
+    return str(path)
+
+
+def write_config(tmp_path, text):
+    path = tmp_path / "okta_aws.toml"
+    path.write_text(text)
+    return str(path)
+
+
+def test_load(config_file):
+    c = config.load(config_file)
+    assert c.setting('username') == 'jdoe'
+    assert c.setting('refresh_threshold') == 900
+    assert c.setting('cookie_file') == \
+        os.path.expanduser('~/.okta_aws_cookie')
+    assert c.setting('sts_region') == ('eu-west-2', 'eu-west-1')
+    assert c.setting('missing', 'default') == 'default'
+    assert c['aliases']['eng'] == 'company-engineering'
+
+
+def test_profile_settings(config_file):
+    c = config.load(config_file)
+    assert c.setting('session_duration', profile='other') == 7200
+    assert c.setting('session_duration',
+                     profile='company-engineering') == 3600
+    assert c.setting('role_arn', profile='company-engineering') == \
+        'Okta_ReadOnly'
+    # Settings for an alias take precedence over the real profile's
+    assert c.setting('role_arn', profile='eng') == 'Okta_PowerUser'
+    assert c.setting('session_duration', profile='eng') == 3600
+
+
+def test_get_config(config_file):
+    oa = okta_aws.OktaAWS(['eng'])
+    oa.config = config.load(config_file)
+    # Defaults to the profile given on the command line
+    assert oa.get_config('role_arn') == 'Okta_PowerUser'
+    assert oa.get_config('session_duration') == 3600
+    assert oa.get_config('role_arn', profile='other') is None
+    assert oa.get_config('username', profile='other') == 'jdoe'
+    assert oa.get_config('missing', 'default') == 'default'
+
+
+def test_config_is_immutable(config_file):
+    c = config.load(config_file)
+    with pytest.raises(TypeError):
+        c['general']['username'] = 'someone'
+    with pytest.raises(TypeError):
+        c['new'] = {}
+
+
+def test_compiled_config_is_cached(config_file):
+    first = config.load(config_file)
+    with patch('toml.load', side_effect=AssertionError("parsed again")):
+        second = config.load(config_file)
+    assert dict(second['eng']) == dict(first['eng'])
+    assert second.setting('sts_region') == ('eu-west-2', 'eu-west-1')
+
+
+def test_changed_config_is_parsed_again(config_file):
+    config.load(config_file)
+    with open(config_file, 'a') as fh:
+        fh.write('\n[new-profile]\nrole_arn = "Okta_Admin"\n')
+    c = config.load(config_file)
+    assert c.setting('role_arn', profile='new-profile') == 'Okta_Admin'
+
+
+def test_unwritable_cache(config_file):
+    # The cache can't be created inside a file
+    c = config.load(config_file, cache_file=config_file + "/config.json")
+    assert c.setting('username') == 'jdoe'
+
+
+@pytest.mark.parametrize('setting, message', [
+    ('session_duration = "forever"', 'a whole number or "auto"'),
+    ('refresh_threshold = true', 'a whole number'),
+    ('sts_region = 1', 'a string or a list of strings'),
+    ('daemon_profiles = [1, 2]', 'a list of strings'),
+])
+def test_invalid_types(tmp_path, setting, message):
+    path = write_config(tmp_path, '[general]\nusername = "jdoe"\n'
+                        'okta_server = "example.okta.com"\n%s\n' % setting)
+    with pytest.raises(exceptions.ConfigError, match=message):
+        config.load(path)
+
+
+def test_missing_required_settings(tmp_path):
+    path = write_config(tmp_path, '[general]\nusername = "jdoe"\n')
+    with pytest.raises(exceptions.ConfigError, match="okta_server"):
+        config.load(path)
+
+
+def test_setting_outside_section(tmp_path):
+    path = write_config(tmp_path, 'username = "jdoe"\n[general]\n')
+    with pytest.raises(exceptions.ConfigError, match="should be in a section"):
+        config.load(path)
+
+
+def test_invalid_toml(tmp_path):
+    path = write_config(tmp_path, '[general\n')
+    with pytest.raises(exceptions.ConfigError, match="Error reading"):
+        config.load(path)
+
+
+def test_unknown_setting_logged(tmp_path, caplog):
+    path = write_config(tmp_path, '[general]\nusername = "jdoe"\n'
+                        'okta_server = "example.okta.com"\n'
+                        'sesion_duration = 3600\n')
+    with caplog.at_level(logging.WARNING):
+        config.load(path)
+    assert "Unknown setting sesion_duration in [general]" in caplog.text
+
+
+def test_groups(tmp_path):
+    path = write_config(tmp_path, '[general]\nusername = "jdoe"\n'
+                        'okta_server = "example.okta.com"\n'
+                        '[groups]\nprod = ["a-prod", "*-prod"]\n')
+    c = config.load(path)
+    assert c['groups']['prod'] == ('a-prod', '*-prod')
+    assert c.setting('username', profile='groups') == 'jdoe'
+
+
+def test_invalid_group(tmp_path):
+    path = write_config(tmp_path, '[general]\nusername = "jdoe"\n'
+                        'okta_server = "example.okta.com"\n'
+                        '[groups]\nprod = "a-prod"\n')
+    with pytest.raises(exceptions.ConfigError, match="Group prod"):
+        config.load(path)
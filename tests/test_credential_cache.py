@@ -0,0 +1,83 @@
+# pylint: disable=invalid-name,missing-docstring
+import datetime
+
+from okta_aws import cache, config, credentials_file, okta_aws
+
+
+def in_seconds(seconds):
+    return datetime.datetime.now(datetime.timezone.utc) + \
+        datetime.timedelta(seconds=seconds)
+
+
+def creds(expiration):
+    return {
+        'AccessKeyId': 'ASIAABCDEFG123456789',
+        'SecretAccessKey': 'secret',
+        'SessionToken': 'token',
+        'Expiration': expiration,
+    }
+
+
+def test_credential_cache_round_trip(tmp_path):
+    cc = cache.CredentialCache(str(tmp_path / "credentials.json"))
+    cc.put('dev', 'Okta_Admin', 3600, creds(in_seconds(3000)))
+
+    cached = cc.get('dev', 'Okta_Admin', 3600, min_lifetime=900)
+    assert cached['AccessKeyId'] == 'ASIAABCDEFG123456789'
+    # Expiration is stored as a string
+    assert isinstance(cached['Expiration'], str)
+
+
+def test_credential_cache_key_includes_role_and_duration(tmp_path):
+    cc = cache.CredentialCache(str(tmp_path / "credentials.json"))
+    cc.put('dev', 'Okta_Admin', 3600, creds(in_seconds(3000)))
+
+    assert cc.get('dev', 'Okta_ReadOnly', 3600) is None
+    assert cc.get('dev', 'Okta_Admin', 7200) is None
+    assert cc.get('prod', 'Okta_Admin', 3600) is None
+
+
+def test_credential_cache_threshold(tmp_path):
+    cc = cache.CredentialCache(str(tmp_path / "credentials.json"))
+    cc.put('dev', None, 3600, creds('2018-04-24T00:00:00Z'))
+    assert cc.get('dev', None, 3600) is None
+
+    cc.put('dev', None, 3600, creds(in_seconds(600)))
+    assert cc.get('dev', None, 3600, min_lifetime=300) is not None
+    assert cc.get('dev', None, 3600, min_lifetime=900) is None
+
+
+def make_oa(tmp_path, monkeypatch, *args):
+    monkeypatch.setenv('AWS_SHARED_CREDENTIALS_FILE',
+                       str(tmp_path / "aws_credentials"))
+    oa = okta_aws.OktaAWS(['dev'] + list(args))
+    oa.config = config.Config({
+        'general': {'cache_dir': str(tmp_path / "cache"),
+                    'session_duration': 3600,
+                    'refresh_threshold': 900}})
+    return oa
+
+
+def test_get_cached_credentials(tmp_path, monkeypatch):
+    oa = make_oa(tmp_path, monkeypatch)
+    aws_creds = creds(in_seconds(3000))
+    oa.credential_cache.put('dev', None, 3600, aws_creds)
+    # Not in the credentials file yet
+    assert oa.get_cached_credentials('dev') is None
+
+    oa.store_aws_creds_in_profile('dev', aws_creds)
+    assert oa.get_cached_credentials('dev')['AccessKeyId'] == \
+        'ASIAABCDEFG123456789'
+
+    # Someone else replaced the credentials in the file
+    credentials_file.update_profiles(
+        {'dev': {'aws_access_key_id': 'OTHER'}})
+    assert oa.get_cached_credentials('dev') is None
+
+
+def test_get_cached_credentials_force(tmp_path, monkeypatch):
+    oa = make_oa(tmp_path, monkeypatch, '--force')
+    aws_creds = creds(in_seconds(3000))
+    oa.credential_cache.put('dev', None, 3600, aws_creds)
+    oa.store_aws_creds_in_profile('dev', aws_creds)
+    assert oa.get_cached_credentials('dev') is None
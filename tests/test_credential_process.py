@@ -0,0 +1,70 @@
+# pylint: disable=invalid-name,missing-docstring
+import datetime
+import json
+from unittest.mock import patch
+
+import pytest
+
+from okta_aws import config, exceptions, okta_aws
+
+
+AWS_CREDS = {
+    'AccessKeyId': 'ASIAABCDEFG123456789',
+    'SecretAccessKey': 'secret',
+    'SessionToken': 'token',
+    'Expiration': datetime.datetime(2018, 4, 24,
+                                    tzinfo=datetime.timezone.utc),
+}
+
+
+@pytest.fixture
+def cp(tmp_path):
+    oa = okta_aws.OktaAWS(['--credential-process', 'dev'])
+    oa.config = config.Config({
+        'general': {'cache_dir': str(tmp_path / "cache"),
+                    'cookie_file': str(tmp_path / "cookie"),
+                    'session_duration': 3600,
+                    'refresh_threshold': 900}})
+    return oa
+
+
+def test_credential_process_args(cp):
+    assert cp.profile == 'dev'
+    assert not cp.interactive
+
+
+def test_credential_process_output(cp):
+    output = json.loads(cp.credential_process_output(AWS_CREDS))
+    assert output == {
+        'Version': 1,
+        'AccessKeyId': 'ASIAABCDEFG123456789',
+        'SecretAccessKey': 'secret',
+        'SessionToken': 'token',
+        'Expiration': '2018-04-24T00:00:00+00:00',
+    }
+
+
+def test_credential_process_uses_cache(cp, capsys):
+    creds = dict(AWS_CREDS)
+    creds['Expiration'] = datetime.datetime.now(datetime.timezone.utc) + \
+        datetime.timedelta(hours=1)
+    cp.credential_cache.put('dev', None, 3600, creds)
+    with patch.object(cp, 'get_okta_session') as patched_session:
+        cp.credential_process()
+        patched_session.assert_not_called()
+    output = json.loads(capsys.readouterr().out)
+    assert output['AccessKeyId'] == 'ASIAABCDEFG123456789'
+
+
+def test_credential_process_not_logged_in(cp):
+    with pytest.raises(exceptions.LoginError, match="Not logged in"):
+        cp.credential_process()
+
+
+def test_credential_process_never_prompts_for_role(cp):
+    arns = [['principal', 'arn:aws:iam::012345678901:role/One'],
+            ['principal', 'arn:aws:iam::012345678901:role/Two']]
+    with patch('builtins.input') as patched_input:
+        with pytest.raises(exceptions.RoleError):
+            cp.select_role(arns, 'dev')
+        patched_input.assert_not_called()
@@ -0,0 +1,78 @@
+# pylint: disable=invalid-name,missing-docstring
+import os
+import stat
+
+from okta_aws import credentials_file
+
+
+EXISTING = """# My AWS credentials
+[default]
+aws_access_key_id = AKIADEFAULT
+aws_secret_access_key = defaultsecret
+
+; static keys, don't touch
+[static]
+aws_access_key_id = AKIASTATIC
+aws_secret_access_key = staticsecret
+
+[okta-dev]
+aws_access_key_id = OLDKEY
+aws_secret_access_key = oldsecret
+aws_session_token = oldtoken
+region = us-west-2
+"""
+
+NEW_CREDS = {
+    'aws_access_key_id': 'NEWKEY',
+    'aws_secret_access_key': 'newsecret',
+    'aws_session_token': 'newtoken',
+}
+
+
+def test_merge_updates_existing_profile():
+    merged = credentials_file.merge_profiles(EXISTING,
+                                             {'okta-dev': NEW_CREDS})
+    assert merged == EXISTING.replace('OLDKEY', 'NEWKEY') \
+        .replace('oldsecret', 'newsecret').replace('oldtoken', 'newtoken')
+
+
+def test_merge_adds_missing_keys_and_profiles():
+    merged = credentials_file.merge_profiles(EXISTING, {
+        'default': {'aws_session_token': 'tok'},
+        'okta-prod': NEW_CREDS})
+    profiles = credentials_file.parse_profiles(merged)
+    assert profiles['default'] == {
+        'aws_access_key_id': 'AKIADEFAULT',
+        'aws_secret_access_key': 'defaultsecret',
+        'aws_session_token': 'tok'}
+    assert profiles['okta-prod'] == NEW_CREDS
+    assert profiles['static']['aws_access_key_id'] == 'AKIASTATIC'
+    assert "# My AWS credentials" in merged
+    assert "; static keys, don't touch" in merged
+    # The new key is added to the default section, before the blank line
+    assert "aws_session_token = tok\n\n; static keys" in merged
+
+
+def test_merge_empty_file():
+    merged = credentials_file.merge_profiles('', {'okta-dev': NEW_CREDS})
+    assert merged == ("[okta-dev]\n"
+                      "aws_access_key_id = NEWKEY\n"
+                      "aws_secret_access_key = newsecret\n"
+                      "aws_session_token = newtoken\n")
+
+
+def test_update_profiles(tmp_path):
+    path = str(tmp_path / "aws" / "credentials")
+    credentials_file.update_profiles({'one': NEW_CREDS}, path)
+    credentials_file.update_profiles({'two': NEW_CREDS}, path)
+
+    assert credentials_file.read_profiles(path) == {
+        'one': NEW_CREDS, 'two': NEW_CREDS}
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+    # No temporary files are left behind
+    assert sorted(os.listdir(str(tmp_path / "aws"))) == \
+        ['credentials', 'credentials.lock']
+
+
+def test_read_profiles_missing_file(tmp_path):
+    assert credentials_file.read_profiles(str(tmp_path / "nope")) == {}
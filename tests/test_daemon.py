@@ -0,0 +1,104 @@
+# pylint: disable=invalid-name,missing-docstring
+import pytest
+
+from okta_aws import daemon, exceptions
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def make_scheduler(refresh, keepalive=None, **kwargs):
+    clock = FakeClock()
+    return clock, daemon.RefreshScheduler(
+        refresh, keepalive, clock=clock.time, sleep=clock.sleep, **kwargs)
+
+
+def test_refreshes_before_expiry():
+    calls = []
+
+    def refresh(profile):
+        calls.append((profile, clock.now))
+        return clock.now + 3600
+
+    clock, scheduler = make_scheduler(refresh, margin=300)
+    scheduler.schedule('one', clock.now)
+    scheduler.schedule('two', clock.now + 10)
+    for _ in range(4):
+        scheduler.run_once()
+
+    assert calls == [('one', 1000.0), ('two', 1010.0),
+                     ('one', 4300.0), ('two', 4310.0)]
+
+
+def test_retries_after_failure():
+    calls = []
+
+    def refresh(profile):
+        calls.append(clock.now)
+        if len(calls) == 1:
+            raise RuntimeError("STS is down")
+        return clock.now + 3600
+
+    clock, scheduler = make_scheduler(refresh, retry_interval=60)
+    scheduler.schedule('one', clock.now)
+    scheduler.run_once()
+    scheduler.run_once()
+    assert calls == [1000.0, 1060.0]
+    assert scheduler.next_run() == 1060.0 + 3600 - 300
+
+
+def test_never_schedules_in_the_past():
+    clock, scheduler = make_scheduler(lambda p: clock.now + 10, margin=300,
+                                      retry_interval=60)
+    scheduler.schedule('one', clock.now)
+    scheduler.run_once()
+    assert scheduler.next_run() == 1060.0
+
+
+def test_keepalive():
+    checks = []
+    clock, scheduler = make_scheduler(lambda p: clock.now + 3600,
+                                      keepalive=lambda: checks.append(
+                                          clock.now),
+                                      keepalive_interval=300)
+    scheduler.schedule('one', clock.now)
+    for _ in range(3):
+        scheduler.run_once()
+    assert checks == [1300.0, 1600.0]
+
+
+def test_keepalive_failure_stops_scheduler():
+    def keepalive():
+        raise exceptions.LoginError("Okta session has expired")
+
+    clock, scheduler = make_scheduler(lambda p: clock.now + 3600,
+                                      keepalive=keepalive)
+    with pytest.raises(exceptions.LoginError, match="session has expired"):
+        scheduler.run()
+
+
+def test_keepalive_network_error_retried():
+    checks = []
+
+    def keepalive():
+        checks.append(clock.now)
+        if len(checks) == 1:
+            raise exceptions.NetworkError("Timed out connecting to okta")
+
+    clock, scheduler = make_scheduler(lambda p: clock.now + 3600,
+                                      keepalive=keepalive,
+                                      keepalive_interval=300,
+                                      retry_interval=60)
+    scheduler.schedule('one', clock.now)
+    for _ in range(4):
+        scheduler.run_once()
+    # Tried again after retry_interval, then back to keepalive_interval
+    assert checks == [1300.0, 1360.0, 1660.0]
@@ -0,0 +1,53 @@
+# pylint: disable=invalid-name,missing-docstring
+from unittest.mock import patch
+
+from okta_aws import exceptions
+
+
+def test_fetch_all_credentials(oa):
+    applinks = {'one': 'url1', 'two': 'url2', 'three': 'url3'}
+
+    def fake_fetch(applinks, session_id, profile, store):
+        assert not store
+        if profile == 'two':
+            raise exceptions.SAMLError("Problem getting SAML assertion")
+        return {'AccessKeyId': profile}
+
+    with patch.object(oa, 'fetch_credentials', side_effect=fake_fetch), \
+            patch.object(oa, 'store_aws_creds_in_profiles') as patched_store:
+        results = oa.fetch_all_credentials(applinks, 'session_id', jobs=2)
+
+    # All successful profiles are written in one batch
+    patched_store.assert_called_once_with({
+        'one': {'AccessKeyId': 'one'},
+        'three': {'AccessKeyId': 'three'}})
+
+    assert set(results.keys()) == {'one', 'two', 'three'}
+    assert results['one'] is None
+    assert results['three'] is None
+    assert isinstance(results['two'], exceptions.SAMLError)
+
+
+def test_fetch_all_credentials_unexpected_error(oa):
+    applinks = {'one': 'url1', 'two': 'url2'}
+
+    def fake_fetch(applinks, session_id, profile, store):
+        if profile == 'one':
+            raise ValueError("boom")
+        return {'AccessKeyId': profile}
+
+    with patch.object(oa, 'fetch_credentials', side_effect=fake_fetch), \
+            patch.object(oa, 'store_aws_creds_in_profiles'):
+        results = oa.fetch_all_credentials(applinks, 'session_id', jobs=2)
+
+    assert isinstance(results['one'], ValueError)
+    assert results['two'] is None
+
+
+def test_report_results(oa, capsys):
+    assert oa.report_results({'one': None, 'two': None})
+    assert not oa.report_results(
+        {'one': None, 'two': exceptions.SAMLError("bad")})
+    out = capsys.readouterr().out
+    assert "Fetched credentials for 1 of 2 profiles" in out
+    assert "FAILED  two: bad" in out
@@ -0,0 +1,85 @@
+# pylint: disable=invalid-name,missing-docstring
+import time
+from unittest.mock import patch
+
+import pytest
+
+from okta_aws import config, okta_aws
+
+
+APPLINKS = {
+    'Company Engineering (dev use) AWS': 'https://example.okta.com/eng',
+    'Company Prod AWS': 'https://example.okta.com/prod',
+}
+
+
+def make_oa(tmp_path, *args):
+    oa = okta_aws.OktaAWS(list(args))
+    oa.config = config.Config({
+        'general': {'cache_dir': str(tmp_path),
+                    'okta_server': 'example.okta.com',
+                    'username': 'fakey',
+                    'short_profile_names': True,
+                    'applinks_ttl': 3600},
+        'aliases': {'eng': 'company-engineering'}})
+    return oa
+
+
+@pytest.fixture
+def patched_okta():
+    with patch.object(okta_aws.OktaAWS, 'iter_assigned_applications',
+                      side_effect=lambda s: iter(APPLINKS.items())) \
+            as patched:
+        yield patched
+
+
+def test_get_applinks_is_cached(tmp_path, patched_okta):
+    oa = make_oa(tmp_path)
+    expected = {'company-engineering': 'https://example.okta.com/eng',
+                'company-prod': 'https://example.okta.com/prod'}
+    assert oa.get_applinks('session_id') == expected
+    assert oa.get_applinks('session_id', 'eng') == expected
+    assert oa.load_cached_applinks() == expected
+    assert patched_okta.call_count == 1
+
+
+def test_get_applinks_unknown_profile_refreshes(tmp_path, patched_okta):
+    oa = make_oa(tmp_path)
+    oa.get_applinks('session_id')
+    oa.get_applinks('session_id', 'company-new')
+    assert patched_okta.call_count == 2
+
+
+def test_get_applinks_expired(tmp_path, patched_okta):
+    oa = make_oa(tmp_path)
+    oa.get_applinks('session_id')
+    with patch('time.time', return_value=time.time() + 7200):
+        assert oa.load_cached_applinks() is None
+        oa.get_applinks('session_id')
+    assert patched_okta.call_count == 2
+
+
+def test_get_applinks_force(tmp_path, patched_okta):
+    oa = make_oa(tmp_path, '--force')
+    oa.get_applinks('session_id')
+    oa.get_applinks('session_id')
+    assert patched_okta.call_count == 2
+
+
+def test_get_applinks_keyed_on_user(tmp_path, patched_okta, set_config):
+    oa = make_oa(tmp_path)
+    oa.get_applinks('session_id')
+    set_config(oa, 'general', username='someone_else')
+    assert oa.load_cached_applinks() is None
+
+
+def test_list_profiles(oa, capsys, set_config):
+    set_config(oa, 'aliases', eng='company-engineering')
+    applinks = {'company-engineering': 'url1', 'company-prod': 'url2'}
+    oa.list_profiles(applinks)
+    assert capsys.readouterr().out == (
+        "Available profiles:\n"
+        "company-engineering (Aliases: eng)\n"
+        "company-prod\n")
+    oa.list_profiles(applinks, names_only=True)
+    assert capsys.readouterr().out == "company-engineering\ncompany-prod\n"
@@ -1,5 +1,10 @@
 #!/usr/bin/env python3
 # pylint: disable=invalid-name,missing-docstring
+import base64
+
+import pytest
+
+from okta_aws import exceptions
 
 
 def test_get_arns(oa, shared_datadir):
@@ -11,3 +16,20 @@ def test_get_arns(oa, shared_datadir):
     assert arns[0] == 'arn:aws:iam::012345678901:saml-provider/OKTA'
     # Role
     assert arns[1] == 'arn:aws:iam::012345678901:role/Okta_AdministratorAccess'
+
+
+@pytest.mark.parametrize('length', [101, 200])
+def test_get_arns_truncated_assertion(oa, shared_datadir, length):
+    # Cutting the base64 short breaks the padding, and cutting it on a
+    # boundary leaves an XML document that never ends
+    with open("%s/saml_assertion.txt" % shared_datadir) as fh:
+        assertion = ''.join(fh.read().split())[:length]
+    with pytest.raises(exceptions.SAMLError, match="SAML assertion"):
+        oa.get_arns(assertion)
+
+
+def test_get_arns_invalid_session_duration(oa, shared_datadir):
+    with open("%s/saml_assertion_decoded.txt" % shared_datadir) as fh:
+        xml = fh.read().replace('>43200<', '>soon<')
+    with pytest.raises(exceptions.SAMLError, match="SAML assertion"):
+        oa.get_arns(base64.b64encode(xml.encode()).decode())
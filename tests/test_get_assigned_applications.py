@@ -0,0 +1,79 @@
+# pylint: disable=invalid-name,missing-docstring
+import json
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from okta_aws import exceptions
+
+
+def app(label, app_name='amazon_aws'):
+    return {'label': label, 'appName': app_name,
+            'linkUrl': 'https://example.okta.com/%s' % label}
+
+
+def fake_page(apps, next_url=None, status_code=200):
+    response = MagicMock()
+    response.__enter__.return_value = response
+    response.status_code = status_code
+    data = json.dumps(apps).encode('utf-8')
+    response.iter_content.return_value = [data[i:i + 7]
+                                          for i in range(0, len(data), 7)]
+    response.links = {'next': {'url': next_url}} if next_url else {}
+    return response
+
+
+def test_iter_assigned_applications_paginates(oa, set_config):
+    set_config(oa, 'general', okta_server='example.okta.com')
+    pages = [
+        fake_page([app('One AWS'), app('Slack', 'slack')], 'https://next/2'),
+        fake_page([app('Two AWS')], 'https://next/3'),
+        fake_page([app('Three AWS')]),
+    ]
+    with patch("requests.Session.get", side_effect=pages) as patched_get:
+        applinks = dict(oa.iter_assigned_applications('session_id'))
+
+    assert list(applinks.keys()) == ['One AWS', 'Two AWS', 'Three AWS']
+    assert [c[0][0] for c in patched_get.call_args_list] == [
+        'https://example.okta.com/api/v1/users/me/appLinks?limit=200',
+        'https://next/2', 'https://next/3']
+
+
+def test_iter_assigned_applications_is_lazy(oa, set_config):
+    set_config(oa, 'general', okta_server='example.okta.com')
+    pages = [fake_page([app('One AWS')], 'https://next/2'),
+             fake_page([app('Two AWS')])]
+    with patch("requests.Session.get", side_effect=pages) as patched_get:
+        apps = oa.iter_assigned_applications('session_id')
+        assert next(apps)[0] == 'One AWS'
+        # The second page isn't requested until it is needed
+        assert patched_get.call_count == 1
+        assert next(apps)[0] == 'Two AWS'
+        assert patched_get.call_count == 2
+
+
+def test_iter_assigned_applications_error(oa, set_config):
+    set_config(oa, 'general', okta_server='example.okta.com')
+    with patch("requests.Session.get",
+               return_value=fake_page([], status_code=500)):
+        with pytest.raises(exceptions.ApplicationError, match="500"):
+            list(oa.iter_assigned_applications('session_id'))
+
+
+def test_iter_assigned_applications_rejected_session(oa, set_config):
+    set_config(oa, 'general', okta_server='example.okta.com')
+    with patch("requests.Session.get",
+               return_value=fake_page([], status_code=403)):
+        with pytest.raises(exceptions.SessionError, match="403"):
+            list(oa.iter_assigned_applications('session_id'))
+
+
+def test_iter_applinks_shortens_names(oa, set_config, tmp_path):
+    set_config(oa, 'general', okta_server='example.okta.com',
+               cache_dir=str(tmp_path), short_profile_names=True,
+               applinks_ttl=3600)
+    pages = [fake_page([app('Company Engineering (dev use) AWS'),
+                        app('Company  Prod AWS')])]
+    with patch("requests.Session.get", side_effect=pages):
+        applinks = dict(oa.iter_applinks('session_id'))
+    assert list(applinks.keys()) == ['company-engineering', 'company-prod']
@@ -4,7 +4,7 @@ from unittest.mock import patch
 
 
 def test_get_saml_assertion(oa, shared_datadir):
-    with patch("requests.post") as patched_post:
+    with patch("requests.Session.post") as patched_post:
         patched_post.return_value.status_code = 200
         with open("%s/saml_assertion_page.html" % shared_datadir) as fh:
             patched_post.return_value.text = fh.read()
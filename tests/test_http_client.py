@@ -0,0 +1,65 @@
+# pylint: disable=invalid-name,missing-docstring
+import time
+from unittest.mock import MagicMock, patch
+
+import pytest
+import requests
+
+from okta_aws import exceptions, http_client
+
+
+def fake_response(headers):
+    response = MagicMock()
+    response.headers = headers
+    return response
+
+
+def test_retry_honours_rate_limit_reset():
+    retry = http_client.OktaRetry(total=3)
+    reset = time.time() + 5
+    wait = retry.get_retry_after(
+        fake_response({'X-Rate-Limit-Reset': str(int(reset))}))
+    assert 0 <= wait <= 5
+
+
+def test_retry_caps_rate_limit_wait():
+    retry = http_client.OktaRetry(total=3)
+    wait = retry.get_retry_after(fake_response(
+        {'X-Rate-Limit-Reset': str(int(time.time() + 3600))}))
+    assert wait == http_client.OktaRetry.MAX_RATE_LIMIT_WAIT
+
+
+def test_retry_prefers_retry_after():
+    retry = http_client.OktaRetry(total=3)
+    assert retry.get_retry_after(fake_response({'Retry-After': '2'})) == 2
+
+
+def test_retry_post_only_when_rate_limited():
+    retry = http_client.OktaRetry(total=3,
+                                  status_forcelist=[429, 500, 503])
+    assert retry.is_retry('POST', 429)
+    assert not retry.is_retry('POST', 503)
+    assert retry.is_retry('GET', 503)
+    assert not retry.is_retry('GET', 404)
+
+
+def test_session_sets_default_timeout():
+    session = http_client.OktaSession(timeout=(1, 2))
+    with patch("requests.Session.send") as patched_send:
+        session.get("https://example.okta.com/")
+        assert patched_send.call_args[1]['timeout'] == (1, 2)
+
+
+def test_session_reuses_one_adapter():
+    session = http_client.OktaSession(pool_size=20)
+    adapter = session.get_adapter("https://example.okta.com/")
+    assert adapter is session.get_adapter("https://other.okta.com/")
+    assert adapter._pool_maxsize == 20  # pylint: disable=protected-access
+
+
+def test_session_wraps_connection_errors():
+    session = http_client.OktaSession()
+    with patch("requests.Session.send",
+               side_effect=requests.exceptions.ConnectTimeout("timed out")):
+        with pytest.raises(exceptions.NetworkError, match="timed out"):
+            session.get("https://example.okta.com/")
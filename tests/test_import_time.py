@@ -0,0 +1,54 @@
+# pylint: disable=invalid-name,missing-docstring
+"""Guards okta_aws's start up time. Shell prompts and wrappers run okta_aws
+many times a day, so importing the command line entry point must stay cheap
+and mustn't pull in the heavy dependencies that are only needed when
+actually talking to okta or AWS."""
+import os
+import subprocess
+import sys
+
+# Cumulative import time budget for okta_aws.__main__, in milliseconds
+IMPORT_BUDGET_MS = int(os.getenv('OKTA_AWS_IMPORT_BUDGET_MS', '100'))
+
+HEAVY_MODULES = [
+    'asyncio',
+    'botocore',
+    'http.server',
+    'requests',
+    'toml',
+    'urllib3',
+    'xml.etree.ElementTree',
+]
+
+
+def import_times(tmp_path):
+    """Returns a dictionary mapping each module imported by okta_aws.__main__
+    to its cumulative import time in microseconds."""
+    env = dict(os.environ)
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    env['PYTHONPYCACHEPREFIX'] = str(tmp_path)
+    cmd = [sys.executable, '-X', 'importtime', '-c',
+           'import okta_aws.__main__']
+    # Run once to compile the byte code, then measure a run that uses it
+    subprocess.run(cmd, env=env, check=True, stderr=subprocess.DEVNULL)
+    result = subprocess.run(cmd, env=env, check=True, stderr=subprocess.PIPE,
+                            universal_newlines=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def test_heavy_modules_not_imported(tmp_path):
+    times = import_times(tmp_path)
+    assert 'okta_aws.okta_aws' in times
+    imported = [m for m in HEAVY_MODULES if m in times]
+    assert imported == []
+
+
+def test_import_time_budget(tmp_path):
+    times = import_times(tmp_path)
+    assert times['okta_aws.__main__'] / 1000.0 < IMPORT_BUDGET_MS
@@ -0,0 +1,35 @@
+# pylint: disable=invalid-name,missing-docstring
+import json
+
+import pytest
+
+from okta_aws import jsonstream
+
+
+DOC = [{'label': 'Company AWS', 'linkUrl': 'https://x/y?a=1,]'}, 12345,
+       ['nested', {'a': None}], 'café', True]
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 5, 1000])
+def test_iter_json_array_chunks(chunk_size):
+    data = json.dumps(DOC, indent=2).encode('utf-8')
+    chunks = [data[i:i + chunk_size]
+              for i in range(0, len(data), chunk_size)]
+    assert list(jsonstream.iter_json_array(chunks)) == DOC
+
+
+def test_iter_json_array_empty():
+    assert list(jsonstream.iter_json_array([' [ ', ' ] '])) == []
+
+
+def test_iter_json_array_yields_before_end():
+    items = jsonstream.iter_json_array(iter(['[{"a": 1}, ', '{"b"']))
+    assert next(items) == {'a': 1}
+    with pytest.raises(ValueError):
+        next(items)
+
+
+@pytest.mark.parametrize('doc', ['{"a": 1}', '[1, 2', '[1 2]', '[1]x', ''])
+def test_iter_json_array_invalid(doc):
+    with pytest.raises(ValueError):
+        list(jsonstream.iter_json_array([doc]))
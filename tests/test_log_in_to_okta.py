@@ -9,7 +9,7 @@ from unittest.mock import patch
 
 def test_log_in_to_okta_success(oa, shared_datadir):
     oa.config = oa.load_config("%s/okta_aws.toml" % shared_datadir)
-    with patch("requests.post") as patched_post:
+    with patch("requests.Session.post") as patched_post:
         patched_post.return_value.status_code = 200
         with open("%s/okta_auth_success.json" % shared_datadir) as fh:
             text = fh.read()
@@ -23,7 +23,7 @@ def test_log_in_to_okta_success(oa, shared_datadir):
 
 def test_log_in_to_okta_incorrect_password(oa, shared_datadir):
     oa.config = oa.load_config("%s/okta_aws.toml" % shared_datadir)
-    with patch("requests.post") as patched_post:
+    with patch("requests.Session.post") as patched_post:
         patched_post.return_value.status_code = 401
 
         with pytest.raises(exceptions.LoginError, match="Incorrect password"):
@@ -32,7 +32,7 @@ def test_log_in_to_okta_incorrect_password(oa, shared_datadir):
 
 def test_log_in_to_okta_password_expired(oa, shared_datadir):
     oa.config = oa.load_config("%s/okta_aws.toml" % shared_datadir)
-    with patch("requests.post") as patched_post:
+    with patch("requests.Session.post") as patched_post:
         patched_post.return_value.status_code = 200
         with open("%s/okta_auth_password_expired.json" % shared_datadir) as fh:
             text = fh.read()
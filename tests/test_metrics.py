@@ -0,0 +1,110 @@
+# pylint: disable=invalid-name,missing-docstring
+import json
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from okta_aws import exceptions, http_client, metrics
+
+
+def read_lines(path):
+    with open(path) as fh:
+        return [json.loads(line) for line in fh]
+
+
+def test_phase_totals():
+    m = metrics.Metrics()
+    for _ in range(2):
+        with m.phase('saml'):
+            pass
+    assert m.phases['saml'].calls == 2
+    assert m.phases['saml'].seconds >= 0
+
+
+def test_phase_records_errors():
+    m = metrics.Metrics()
+    with pytest.raises(exceptions.SAMLError):
+        with m.phase('saml'):
+            raise exceptions.SAMLError("oops")
+    assert m.phases['saml'].errors == 1
+
+
+def test_http_counted_against_current_phase(tmp_path):
+    path = str(tmp_path / 'metrics.jsonl')
+    m = metrics.Metrics(path)
+    with m.phase('fetch', 'myprofile'):
+        with m.phase('saml'):
+            m.http('POST', 'https://example.okta.com/app?x=1', 200, 1234, 1,
+                   0.5)
+    m.close()
+    assert m.phases['saml'].requests == 1
+    assert m.phases['saml'].bytes == 1234
+    assert m.phases['saml'].retries == 1
+    http, saml, fetch = read_lines(path)
+    assert http['event'] == 'http'
+    assert http['url'] == 'https://example.okta.com/app'
+    assert http['profile'] == 'myprofile'
+    assert saml['phase'] == 'saml'
+    assert saml['profile'] == 'myprofile'
+    assert fetch['phase'] == 'fetch'
+    assert http['run'] == saml['run'] == fetch['run'] == m.run_id
+
+
+def test_phase_extra_fields(tmp_path):
+    path = str(tmp_path / 'metrics.jsonl')
+    m = metrics.Metrics(path)
+    with m.phase('sts', 'myprofile', region='us-east-1') as record:
+        record['retries'] = 2
+    m.close()
+    line, = read_lines(path)
+    assert line['region'] == 'us-east-1'
+    assert line['retries'] == 2
+    assert m.phases['sts'].retries == 2
+
+
+def test_unwritable_metrics_file(tmp_path):
+    m = metrics.Metrics(str(tmp_path / 'missing' / 'metrics.jsonl'))
+    with m.phase('saml'):
+        pass
+    assert m.path is None
+    assert m.phases['saml'].calls == 1
+
+
+def test_format_summary():
+    m = metrics.Metrics()
+    with m.phase('authn'):
+        m.http('POST', 'https://example.okta.com/api/v1/authn', 200, 10, 0,
+               0.1)
+    lines = m.format_summary(total=1.5).splitlines()
+    assert lines[0].split()[0] == 'phase'
+    assert lines[1].split()[:2] == ['authn', '1']
+    assert lines[-1].split() == ['total', '1500.0']
+
+
+def test_session_records_requests():
+    m = metrics.Metrics()
+    session = http_client.OktaSession(metrics=m)
+    response = MagicMock()
+    response.status_code = 200
+    response.content = b'{"id": "abc"}'
+    response.raw.retries.history = ()
+    with patch("requests.Session.request", return_value=response), \
+            m.phase('sessions'):
+        session.post("https://example.okta.com/api/v1/sessions")
+    assert m.phases['sessions'].requests == 1
+    assert m.phases['sessions'].bytes == 13
+
+
+def test_run_prints_timings(shared_datadir, capsys):
+    from okta_aws import okta_aws
+    oa = okta_aws.OktaAWS(['--timings', '--list', '-c',
+                           str(shared_datadir / 'okta_aws.toml')])
+    with patch.object(oa, 'load_cached_applinks',
+                      return_value={'company-engineering': 'url'}), \
+            patch.object(oa, 'preflight_checks'), \
+            pytest.raises(SystemExit):
+        oa.run()
+    err = capsys.readouterr().err
+    assert err.splitlines()[0].split()[0] == 'phase'
+    assert 'config' in err
+    assert 'total' in err
@@ -0,0 +1,143 @@
+# pylint: disable=invalid-name,missing-docstring
+import io
+import json
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from okta_aws import exceptions, spinner
+
+PUSH_URL = \
+    'https://example.okta.com/api/v1/authn/factors/push0000000000000000/verify'
+POLL_URL = PUSH_URL + '/poll'
+
+
+def response(body, status_code=200):
+    r = MagicMock()
+    r.status_code = status_code
+    r.json.return_value = body
+    r.text = json.dumps(body)
+    return r
+
+
+def challenge(result='WAITING'):
+    return response({
+        'status': 'MFA_CHALLENGE',
+        'factorResult': result,
+        '_links': {'next': {'name': 'poll', 'href': POLL_URL}},
+    })
+
+
+SUCCESS = response({'status': 'SUCCESS', 'sessionToken': 'token123'})
+
+
+@pytest.fixture
+def mfa_required(shared_datadir):
+    with open("%s/okta_auth_mfa_required.json" % shared_datadir) as fh:
+        return json.load(fh)
+
+
+@pytest.fixture
+def tty():
+    with patch('sys.stdin') as stdin:
+        stdin.isatty.return_value = True
+        yield stdin
+
+
+@pytest.fixture(autouse=True)
+def no_wait():
+    with patch.object(spinner.Spinner, 'wait'), \
+            patch('sys.stderr', io.StringIO()):
+        yield
+
+
+def test_push_approved(oa):
+    with patch("requests.Session.post", side_effect=[
+            challenge(), challenge(), SUCCESS]) as patched_post:
+        session_data = oa.verify_push_factor(PUSH_URL, 'state')
+    assert session_data['sessionToken'] == 'token123'
+    assert [c[0][0] for c in patched_post.call_args_list] == \
+        [PUSH_URL, POLL_URL, POLL_URL]
+    assert patched_post.call_args[1]['json'] == {'stateToken': 'state'}
+
+
+def test_push_backs_off(oa):
+    waits = []
+    with patch("requests.Session.post", side_effect=[
+            challenge()] * 6 + [SUCCESS]), \
+            patch.object(spinner.Spinner, 'wait', side_effect=waits.append):
+        oa.verify_push_factor(PUSH_URL, 'state')
+    assert waits[0] == 1.0
+    assert waits == sorted(waits)
+    assert max(waits) == 5.0
+
+
+def test_push_rejected(oa):
+    with patch("requests.Session.post", side_effect=[
+            challenge(), challenge('REJECTED')]):
+        with pytest.raises(exceptions.LoginError, match="rejected"):
+            oa.verify_push_factor(PUSH_URL, 'state')
+
+
+def test_push_timeout(oa, set_config):
+    set_config(oa, 'general', push_timeout=0)
+    with patch("requests.Session.post", return_value=challenge()):
+        with pytest.raises(exceptions.LoginError, match="Timed out"):
+            oa.verify_push_factor(PUSH_URL, 'state')
+
+
+def test_mfa_uses_totp_by_default(oa, mfa_required, tty):
+    # pylint: disable=unused-argument
+    with patch.object(oa, 'verify_totp_factor',
+                      return_value={'status': 'SUCCESS'}) as totp:
+        oa.verify_mfa(mfa_required)
+    totp.assert_called_once_with(
+        'https://example.okta.com/api/v1/authn/factors/totp0000000000000000/'
+        'verify', '00stateToken')
+
+
+def test_mfa_factor_preference(oa, mfa_required, tty, set_config):
+    # pylint: disable=unused-argument
+    set_config(oa, 'dev',
+               factor_preference=['push', 'token:software:totp'])
+    oa.profile = 'dev'
+    with patch.object(oa, 'verify_push_factor',
+                      return_value={'status': 'SUCCESS'}) as push:
+        oa.verify_mfa(mfa_required)
+    push.assert_called_once_with(PUSH_URL, '00stateToken')
+
+
+def test_mfa_push_without_terminal(oa, mfa_required, tty):
+    tty.isatty.return_value = False
+    with patch.object(oa, 'verify_push_factor',
+                      return_value={'status': 'SUCCESS'}) as push:
+        oa.verify_mfa(mfa_required)
+    push.assert_called_once()
+
+
+def test_mfa_no_usable_factor(oa, mfa_required, tty, set_config):
+    # pylint: disable=unused-argument
+    set_config(oa, 'general', factor_preference='push')
+    mfa_required['_embedded']['factors'] = \
+        mfa_required['_embedded']['factors'][:1]
+    with pytest.raises(exceptions.LoginError, match="can be used"):
+        oa.verify_mfa(mfa_required)
+
+
+def test_log_in_to_okta_with_push(oa, shared_datadir, mfa_required, tty):
+    # pylint: disable=unused-argument
+    with open("%s/okta_aws.toml" % shared_datadir, 'a') as fh:
+        fh.write('factor_preference = "push"\n')
+    oa.config = oa.load_config("%s/okta_aws.toml" % shared_datadir)
+    with patch("requests.Session.post", side_effect=[
+            response(mfa_required), challenge(), SUCCESS]):
+        assert oa.log_in_to_okta('hunter2') == 'token123'
+
+
+def test_spinner_not_a_terminal():
+    stream = io.StringIO()
+    s = spinner.Spinner("Waiting", stream)
+    s.draw()
+    s.draw()
+    s.finish('done')
+    assert stream.getvalue() == "Waiting...\n"
@@ -0,0 +1,194 @@
+# pylint: disable=invalid-name,missing-docstring
+import datetime
+import threading
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from okta_aws import config, exceptions
+
+TARGET_ROLE = 'arn:aws:iam::%s:role/Deploy'
+
+
+def make_creds(name):
+    return {
+        'AccessKeyId': 'ASIA' + name.upper(),
+        'SecretAccessKey': 'secret-' + name,
+        'SessionToken': 'token-' + name,
+        'Expiration': datetime.datetime.now(datetime.timezone.utc) +
+        datetime.timedelta(hours=1),
+    }
+
+
+@pytest.fixture
+def oa(oa, tmp_path, monkeypatch):
+    monkeypatch.delenv('AWS_REGION', raising=False)
+    monkeypatch.delenv('AWS_DEFAULT_REGION', raising=False)
+    oa.config = config.Config({
+        'general': {
+            'username': 'jdoe@example.com',
+            'okta_server': 'example.okta.com',
+            'cache_dir': str(tmp_path),
+            'session_duration': 'auto',
+            'refresh_threshold': 900,
+        },
+        'aliases': {'h': 'hub'},
+        'app-one': {'source_profile': 'hub',
+                    'role_arn': TARGET_ROLE % '111111111111',
+                    'external_id': 'secret-id'},
+        'app-two': {'source_profile': 'h',
+                    'role_arn': TARGET_ROLE % '222222222222'},
+        'app-three': {'source_profile': 'app-two',
+                      'role_arn': TARGET_ROLE % '333333333333'},
+        'other': {'role_arn': 'Okta_ReadOnly'},
+    })
+    return oa
+
+
+@pytest.fixture
+def sts_client():
+    client = MagicMock()
+    client.assume_role.side_effect = lambda **kwargs: {
+        'Credentials': make_creds(kwargs['RoleArn'].split(':')[4])}
+    with patch('okta_aws.sts.get_client', return_value=client) as patched:
+        client.get_client = patched
+        yield client
+
+
+def test_chain_root(oa):
+    assert oa.chain_root('app-three') == 'hub'
+    assert oa.chain_root('app-one') == 'hub'
+    assert oa.chain_root('h') == 'hub'
+    assert oa.chain_root('other') == 'other'
+
+
+def test_chain_levels(oa):
+    assert oa.role_chains() == ['app-one', 'app-three', 'app-two']
+    assert oa.chain_levels(oa.role_chains()) == [
+        ['app-one', 'app-two'], ['app-three']]
+
+
+def test_check_role_chains_needs_role_arn(oa, set_config):
+    set_config(oa, 'app-one', role_arn='Deploy')
+    with pytest.raises(exceptions.ConfigError, match="app-one"):
+        config.check_role_chains(oa.config)
+
+
+def test_check_role_chains_loop(oa, set_config):
+    set_config(oa, 'hub', source_profile='app-three',
+               role_arn=TARGET_ROLE % '444444444444')
+    with pytest.raises(exceptions.ConfigError, match="leads back"):
+        config.check_role_chains(oa.config)
+
+
+def test_role_session_name(oa, set_config):
+    assert oa.role_session_name('app-one') == 'jdoe@example.com'
+    set_config(oa, 'general', role_session_name='J Doe (okta)')
+    assert oa.role_session_name('app-one') == 'J-Doe--okta-'
+
+
+def test_assume_chained_role(oa, sts_client):
+    hub_creds = make_creds('hub')
+    creds, duration = oa.assume_chained_role(hub_creds, 'app-one')
+    assert creds['AccessKeyId'] == 'ASIA111111111111'
+    assert duration == 3600
+    sts_client.get_client.assert_called_once_with('us-east-1', hub_creds)
+    sts_client.assume_role.assert_called_once_with(
+        RoleArn=TARGET_ROLE % '111111111111',
+        RoleSessionName='jdoe@example.com', DurationSeconds=3600,
+        ExternalId='secret-id')
+
+
+def test_chained_duration_limited_to_an_hour(oa, sts_client, set_config):
+    set_config(oa, 'general', session_duration=43200)
+    oa.assume_chained_role(make_creds('hub'), 'app-two')
+    assert sts_client.assume_role.call_args[1]['DurationSeconds'] == 3600
+    set_config(oa, 'general', session_duration=1800)
+    oa.assume_chained_role(make_creds('hub'), 'app-two')
+    assert sts_client.assume_role.call_args[1]['DurationSeconds'] == 1800
+
+
+def test_fetch_all_fans_out_from_hub(oa, sts_client):
+    applinks = {'hub': 'url-hub', 'other': 'url-other'}
+    with patch.object(oa, 'assume_okta_role', side_effect=lambda a, s, p: (
+            make_creds(p), 3600)) as patched_okta, \
+            patch.object(oa, 'store_aws_creds_in_profiles') as patched_store:
+        results = oa.fetch_all_credentials(applinks, 'session_id', jobs=4,
+                                           chained=oa.role_chains())
+
+    assert results == dict.fromkeys(
+        ['hub', 'other', 'app-one', 'app-two', 'app-three'])
+    # The hub is only fetched using okta once
+    assert sorted(c[0][2] for c in patched_okta.call_args_list) == \
+        ['hub', 'other']
+    # Everything is stored in one go
+    patched_store.assert_called_once()
+    stored = patched_store.call_args[0][0]
+    assert sorted(stored) == sorted(results)
+    # app-three is assumed using app-two's credentials
+    signed_with = [c[0][1]['AccessKeyId']
+                   for c in sts_client.get_client.call_args_list]
+    assert sorted(signed_with) == ['ASIA222222222222', 'ASIAHUB', 'ASIAHUB']
+
+
+def test_fetch_all_source_failure(oa, sts_client):
+    def assume_okta_role(applinks, session_id, profile):
+        raise exceptions.SAMLError("Problem getting SAML assertion")
+
+    with patch.object(oa, 'assume_okta_role', side_effect=assume_okta_role), \
+            patch.object(oa, 'store_aws_creds_in_profiles'):
+        results = oa.fetch_all_credentials({'hub': 'url-hub'}, 'session_id',
+                                           chained=oa.role_chains())
+    assert isinstance(results['hub'], exceptions.SAMLError)
+    for profile in ('app-one', 'app-two', 'app-three'):
+        assert isinstance(results[profile], exceptions.ProfileError)
+    sts_client.assume_role.assert_not_called()
+
+
+def test_fetch_all_source_session_rejected(oa, sts_client):
+    rejected = {'hub'}
+
+    def assume_okta_role(applinks, session_id, profile):
+        if profile in rejected:
+            raise exceptions.SessionError("Okta rejected the session")
+        return make_creds(profile), 3600
+
+    oa.saved_session = True
+    with patch.object(oa, 'assume_okta_role', side_effect=assume_okta_role), \
+            patch.object(oa, 'store_aws_creds_in_profiles'), \
+            patch.object(oa, 'renew_session', return_value='new_session'):
+        results = oa.fetch_all_credentials(
+            {'hub': 'url-hub', 'other': 'url-other'}, 'session_id',
+            chained=oa.role_chains())
+        # The chains are retried along with their source
+        assert sorted(p for p, e in results.items()
+                      if isinstance(e, exceptions.SessionError)) == \
+            ['app-one', 'app-three', 'app-two', 'hub']
+        rejected.clear()
+        results = oa.retry_rejected(
+            results, 'session_id', lambda session_id, profiles:
+            oa.fetch_profiles({'hub': 'url-hub'}, session_id, profiles))
+    assert results == dict.fromkeys(
+        ['hub', 'other', 'app-one', 'app-two', 'app-three'])
+
+
+def test_fetch_chained_profile_fetches_source_once(oa, sts_client):
+    applinks = {'hub': 'url-hub'}
+    calls = []
+    lock = threading.Lock()
+
+    def assume_okta_role(applinks, session_id, profile):
+        with lock:
+            calls.append(profile)
+        return make_creds(profile), 3600
+
+    with patch.object(oa, 'assume_okta_role', side_effect=assume_okta_role):
+        threads = [threading.Thread(target=oa.fetch_credentials, args=(
+            applinks, 'session_id', profile), kwargs={'store': False})
+                   for profile in ('app-one', 'app-two', 'app-three')]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    assert calls == ['hub']
+    assert sts_client.assume_role.call_count == 4
@@ -0,0 +1,93 @@
+# pylint: disable=invalid-name,missing-docstring
+import base64
+import xml.etree.ElementTree as ET
+from unittest.mock import patch
+
+import pytest
+
+from okta_aws import saml
+
+ROLE_VALUE = ('arn:aws:iam::012345678901:saml-provider/OKTA,'
+              'arn:aws:iam::012345678901:role/Okta_AdministratorAccess')
+
+
+def encode(xml):
+    return base64.b64encode(xml.encode()).decode()
+
+
+def read(shared_datadir, filename):
+    with open("%s/%s" % (shared_datadir, filename)) as fh:
+        return fh.read()
+
+
+def test_parse_assertion(shared_datadir):
+    info = saml.parse_assertion(read(shared_datadir, 'saml_assertion.txt'))
+    assert info.roles == (tuple(ROLE_VALUE.split(',')),)
+    assert info.session_duration == 43200
+    assert info.not_on_or_after == '2018-04-21T00:00:00.000Z'
+
+
+@pytest.mark.parametrize('chunk_size', [4, 64, 65536])
+def test_parse_assertion_many_roles(shared_datadir, chunk_size):
+    xml = read(shared_datadir, 'saml_assertion_decoded.txt')
+    value = ('<saml2:AttributeValue xmlns:xs="http://www.w3.org/2001/'
+             'XMLSchema" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"'
+             ' xsi:type="xs:string">%s</saml2:AttributeValue>')
+    roles = [('arn:aws:iam::%012d:saml-provider/OKTA' % i,
+              'arn:aws:iam::%012d:role/Okta_ReadOnly' % i)
+             for i in range(200)]
+    xml = xml.replace(value % ROLE_VALUE,
+                      '\n'.join(value % ','.join(r) for r in roles))
+    with patch.object(saml, 'CHUNK_SIZE', chunk_size):
+        info = saml.parse_assertion.__wrapped__(encode(xml))
+    assert info.roles == tuple(roles)
+    assert info.session_duration == 43200
+
+
+def test_parse_assertion_earliest_not_on_or_after():
+    xml = ('<r xmlns:saml2="urn:oasis:names:tc:SAML:2.0:assertion">'
+           '<a NotOnOrAfter="2018-04-21T01:00:00.000Z"/>'
+           '<b NotOnOrAfter="2018-04-21T00:30:00Z"/>'
+           '<saml2:AttributeStatement><saml2:Attribute '
+           'Name="https://aws.amazon.com/SAML/Attributes/Role">'
+           '<saml2:AttributeValue>p,r</saml2:AttributeValue>'
+           '</saml2:Attribute></saml2:AttributeStatement></r>')
+    info = saml.parse_assertion(encode(xml))
+    assert info.roles == (('p', 'r'),)
+    assert info.session_duration is None
+    assert info.not_on_or_after == '2018-04-21T00:30:00Z'
+
+
+def test_parse_assertion_stops_after_attributes():
+    # Anything after the attributes isn't looked at
+    xml = ('<r xmlns:saml2="urn:oasis:names:tc:SAML:2.0:assertion">'
+           '<saml2:AttributeStatement><saml2:Attribute '
+           'Name="https://aws.amazon.com/SAML/Attributes/Role">'
+           '<saml2:AttributeValue>p,r</saml2:AttributeValue>'
+           '</saml2:Attribute></saml2:AttributeStatement>'
+           '<unclosed><<<')
+    assert saml.parse_assertion(encode(xml)).roles == (('p', 'r'),)
+
+
+def test_parse_assertion_invalid_xml():
+    with pytest.raises(ET.ParseError):
+        saml.parse_assertion(encode('<r><unclosed></r>'))
+
+
+def test_parse_assertion_invalid_base64():
+    with pytest.raises(ValueError):
+        saml.parse_assertion('not base64!')
+
+
+def test_form_value(shared_datadir):
+    page = read(shared_datadir, 'saml_assertion_page.html')
+    assert saml.form_value(page, 'SAMLResponse') == \
+        'VGVzdGluZyAxLi4uMi4uLjMuLi4K'
+    assert saml.form_value(page, 'RelayState') == ''
+    assert saml.form_value(page, 'missing') is None
+
+
+def test_form_value_attribute_order():
+    page = ('<input type="hidden" value="a&#x2b;b" name="SAMLResponse"/>'
+            '<input name="Other" value="c"/>')
+    assert saml.form_value(page, 'SAMLResponse') == 'a+b'
@@ -0,0 +1,100 @@
+# pylint: disable=invalid-name,missing-docstring
+from unittest.mock import patch
+
+import pytest
+
+from okta_aws import config, exceptions, okta_aws
+
+APPLINKS = {
+    'company-dev': 'url-dev',
+    'company-prod': 'url-prod',
+    'payments-prod': 'url-payments-prod',
+    'payments-staging': 'url-payments-staging',
+    'search-prod-eu': 'url-search-prod-eu',
+}
+
+
+def make_oa(*argv):
+    oa = okta_aws.OktaAWS(list(argv))
+    oa.config = config.Config({
+        'general': {},
+        'aliases': {'pay': 'payments-prod'},
+        'groups': {
+            'prod': ['company-prod', 'payments-prod'],
+            'eu': ['re:.*-eu', 'pay'],
+        },
+    })
+    return oa
+
+
+def test_arguments():
+    oa = make_oa('--select', '*-prod', '-S', 're:x', '--group', 'prod')
+    assert oa.args.select == ['*-prod', 're:x']
+    assert oa.args.group == ['prod']
+
+
+def test_select_glob():
+    oa = make_oa('--select', '*-prod')
+    assert oa.select_profiles(list(APPLINKS)) == \
+        ['company-prod', 'payments-prod']
+
+
+def test_select_regex():
+    oa = make_oa('--select', 're:(company|search)-.*')
+    assert oa.select_profiles(list(APPLINKS)) == \
+        ['company-dev', 'company-prod', 'search-prod-eu']
+    # The whole name has to match
+    oa = make_oa('--select', 're:prod')
+    assert oa.select_profiles(list(APPLINKS)) == []
+
+
+def test_select_groups():
+    oa = make_oa('--group', 'prod', '--group', 'eu', '--select', '*-prod')
+    assert oa.select_profiles(list(APPLINKS)) == [
+        'company-prod', 'payments-prod', 'search-prod-eu']
+
+
+def test_select_alias_once():
+    oa = make_oa('--select', 'pay', '--select', '*-prod')
+    assert oa.select_profiles(list(APPLINKS)) == ['pay', 'company-prod']
+    oa = make_oa('--select', 'payments-prod', '--select', 'pay')
+    assert oa.select_profiles(list(APPLINKS)) == ['payments-prod']
+
+
+def test_unknown_group():
+    oa = make_oa('--group', 'missing')
+    with pytest.raises(exceptions.ConfigError, match="no group called"):
+        oa.selection_patterns()
+
+
+def test_invalid_regex():
+    oa = make_oa('--select', 're:(')
+    with pytest.raises(exceptions.ConfigError, match="Invalid regular"):
+        oa.selection_patterns()
+
+
+def test_fetch_selected_credentials():
+    oa = make_oa('--select', 'pay', '--select', '*-prod', '--select',
+                 'missing')
+    fetched = {}
+
+    def fake_fetch(applinks, session_id, profile, store, **kwargs):
+        # pylint: disable=unused-argument
+        assert not store
+        fetched[profile] = applinks
+        return {'AccessKeyId': profile}
+
+    with patch.object(oa, 'fetch_credentials', side_effect=fake_fetch), \
+            patch.object(oa, 'store_aws_creds_in_profiles') as patched_store:
+        results = oa.fetch_selected_credentials(APPLINKS, 'session_id')
+
+    assert fetched == {
+        # Aliases are stored under the alias, and the account isn't fetched
+        # again for its own name
+        'pay': {'payments-prod': 'url-payments-prod'},
+        'company-prod': {'company-prod': 'url-prod'},
+    }
+    patched_store.assert_called_once()
+    assert sorted(patched_store.call_args[0][0]) == ['company-prod', 'pay']
+    assert isinstance(results.pop('missing'), exceptions.ProfileError)
+    assert results == dict.fromkeys(['company-prod', 'pay'])
@@ -0,0 +1,157 @@
+# pylint: disable=invalid-name,missing-docstring
+import datetime
+import json
+import threading
+import urllib.error
+import urllib.request
+from unittest.mock import patch
+
+import pytest
+
+from okta_aws import config, exceptions, okta_aws, server
+
+
+def make_creds(lifetime):
+    return {
+        'AccessKeyId': 'ASIAABCDEFG123456789',
+        'SecretAccessKey': 'secret',
+        'SessionToken': 'token',
+        'Expiration': datetime.datetime.now(datetime.timezone.utc) +
+        datetime.timedelta(seconds=lifetime),
+    }
+
+
+class FakeSTS(object):
+    def __init__(self, lifetime=3600):
+        self.lifetime = lifetime
+        self.calls = []
+
+    def fetch(self, profile):
+        if profile == 'unknown':
+            raise exceptions.ProfileError(
+                "unknown isn't a valid profile name")
+        self.calls.append(profile)
+        return make_creds(self.lifetime)
+
+
+@pytest.fixture
+def running_server():
+    sts = FakeSTS()
+    httpd = server.CredentialServer(
+        ('127.0.0.1', 0), server.CredentialStore(sts.fetch), 'sekrit')
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield sts, "http://127.0.0.1:%d" % httpd.server_address[1]
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def get(url, token='sekrit'):
+    request = urllib.request.Request(url, headers={'Authorization': token})
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read())
+
+
+def test_store_caches_credentials():
+    sts = FakeSTS()
+    store = server.CredentialStore(sts.fetch)
+    assert store.get('dev') is store.get('dev')
+    assert sts.calls == ['dev']
+
+
+def test_store_refreshes_expiring_credentials():
+    sts = FakeSTS(lifetime=60)
+    store = server.CredentialStore(sts.fetch, min_lifetime=300)
+    store.get('dev')
+    store.get('dev')
+    assert sts.calls == ['dev', 'dev']
+
+
+def test_serve_credentials(running_server):
+    sts, url = running_server
+    creds = get(url + "/creds/dev")
+    assert creds['AccessKeyId'] == 'ASIAABCDEFG123456789'
+    assert creds['Token'] == 'token'
+    assert 'Expiration' in creds
+    get(url + "/creds/dev")
+    assert sts.calls == ['dev']
+
+
+def test_serve_requires_token(running_server):
+    _, url = running_server
+    with pytest.raises(urllib.error.HTTPError) as e:
+        get(url + "/creds/dev", token='wrong')
+    assert e.value.code == 401
+
+
+def test_serve_unknown_profile(running_server):
+    _, url = running_server
+    with pytest.raises(urllib.error.HTTPError) as e:
+        get(url + "/creds/unknown")
+    assert e.value.code == 404
+
+
+def test_serve_parses_profile_from_path(running_server):
+    sts, url = running_server
+    get(url + "/creds/my%2Dprofile?foo=1")
+    assert sts.calls == ['my-profile']
+
+
+@pytest.mark.parametrize('path', ['/creds/', '/creds/dev/extra',
+                                  '/creds/a%2Fb'])
+def test_serve_invalid_profile_name(running_server, path):
+    sts, url = running_server
+    with pytest.raises(urllib.error.HTTPError) as e:
+        get(url + path)
+    assert e.value.code == 404
+    assert sts.calls == []
+
+
+def serve(oa, session_id='sid123'):
+    # Returns the CredentialStore oa.serve() would serve
+    with patch.object(server, 'CredentialServer') as patched:
+        patched.return_value.server_address = ('127.0.0.1', 9876)
+        oa.serve({'dev': 'url-dev'}, session_id)
+    return patched.call_args[0][1]
+
+
+def test_serve_keeps_secrets_in_memory(tmp_path, shared_datadir, capsys):
+    oa = okta_aws.OktaAWS(['--serve', 'dev'])
+    oa.config = config.Config({'general': {'cache_dir': str(tmp_path),
+                                           'username': 'jdoe',
+                                           'session_duration': 3600}})
+    with open("%s/saml_assertion.txt" % shared_datadir) as fh:
+        assertion = fh.read()
+    expires = (datetime.datetime.now(datetime.timezone.utc) +
+               datetime.timedelta(minutes=5)).isoformat()
+    with patch.object(oa, 'get_saml_assertion', return_value=assertion), \
+            patch.object(oa, 'saml_expiry', return_value=expires), \
+            patch.object(oa, 'assume_role',
+                         return_value=(make_creds(3600), 3600)):
+        creds = serve(oa).get('dev')
+    capsys.readouterr()
+    assert creds['SecretAccessKey'] == 'secret'
+    assert not (tmp_path / "credentials.json").exists()
+    assert not (tmp_path / "saml.json").exists()
+
+
+def test_serve_renews_session():
+    oa = okta_aws.OktaAWS(['--serve', 'dev'])
+    used = []
+
+    def fetch_credentials(applinks, session_id, profile, **kwargs):
+        # pylint: disable=unused-argument
+        used.append(session_id)
+        if session_id == 'sid123':
+            raise exceptions.SessionError("Okta rejected the session")
+        return make_creds(3600)
+
+    with patch.object(oa, 'fetch_credentials',
+                      side_effect=fetch_credentials), \
+            patch.object(oa, 'renew_session',
+                         return_value='sid456') as patched_renew:
+        store = serve(oa)
+        store.get('dev')
+        store.get('prod')
+    patched_renew.assert_called_once_with('sid123')
+    assert used == ['sid123', 'sid456', 'sid456']
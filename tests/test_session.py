@@ -0,0 +1,266 @@
+# pylint: disable=invalid-name,missing-docstring
+import datetime
+import json
+import os
+import stat
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from okta_aws import exceptions, okta_aws, session
+
+REFRESH_URL = \
+    'https://example.okta.com/api/v1/sessions/me/lifecycle/refresh'
+
+
+def timestamp(seconds):
+    when = datetime.datetime.now(datetime.timezone.utc) + \
+        datetime.timedelta(seconds=seconds)
+    return when.strftime('%Y-%m-%dT%H:%M:%S.000Z')
+
+
+def response(body, status_code=200):
+    r = MagicMock()
+    r.status_code = status_code
+    r.json.return_value = body
+    r.text = json.dumps(body)
+    r.__enter__.return_value = r
+    return r
+
+
+@pytest.fixture
+def store(tmp_path):
+    return session.SessionStore(str(tmp_path / "cookies"))
+
+
+@pytest.fixture
+def oa(oa, store, set_config):
+    set_config(oa, 'general', okta_server='example.okta.com')
+    set_config(oa, 'general', cookie_file=store.cookie_file)
+    set_config(oa, 'general', session_refresh_threshold=900)
+    return oa
+
+
+def test_store_save_and_load(store):
+    assert store.load() is None
+    store.save('sid123', '2018-04-21T00:00:00.000Z')
+    assert store.load() == 'sid123'
+    assert store.expires_at('sid123') == '2018-04-21T00:00:00.000Z'
+    assert stat.S_IMODE(os.stat(store.cookie_file).st_mode) == 0o600
+    assert stat.S_IMODE(os.stat(store.expiry_file).st_mode) == 0o600
+    with open(store.expiry_file) as fh:
+        assert 'sid123' not in fh.read()
+
+
+def test_store_expiry_belongs_to_session(store):
+    store.save('sid123', '2018-04-21T00:00:00.000Z')
+    # Replaced by something that doesn't know about the expiry file
+    with open(store.cookie_file, 'w') as fh:
+        fh.write('sid456')
+    assert store.expires_at(store.load()) is None
+
+
+def test_store_save_without_expiry(store):
+    store.save('sid123', '2018-04-21T00:00:00.000Z')
+    store.save('sid456')
+    assert store.expires_at('sid456') is None
+    assert not os.path.exists(store.expiry_file)
+
+
+def test_store_old_cookie_format(store):
+    with open(store.cookie_file, 'w') as fh:
+        fh.write('#LWP-Cookies-2.0\nSet-Cookie3: sid="sid123"; path="/"\n')
+    assert store.load() == 'sid123'
+
+
+def test_valid_session_not_checked(oa, store):
+    store.save('sid123', timestamp(3600))
+    with patch("requests.Session.request") as patched:
+        assert oa.load_session_id() == 'sid123'
+    patched.assert_not_called()
+
+
+def test_session_near_expiry_refreshed(oa, store):
+    store.save('sid123', timestamp(600))
+    expires_at = timestamp(7200)
+    with patch("requests.Session.post",
+               return_value=response({'id': 'sid123',
+                                      'expiresAt': expires_at})) as patched:
+        assert oa.load_session_id() == 'sid123'
+    assert patched.call_args[0][0] == REFRESH_URL
+    assert patched.call_args[1]['cookies'] == {'sid': 'sid123'}
+    assert store.expires_at('sid123') == expires_at
+
+
+def test_session_without_expiry_refreshed(oa, store):
+    with open(store.cookie_file, 'w') as fh:
+        fh.write('sid123')
+    expires_at = timestamp(7200)
+    with patch("requests.Session.post",
+               return_value=response({'id': 'sid123',
+                                      'expiresAt': expires_at})):
+        assert oa.load_session_id() == 'sid123'
+    assert store.expires_at('sid123') == expires_at
+
+
+def test_expired_session(oa, store):
+    store.save('sid123', timestamp(60))
+    with patch("requests.Session.post",
+               return_value=response({'errorCode': 'E0000007'}, 404)):
+        assert oa.load_session_id() is None
+    assert store.expires_at('sid123') is None
+
+
+def test_rejected_session_forgets_expiry(oa, store):
+    store.save('sid123', timestamp(3600))
+    with patch("requests.Session.get",
+               return_value=response({'errorCode': 'E0000006'}, 403)):
+        with pytest.raises(exceptions.SessionError):
+            list(oa.iter_assigned_applications('sid123'))
+    assert store.expires_at('sid123') is None
+
+
+def test_log_in_saves_expiry(oa, store):
+    expires_at = timestamp(7200)
+    with patch.object(oa, 'log_in_to_okta', return_value='token'), \
+            patch('getpass.getpass', return_value='password'), \
+            patch("requests.Session.post",
+                  return_value=response({'id': 'sid123',
+                                         'expiresAt': expires_at})):
+        assert oa.log_in() == 'sid123'
+    assert store.load() == 'sid123'
+    assert store.expires_at('sid123') == expires_at
+
+
+def test_revoked_session_refreshed(oa, store):
+    store.save('sid123', timestamp(3600))
+    calls = []
+
+    def action(session_id):
+        calls.append(session_id)
+        if len(calls) == 1:
+            raise exceptions.SessionError("Okta rejected the session")
+        return 'applinks'
+
+    with patch.object(oa, 'refresh_session', return_value=True), \
+            patch.object(oa, 'log_in') as patched_log_in:
+        assert oa.with_okta_session(action) == 'applinks'
+    assert calls == ['sid123', 'sid123']
+    patched_log_in.assert_not_called()
+
+
+def test_revoked_session_logs_in(oa, store):
+    store.save('sid123', timestamp(3600))
+
+    def action(session_id):
+        if session_id == 'sid123':
+            raise exceptions.SessionError("Okta rejected the session")
+        return session_id
+
+    with patch.object(oa, 'refresh_session', return_value=False), \
+            patch.object(oa, 'log_in', return_value='sid456'):
+        assert oa.with_okta_session(action) == 'sid456'
+
+
+def test_revoked_session_not_interactive(oa, store):
+    store.save('sid123', timestamp(3600))
+    oa.interactive = False
+
+    def action(session_id):
+        raise exceptions.SessionError("Okta rejected the session")
+
+    with patch.object(oa, 'refresh_session', return_value=False), \
+            pytest.raises(exceptions.LoginError, match="Not logged in"):
+        oa.with_okta_session(action)
+
+
+def test_new_session_not_renewed(oa):
+    oa.args.no_cookies = True
+    calls = []
+
+    def action(session_id):
+        calls.append(session_id)
+        raise exceptions.SessionError("Okta rejected the session")
+
+    with patch.object(oa, 'log_in', return_value='sid456'), \
+            patch.object(oa, 'refresh_session') as patched_refresh, \
+            pytest.raises(exceptions.SessionError):
+        oa.with_okta_session(action)
+    assert calls == ['sid456']
+    patched_refresh.assert_not_called()
+
+
+@pytest.mark.parametrize('status_code,text', [
+    (200, '<html>Sign in</html>'), (403, '')])
+def test_saml_refused_session_rejected(oa, status_code, text):
+    with patch("requests.Session.post",
+               return_value=response({}, status_code)) as patched, \
+            patch.object(oa, 'refresh_session', return_value=False):
+        patched.return_value.text = text
+        with pytest.raises(exceptions.SessionError):
+            oa.get_saml_assertion('sid123', 'https://example.okta.com/app')
+
+
+def test_saml_refused_session_valid(oa):
+    # e.g. a sign on policy for the application asking for another factor
+    with patch("requests.Session.post",
+               return_value=response({}, 200)) as patched, \
+            patch.object(oa, 'refresh_session', return_value=True):
+        patched.return_value.text = '<html>Verify it is you</html>'
+        with pytest.raises(exceptions.SAMLError) as excinfo:
+            oa.get_saml_assertion('sid123', 'https://example.okta.com/app')
+    assert not isinstance(excinfo.value, exceptions.SessionError)
+
+
+def test_only_rejected_profiles_retried(capsys):
+    oa = okta_aws.OktaAWS(['--all'])
+    oa.saved_session = True
+    fetched = []
+
+    def fake_fetch(applinks, session_id, profile, store, **kwargs):
+        # pylint: disable=unused-argument
+        fetched.append((profile, session_id))
+        if profile == 'b' and session_id == 'sid123':
+            raise exceptions.SessionError("Okta rejected the session")
+        if profile == 'c':
+            raise exceptions.SAMLError("Okta didn't return a SAML assertion")
+        return {'AccessKeyId': profile}
+
+    with patch.object(oa, 'iter_applinks',
+                      return_value=iter([('a', 'url-a'), ('b', 'url-b'),
+                                         ('c', 'url-c')])), \
+            patch.object(oa, 'fetch_credentials', side_effect=fake_fetch), \
+            patch.object(oa, 'store_aws_creds_in_profiles'), \
+            patch.object(oa, 'refresh_session', return_value=False), \
+            patch.object(oa, 'log_in', return_value='sid456'), \
+            pytest.raises(SystemExit) as excinfo:
+        oa.run_with_session('sid123')
+    assert excinfo.value.code == 1
+    assert sorted(fetched) == [('a', 'sid123'), ('b', 'sid123'),
+                               ('b', 'sid456'), ('c', 'sid123')]
+    out = capsys.readouterr().out
+    assert "Fetched credentials for 2 of 3 profiles" in out
+    assert "FAILED  c: Okta didn't return a SAML assertion" in out
+
+
+def test_rejected_profiles_reported(capsys):
+    oa = okta_aws.OktaAWS(['--all'])
+
+    def fake_fetch(applinks, session_id, profile, store, **kwargs):
+        # pylint: disable=unused-argument
+        if profile == 'b':
+            raise exceptions.SessionError("Okta rejected the session")
+        return {'AccessKeyId': profile}
+
+    # A session from this run isn't renewed, but the others still succeed
+    with patch.object(oa, 'iter_applinks',
+                      return_value=iter([('a', 'url-a'), ('b', 'url-b')])), \
+            patch.object(oa, 'fetch_credentials', side_effect=fake_fetch), \
+            patch.object(oa, 'store_aws_creds_in_profiles'), \
+            patch.object(oa, 'log_in') as patched_log_in, \
+            pytest.raises(SystemExit):
+        oa.run_with_session('sid123')
+    patched_log_in.assert_not_called()
+    out = capsys.readouterr().out
+    assert "OK      a" in out
+    assert "FAILED  b: Okta rejected the session" in out
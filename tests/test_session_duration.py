@@ -0,0 +1,125 @@
+# pylint: disable=invalid-name,missing-docstring
+import base64
+from unittest.mock import patch
+
+import botocore.exceptions
+import pytest
+
+from okta_aws import cache, exceptions
+
+ROLE = 'arn:aws:iam::012345678901:role/Okta_AdministratorAccess'
+PRINCIPAL = 'arn:aws:iam::012345678901:saml-provider/OKTA'
+
+
+@pytest.fixture
+def assertion(shared_datadir):
+    # The test assertion allows sessions of 43200 seconds
+    with open("%s/saml_assertion.txt" % shared_datadir) as fh:
+        return fh.read()
+
+
+@pytest.fixture
+def oa(oa, tmp_path, set_config):
+    set_config(oa, 'general', cache_dir=str(tmp_path))
+    set_config(oa, 'general', session_duration='auto')
+    return oa
+
+
+def without_session_duration(assertion):
+    xml = base64.b64decode(assertion).decode()
+    xml = xml.replace('SAML/Attributes/SessionDuration',
+                      'SAML/Attributes/Other')
+    return base64.b64encode(xml.encode()).decode()
+
+
+def duration_error():
+    return botocore.exceptions.ClientError({'Error': {
+        'Code': 'ValidationError',
+        'Message': 'The requested DurationSeconds exceeds the '
+                   'MaxSessionDuration set for this role.'}},
+                                           'AssumeRoleWithSAML')
+
+
+def test_auto_uses_okta_session_duration(oa, assertion):
+    assert oa.session_duration(assertion, ROLE) == 43200
+
+
+def test_auto_defaults_to_an_hour(oa, assertion):
+    assert oa.session_duration(without_session_duration(assertion),
+                               ROLE) == 3600
+
+
+def test_configured_duration_capped_by_okta(oa, assertion, set_config):
+    set_config(oa, 'general', session_duration=86400)
+    assert oa.session_duration(assertion, ROLE) == 43200
+    set_config(oa, 'general', session_duration=7200)
+    assert oa.session_duration(assertion, ROLE) == 7200
+
+
+def test_duration_capped_by_learned_role_max(oa, assertion):
+    oa.duration_cache.put(ROLE, 14400)
+    assert oa.session_duration(assertion, ROLE) == 14400
+    assert oa.session_duration(assertion, ROLE + 'Other') == 43200
+
+
+def test_role_duration_cache_expires(tmp_path):
+    dc = cache.RoleDurationCache(str(tmp_path / "durations.json"), ttl=60)
+    dc.put(ROLE, 7200)
+    assert dc.get(ROLE) == 7200
+    with patch('time.time', return_value=dc.store.get(ROLE)['learned_at'] +
+               61):
+        assert dc.get(ROLE) is None
+
+
+@patch('okta_aws.sts.get_client')
+def test_aws_assume_role_duration_error(patched_client, oa):
+    patched_client.return_value.assume_role_with_saml.side_effect = \
+        duration_error()
+    with pytest.raises(exceptions.DurationError):
+        oa.aws_assume_role(PRINCIPAL, ROLE, 'assertion', 43200)
+
+
+def test_assume_role_falls_back_to_shorter_durations(oa):
+    def assume(principal_arn, role_arn, assertion, duration, profile=None):
+        # pylint: disable=unused-argument
+        if duration > 7200:
+            raise exceptions.DurationError("too long")
+        return {'AccessKeyId': 'ASIA'}
+
+    with patch.object(oa, 'aws_assume_role', side_effect=assume) as patched:
+        creds, duration = oa.assume_role(PRINCIPAL, ROLE, 'assertion', 43200)
+    assert creds == {'AccessKeyId': 'ASIA'}
+    assert duration == 7200
+    assert [c[0][3] for c in patched.call_args_list] == \
+        [43200, 28800, 21600, 14400, 10800, 7200]
+    # Next time we go straight to what worked
+    assert oa.duration_cache.get(ROLE) == 7200
+
+
+def test_assume_role_gives_up_at_an_hour(oa):
+    with patch.object(oa, 'aws_assume_role',
+                      side_effect=exceptions.DurationError("too long")):
+        with pytest.raises(exceptions.DurationError):
+            oa.assume_role(PRINCIPAL, ROLE, 'assertion', 3600)
+
+
+def test_assume_role_other_errors_not_retried(oa):
+    with patch.object(oa, 'aws_assume_role',
+                      side_effect=exceptions.AssumeRoleError("denied")) as \
+            patched:
+        with pytest.raises(exceptions.AssumeRoleError):
+            oa.assume_role(PRINCIPAL, ROLE, 'assertion', 43200)
+    assert patched.call_count == 1
+
+
+def test_duration_not_remembered_until_accepted(oa):
+    def assume(principal_arn, role_arn, assertion, duration, profile=None):
+        # pylint: disable=unused-argument
+        if duration > 7200:
+            raise exceptions.DurationError("too long")
+        raise exceptions.AssumeRoleError("denied")
+
+    with patch.object(oa, 'aws_assume_role', side_effect=assume):
+        with pytest.raises(exceptions.AssumeRoleError, match="denied"):
+            oa.assume_role(PRINCIPAL, ROLE, 'assertion', 43200)
+    assert oa.duration_cache.get(ROLE) is None
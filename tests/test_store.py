@@ -0,0 +1,266 @@
+# pylint: disable=invalid-name,missing-docstring
+import os
+import stat
+import sys
+import threading
+from unittest.mock import patch
+
+import pytest
+
+from okta_aws import config, exceptions, okta_aws, session, store
+
+
+@pytest.fixture
+def memory_keyring():
+    keyring = pytest.importorskip('keyring')
+    from keyring.backend import KeyringBackend
+
+    class MemoryKeyring(KeyringBackend):
+        priority = 1
+
+        def __init__(self):
+            super().__init__()
+            self.passwords = {}
+
+        def get_password(self, service, username):
+            return self.passwords.get((service, username))
+
+        def set_password(self, service, username, password):
+            self.passwords[(service, username)] = password
+
+        def delete_password(self, service, username):
+            del self.passwords[(service, username)]
+
+    original = keyring.get_keyring()
+    backend = MemoryKeyring()
+    keyring.set_keyring(backend)
+    store._keys.clear()
+    yield backend
+    keyring.set_keyring(original)
+    store._keys.clear()
+
+
+@pytest.fixture
+def encrypted_store(tmp_path):
+    pytest.importorskip('cryptography')
+    store._keys.clear()
+    yield store.EncryptedFileStore(str(tmp_path / "creds.enc"),
+                                   str(tmp_path / "cache.key"),
+                                   use_keyring=False)
+    store._keys.clear()
+
+
+def test_file_store(tmp_path):
+    s = store.FileStore(str(tmp_path / "cache" / "creds.json"))
+    assert s.get('dev') is None
+    s.set('dev', {'AccessKeyId': 'ASIA1'})
+    s.update({'prod': 1, 'test': 2})
+    s.delete('test')
+    assert s.load() == {'dev': {'AccessKeyId': 'ASIA1'}, 'prod': 1}
+    assert stat.S_IMODE(os.stat(s.path).st_mode) == 0o600
+
+
+def test_expired_entries_dropped(tmp_path):
+    s = store.FileStore(str(tmp_path / "creds.json"))
+    with patch('time.time', return_value=1000):
+        s.set('short', 1, ttl=60)
+        s.set('forever', 2)
+    with patch('time.time', return_value=1059):
+        assert s.get('short') == 1
+    with patch('time.time', return_value=1061):
+        assert s.get('short') is None
+        s.set('other', 3)
+    assert s.entries().keys() == {'forever', 'other'}
+
+
+def test_least_recently_used_evicted(tmp_path):
+    s = store.FileStore(str(tmp_path / "creds.json"), max_entries=2)
+    for when, key in enumerate(['a', 'b']):
+        with patch('time.time', return_value=1000 + when):
+            s.set(key, key)
+    # Reading 'a' makes 'b' the least recently used
+    with patch('time.time', return_value=1010):
+        assert s.get('a') == 'a'
+    with patch('time.time', return_value=1020):
+        s.set('c', 'c')
+    assert s.load() == {'a': 'a', 'c': 'c'}
+
+
+def test_unreadable_store_is_empty(tmp_path):
+    path = tmp_path / "creds.json"
+    path.write_text('{"dev": {"AccessKeyId": "old format"}, "x": [1, 2, 3]')
+    s = store.FileStore(str(path))
+    assert s.load() == {}
+    s.set('dev', 1)
+    assert s.load() == {'dev': 1}
+
+
+def test_concurrent_updates(tmp_path):
+    s = store.FileStore(str(tmp_path / "creds.json"))
+    threads = [threading.Thread(target=store.FileStore(s.path).set,
+                                args=('key%d' % i, i)) for i in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert s.load() == {'key%d' % i: i for i in range(20)}
+
+
+def test_encrypted_store(encrypted_store):
+    encrypted_store.set('dev', {'SecretAccessKey': 'very-secret'}, ttl=60)
+    assert encrypted_store.get('dev') == {'SecretAccessKey': 'very-secret'}
+    with open(encrypted_store.path, 'rb') as fh:
+        data = fh.read()
+    assert data.startswith(store.MAGIC)
+    assert b'very-secret' not in data
+    for path in (encrypted_store.path, encrypted_store.key_file):
+        assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+
+
+def test_encrypted_store_other_key(encrypted_store):
+    encrypted_store.set('dev', 1)
+    store._keys.clear()
+    os.remove(encrypted_store.key_file)
+    other = store.EncryptedFileStore(encrypted_store.path,
+                                     encrypted_store.key_file,
+                                     use_keyring=False)
+    assert other.load() == {}
+
+
+def test_encryption_key_in_keyring(tmp_path, memory_keyring):
+    pytest.importorskip('cryptography')
+    key_file = str(tmp_path / "cache.key")
+    key = store.encryption_key(key_file)
+    assert len(key) == store.KEY_SIZE
+    assert (store.KEYRING_SERVICE, store.KEYRING_KEY_NAME) in \
+        memory_keyring.passwords
+    assert not os.path.exists(key_file)
+    store._keys.clear()
+    assert store.encryption_key(key_file) == key
+
+
+def test_keyring_store(tmp_path, memory_keyring):
+    s = store.KeyringStore('credentials', str(tmp_path / "creds.keyring"))
+    s.set('dev', {'SecretAccessKey': 'very-secret'})
+    assert store.KeyringStore('credentials', s.lock_path).get('dev') == \
+        {'SecretAccessKey': 'very-secret'}
+    assert 'very-secret' not in \
+        memory_keyring.passwords[(store.KEYRING_SERVICE, 'credentials')]
+
+
+def test_keyring_write_failure_logged(tmp_path, memory_keyring, caplog):
+    import keyring.errors
+
+    def set_password(service, username, password):
+        # e.g. the Windows credential locker's size limit
+        raise keyring.errors.PasswordSetError("too big")
+
+    s = store.KeyringStore('session', str(tmp_path / "session.keyring"))
+    with patch.object(memory_keyring, 'set_password',
+                      side_effect=set_password):
+        s.set('dev', 1)
+    assert s.get('dev') is None
+    assert "Unable to save to keyring entry session: too big" in caplog.text
+
+
+def test_open_keyring_store(tmp_path, memory_keyring):
+    pytest.importorskip('cryptography')
+    session_store = store.open_store('keyring', str(tmp_path), 'session')
+    assert isinstance(session_store, store.KeyringStore)
+    # Bulky caches are encrypted files, with the key in the keyring
+    creds = store.open_store('keyring', str(tmp_path), 'credentials')
+    assert isinstance(creds, store.EncryptedFileStore)
+    assert creds.path == str(tmp_path / "credentials.enc")
+    creds.set('dev', {'SecretAccessKey': 'very-secret'})
+    assert creds.get('dev') == {'SecretAccessKey': 'very-secret'}
+    assert set(memory_keyring.passwords) == {
+        (store.KEYRING_SERVICE, store.KEYRING_KEY_NAME)}
+
+
+def test_open_store(tmp_path):
+    s = store.open_store('file', str(tmp_path), 'credentials')
+    assert s.path == str(tmp_path / "credentials.json")
+    with pytest.raises(exceptions.ConfigError, match="should be one of"):
+        store.open_store('plaintext', str(tmp_path), 'credentials')
+
+
+def test_missing_package(tmp_path):
+    with patch.dict(sys.modules, {
+            'cryptography.hazmat.primitives.ciphers.aead': None}):
+        with pytest.raises(exceptions.ConfigError,
+                           match="pip install cryptography"):
+            store.open_store('encrypted', str(tmp_path), 'credentials')
+    with patch.dict(sys.modules, {'keyring': None}):
+        with pytest.raises(exceptions.ConfigError,
+                           match="pip install keyring"):
+            store.open_store('keyring', str(tmp_path), 'credentials')
+
+
+def test_session_in_store(tmp_path):
+    cookie_file = tmp_path / "cookie"
+    cookie_file.write_text('sid123')
+    s = store.FileStore(str(tmp_path / "session.json"))
+    ss = session.SessionStore(str(cookie_file), s)
+    # A session saved before the store was used is picked up
+    assert ss.load() == 'sid123'
+    assert ss.expires_at('sid123') is None
+    ss.save('sid456', '2099-01-01T00:00:00.000Z')
+    assert not cookie_file.exists()
+    assert ss.load() == 'sid456'
+    assert ss.expires_at('sid456') == '2099-01-01T00:00:00.000Z'
+    assert ss.expires_at('sid123') is None
+    ss.forget_expiry()
+    assert ss.load() == 'sid456'
+    assert ss.expires_at('sid456') is None
+
+
+def test_caches_use_cache_store(tmp_path, encrypted_store, set_config):
+    oa = okta_aws.OktaAWS([])
+    oa.config = config.Config({
+        'general': {'cache_dir': str(tmp_path),
+                    'cache_store': 'encrypted',
+                    'cookie_file': str(tmp_path / "cookie")}})
+    assert isinstance(oa.credential_cache.store, store.EncryptedFileStore)
+    assert oa.credential_cache.store is oa.cache_store('credentials')
+    assert isinstance(oa.applinks_cache, store.EncryptedFileStore)
+    assert oa.session_store.store is oa.cache_store('session')
+    set_config(oa, 'general', cache_store='file')
+    assert oa.session_store.store is None
+
+
+def test_reads_while_updating(tmp_path):
+    s = store.FileStore(str(tmp_path / "creds.json"))
+    s.update({'key%d' % i: i for i in range(50)})
+    errors = []
+
+    def read():
+        try:
+            for _ in range(20):
+                for i in range(50):
+                    s.get('key%d' % i)
+        except Exception as e:  # pylint: disable=broad-except
+            errors.append(e)
+
+    threads = [threading.Thread(target=read) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for i in range(20):
+        s.set('new%d' % i, i)
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert len(s.load()) == 70
+
+
+def test_one_store_per_cache(tmp_path):
+    oa = okta_aws.OktaAWS([])
+    oa.config = config.Config({'general': {'cache_dir': str(tmp_path)}})
+    stores = []
+    threads = [threading.Thread(
+        target=lambda: stores.append(oa.cache_store('credentials')))
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert all(s is stores[0] for s in stores)
@@ -0,0 +1,80 @@
+# pylint: disable=invalid-name,missing-docstring
+import botocore.exceptions
+
+from okta_aws import sts
+
+
+def test_get_client_is_cached(monkeypatch):
+    # A profile that doesn't exist mustn't stop us creating a client
+    monkeypatch.setenv('AWS_PROFILE', 'does-not-exist')
+    sts.clear_clients()
+    client = sts.get_client('us-east-1')
+    assert sts.get_client('us-east-1') is client
+    assert sts.get_client('eu-west-1') is not client
+    assert client.meta.region_name == 'us-east-1'
+    sts.clear_clients()
+    assert sts.get_client('us-east-1') is not client
+
+
+def test_signed_clients_cached_per_access_key(monkeypatch):
+    monkeypatch.setattr(sts, 'MAX_SIGNED_CLIENTS', 2)
+    sts.clear_clients()
+
+    def creds(name):
+        return {'AccessKeyId': name, 'SecretAccessKey': 'secret',
+                'SessionToken': 'token'}
+
+    unsigned = sts.get_client('us-east-1')
+    hub = sts.get_client('us-east-1', creds('hub'))
+    assert hub is not unsigned
+    assert sts.get_client('us-east-1', creds('hub')) is hub
+    assert sts.get_client('us-east-1', creds('other')) is not hub
+    # The oldest signed client is forgotten, but not the unsigned one
+    sts.get_client('us-east-1', creds('third'))
+    assert sts.get_client('us-east-1', creds('hub')) is not hub
+    assert sts.get_client('us-east-1') is unsigned
+    sts.clear_clients()
+
+
+def test_regional_endpoints(monkeypatch):
+    # Regions don't share the global endpoint, even if the environment asks
+    # for it
+    monkeypatch.setenv('AWS_STS_REGIONAL_ENDPOINTS', 'legacy')
+    monkeypatch.setattr(sts, '_session', None)
+    sts.clear_clients()
+    for region_name in sts.PARTITION_REGIONS['aws']:
+        assert sts.get_client(region_name).meta.endpoint_url == \
+            'https://sts.%s.amazonaws.com' % region_name
+    sts.clear_clients()
+
+
+def test_partitions():
+    assert sts.arn_partition(
+        'arn:aws-us-gov:iam::012345678901:saml-provider/OKTA') == 'aws-us-gov'
+    assert sts.arn_partition('arn:aws:iam::012345678901:role/x') == 'aws'
+    assert sts.arn_partition('Okta_ReadOnly') is None
+    assert sts.region_partition('cn-northwest-1') == 'aws-cn'
+    assert sts.region_partition('eu-west-1') == 'aws'
+
+
+def test_regions():
+    assert sts.regions('aws', ['eu-west-1', 'us-gov-west-1']) == \
+        ['eu-west-1', 'us-east-1', 'us-west-2']
+    assert sts.regions('aws-us-gov', ['us-gov-east-1']) == \
+        ['us-gov-east-1', 'us-gov-west-1']
+
+
+def test_should_fall_back():
+    def client_error(status):
+        return botocore.exceptions.ClientError({
+            'Error': {'Code': 'Error'},
+            'ResponseMetadata': {'HTTPStatusCode': status}}, 'AssumeRole')
+
+    assert sts.should_fall_back(client_error(500))
+    assert not sts.should_fall_back(client_error(400))
+    assert sts.should_fall_back(
+        botocore.exceptions.ReadTimeoutError(endpoint_url='https://sts'))
+    assert sts.should_fall_back(
+        botocore.exceptions.EndpointConnectionError(
+            endpoint_url='https://sts'))
+    assert not sts.should_fall_back(ValueError())